@@ -0,0 +1,160 @@
+import os
+import functools
+from collections import namedtuple
+
+from rate_equation.transition_profile import TransitionProfile, State, TransitionGroupLabel, Transition
+from rate_equation.wigner import hyperfine_strengths
+
+# Constants of alkali D lines (Steck, Alkali D Line Data).
+#   frequency: Hz, center of gravity of the line
+#   gamma: natural linewidth in Hz, w/o 2 \pi
+#   a_*, b_*: magnetic dipole / electric quadrupole hyperfine constants in Hz
+#   g_j_*: fine-structure Lande g factors
+AtomicLine = namedtuple("AtomicLine", ["nuclear_spin", "j_ground", "j_excited", "frequency", "gamma",
+                                       "a_ground", "a_excited", "b_excited", "g_j_ground", "g_j_excited"])
+
+LINES = {
+    "87Rb D1": AtomicLine(3/2, 1/2, 1/2, 377.107463380e12, 5.7500e6,
+                          3417.341305452e6, 406.147e6, 0, 2.00233113, 0.666),
+    "87Rb D2": AtomicLine(3/2, 1/2, 3/2, 384.2304844685e12, 6.0666e6,
+                          3417.341305452e6, 84.7185e6, 12.4965e6, 2.00233113, 1.3362),
+    "85Rb D1": AtomicLine(5/2, 1/2, 1/2, 377.107385690e12, 5.7500e6,
+                          1011.910813e6, 120.527e6, 0, 2.00233113, 0.666),
+    "85Rb D2": AtomicLine(5/2, 1/2, 3/2, 384.230406373e12, 6.0666e6,
+                          1011.910813e6, 25.0020e6, 25.790e6, 2.00233113, 1.3362),
+    "133Cs D1": AtomicLine(7/2, 1/2, 1/2, 335.116048807e12, 4.575e6,
+                           2298.1579425e6, 291.9201e6, 0, 2.00254032, 0.665900),
+    "133Cs D2": AtomicLine(7/2, 1/2, 3/2, 351.72571850e12, 5.234e6,
+                           2298.1579425e6, 50.28827e6, -0.4934e6, 2.00254032, 1.33400),
+    "23Na D1": AtomicLine(3/2, 1/2, 1/2, 508.3331958e12, 9.765e6,
+                          885.8130644e6, 94.44e6, 0, 2.00229600, 0.66581),
+    "23Na D2": AtomicLine(3/2, 1/2, 3/2, 508.8487162e12, 9.7946e6,
+                          885.8130644e6, 18.534e6, 2.724e6, 2.00229600, 1.3342),
+}
+
+
+def ground_label(f):
+    return f"G{f:g}"
+
+
+def excited_label(f):
+    return f"E{f:g}"
+
+
+def hyperfine_shift(a, b, i, j, f):
+    # energy shift (in units of a, b) of hyperfine level F of a fine-structure level
+    k = f*(f+1) - i*(i+1) - j*(j+1)
+    shift = a * k / 2
+
+    if b != 0 and i > 1/2 and j > 1/2:
+        shift += b * (3/2*k*(k+1) - 2*i*(i+1)*j*(j+1)) / (4*i*(2*i-1)*j*(2*j-1))
+
+    return shift
+
+
+def group_frequency(line, ground_f, excited_f):
+    line = LINES[line] if isinstance(line, str) else line
+    i = line.nuclear_spin
+
+    return line.frequency \
+            + hyperfine_shift(line.a_excited, line.b_excited, i, line.j_excited, excited_f) \
+            - hyperfine_shift(line.a_ground, 0, i, line.j_ground, ground_f)
+
+
+def g_factors(line, ground_fs, excited_fs):
+    # g_F of the hyperfine levels (nuclear contribution neglected), keyed like
+    # the states of `get_profile`, for use with ZeemanDetuning
+    line = LINES[line] if isinstance(line, str) else line
+    i = line.nuclear_spin
+
+    def _g_f(g_j, j, f):
+        return 0 if f == 0 else g_j * (f*(f+1) - i*(i+1) + j*(j+1)) / (2*f*(f+1))
+
+    factors = {ground_label(f): _g_f(line.g_j_ground, line.j_ground, f) for f in ground_fs}
+    factors.update({excited_label(f): _g_f(line.g_j_excited, line.j_excited, f) for f in excited_fs})
+
+    return factors
+
+
+def m_values(f):
+    # m_F of hyperfine level F, highest first
+    return [f - n for n in range(int(round(2*f)) + 1)]
+
+
+def hyperfine_levels(nuclear_spin, j):
+    # all F of a fine-structure level, highest first
+    f_max = nuclear_spin + j
+    f_max = int(f_max) if float(f_max).is_integer() else f_max
+
+    return [f_max - n for n in range(int(round(2 * min(nuclear_spin, j))) + 1)]
+
+
+def build_profile(line, ground_fs=None, excited_fs=None):
+    # TransitionProfile of the hyperfine levels `ground_fs` -> `excited_fs`
+    # (default: all of them) of `line`, a name in LINES or any AtomicLine.
+    # States are labelled State("G<F>", m_F) and State("E<F'>", m_F), each
+    # ground-excited pair of levels is a group. Strengths are generated from
+    # the quantum numbers (see `wigner.hyperfine_strengths`).
+    line = LINES[line] if isinstance(line, str) else line
+    i = line.nuclear_spin
+
+    ground_fs = hyperfine_levels(i, line.j_ground) if ground_fs is None else ground_fs
+    excited_fs = hyperfine_levels(i, line.j_excited) if excited_fs is None else excited_fs
+
+    ground_states = [State(ground_label(f), m) for f in ground_fs for m in m_values(f)]
+    excited_states = [State(excited_label(f), m) for f in excited_fs for m in m_values(f)]
+
+    transitions = []
+    frequencies = {}
+
+    for f_g in ground_fs:
+        for f_e in excited_fs:
+            strengths = hyperfine_strengths(i, line.j_ground, line.j_excited, f_g, f_e)
+            if not strengths:
+                continue
+
+            grp = TransitionGroupLabel(ground_label(f_g), excited_label(f_e))
+            frequencies[grp] = group_frequency(line, f_g, f_e)
+
+            for (m_g, m_e), strength in strengths.items():
+                transitions.append(Transition(State(grp.ground_state_hyperfine, m_g),
+                                              State(grp.excited_state_hyperfine, m_e),
+                                              grp, m_e - m_g, strength))
+
+    return TransitionProfile(ground_states, excited_states, transitions, frequencies, line.gamma)
+
+
+def get_profile(line, ground_fs=None, excited_fs=None, cache_dir=None):
+    # Cached `build_profile`. With `cache_dir` (only for lines in LINES), the
+    # compiled profile is stored there on first use and loaded from there
+    # afterwards, so that e.g. pool workers skip building it.
+    line_name = line if isinstance(line, str) else None
+    line = LINES[line] if isinstance(line, str) else line
+
+    ground_fs = hyperfine_levels(line.nuclear_spin, line.j_ground) if ground_fs is None else ground_fs
+    excited_fs = hyperfine_levels(line.nuclear_spin, line.j_excited) if excited_fs is None else excited_fs
+
+    assert cache_dir is None or line_name is not None, "Only profiles of named lines can be stored."
+
+    return _get_profile(line_name, line, tuple(ground_fs), tuple(excited_fs), cache_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_profile(line_name, line, ground_fs, excited_fs, cache_dir):
+    if cache_dir is None:
+        return build_profile(line, ground_fs, excited_fs)
+
+    name = "{}_F{}_F{}.npz".format(line_name.replace(" ", "_"),
+                                   "-".join(f"{f:g}" for f in ground_fs),
+                                   "-".join(f"{f:g}" for f in excited_fs))
+    path = os.path.join(cache_dir, name)
+
+    if os.path.exists(path):
+        return TransitionProfile.load(path)
+
+    profile = build_profile(line, ground_fs, excited_fs)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    profile.save(path)
+
+    return profile
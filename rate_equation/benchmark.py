@@ -0,0 +1,250 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from rate_equation.transition_profile import TransitionProfile, Transition, State, TransitionGroupLabel
+from rate_equation.radiation_field import RadiationField, RadiationFieldProfile
+from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+from rate_equation.rate_equation import RateEquation
+from rate_equation.solver import steady_state
+
+# Benchmarks of the hot paths of the rate equation pipeline.
+#
+#   python -m rate_equation.benchmark [--quick] [--output results.json]
+#                                     [--baseline baseline.json] [--threshold 0.2]
+#
+# Every case is timed (best of `--repeat` runs) on
+#   - hyperfine manifolds Fg = F, F-1 -> Fe = F (F = 1 ... 7, N_g = 4F)
+#   - synthetic ring manifolds with N_g = N_e up to 1000
+# for several numbers of radiation fields and sweep lengths, and its peak
+# memory is measured in a separate run under tracemalloc. Results are written
+# as JSON; with `--baseline`, cases whose throughput dropped by more than
+# `--threshold` (relative) are reported and the exit status is 1.
+#
+# Cases:
+#   init:         RateEquation.__init__ and all pump terms      (matrices/s)
+#   build_matrix: scattering rates and matrix assembly          (matrices/s)
+#   steady_state: calculate_static_state_population             (matrices/s)
+#   force:        calculate_force                               (matrices/s)
+#   sweep:        detuning sweep with steady states, as in the notebook (points/s)
+
+MANIFOLDS = [("hyperfine", f) for f in range(1, 8)] + [("ring", n) for n in (100, 300, 1000)]
+QUICK_MANIFOLDS = [("hyperfine", 1), ("hyperfine", 3), ("ring", 100)]
+
+
+def hyperfine_manifold(f):
+    # Fg = F, F-1 -> Fe = F of a J = 1/2 -> J' = 3/2 line with I = F - 1/2
+    from rate_equation.atomic_data import LINES, build_profile
+
+    line = LINES["87Rb D2"]._replace(nuclear_spin=f - 1/2)
+
+    return build_profile(line, [f, f - 1], [f])
+
+
+def ring_manifold(num_of_states, gamma=6e6, frequency=384e12):
+    # N ground and N excited states on a ring, excited state k decays to
+    # ground states k-1, k, k+1 (delta_m = +1, 0, -1)
+    ground_states = [State("G", n) for n in range(num_of_states)]
+    excited_states = [State("E", n) for n in range(num_of_states)]
+    grp = TransitionGroupLabel("G", "E")
+
+    transitions = [Transition(ground_states[(k - dm) % num_of_states], excited_states[k], grp, dm, s)
+                   for k in range(num_of_states) for dm, s in ((1, 1), (0, 2), (-1, 1))]
+
+    return TransitionProfile(ground_states, excited_states, transitions, {grp: frequency}, gamma)
+
+
+def make_profile(kind, size):
+    return hyperfine_manifold(size) if kind == "hyperfine" else ring_manifold(size)
+
+
+def make_fields(trans_profile, num_of_fields):
+    freq = np.mean(trans_profile.group_frequencies)
+
+    return RadiationFieldProfile([
+        RadiationField(frequency=freq + (n - num_of_fields // 2) * trans_profile.gamma, delta_m=n % 3 - 1,
+                       normalized_intensity=0.1, direction=1 if n % 2 == 0 else -1)
+        for n in range(num_of_fields)])
+
+
+def make_detunings(trans_profile):
+    g_factors = {hf: 0.5 for hf in set(s.hyperfine for s in trans_profile.ground_states)}
+    g_factors.update({hf: 2/3 for hf in set(s.hyperfine for s in trans_profile.excited_states)})
+
+    return [ZeemanDetuning(g_factors, 1e-4), DopplerDetuning(0.5)]
+
+
+def cases(manifolds, field_counts, sweep_lengths):
+    # (name, params, setup) where setup() returns (run, n_items, unit)
+    for kind, size in manifolds:
+        tp = make_profile(kind, size)
+
+        for num_of_fields in field_counts:
+            params = {"manifold": kind, "size": size, "num_of_ground_states": len(tp.ground_states),
+                      "num_of_fields": num_of_fields}
+            fields = make_fields(tp, num_of_fields)
+            detunings = make_detunings(tp)
+
+            def _init(tp=tp, fields=fields, detunings=detunings):
+                def _run():
+                    RateEquation(tp, fields, detunings).pump_terms
+                return _run, 1, "matrices/s"
+
+            def _build(tp=tp, fields=fields, detunings=detunings):
+                rate_eqn = RateEquation(tp, fields, detunings)
+
+                def _run():
+                    rate_eqn.assemble_matrix(rate_eqn.build_scattering_rates().sum(axis=0))
+                return _run, 1, "matrices/s"
+
+            def _steady_state(tp=tp, fields=fields, detunings=detunings):
+                rate_eqn = RateEquation(tp, fields, detunings)
+                rate_eqn.build_matrix()
+
+                def _run():
+                    rate_eqn.calculate_static_state_population()
+                return _run, 1, "matrices/s"
+
+            def _force(tp=tp, fields=fields, detunings=detunings):
+                rate_eqn = RateEquation(tp, fields, detunings)
+                popu = rate_eqn.calculate_static_state_population()
+
+                def _run():
+                    rate_eqn.calculate_force(popu)
+                return _run, 1, "matrices/s"
+
+            yield "init", params, _init
+            yield "build_matrix", params, _build
+            yield "steady_state", params, _steady_state
+            yield "force", params, _force
+
+            for n_points in sweep_lengths:
+                if n_points * len(tp.ground_states) ** 2 > 5e7:
+                    continue  # dense stack would not fit comfortably in memory
+
+                def _sweep(tp=tp, fields=fields, detunings=detunings, n_points=n_points):
+                    rate_eqn = RateEquation(tp, fields, detunings)
+                    dets = np.linspace(-10, 10, n_points) * tp.gamma
+                    freqs = np.array([f.frequency for f in fields.fields]) + dets[:, np.newaxis]
+
+                    def _run():
+                        steady_state(rate_eqn.sweep(field_frequency=freqs), on_degenerate="nan")
+                    return _run, n_points, "points/s"
+
+                yield "sweep", dict(params, num_of_points=n_points), _sweep
+
+
+def measure(setup, repeat, min_time=0.05):
+    # best time per run of `repeat` measurements, each looping over `run`
+    # for at least `min_time` seconds to average out timer noise
+    run, n_items, unit = setup()
+    run()  # warm up caches
+
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(np.ceil(min_time / elapsed)))
+
+    times = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        times.append((time.perf_counter() - start) / loops)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+
+    return {"seconds": best, "throughput": n_items / best, "unit": unit, "peak_memory": peak}
+
+
+def run_benchmarks(manifolds=MANIFOLDS, field_counts=(1, 2, 4), sweep_lengths=(10, 100, 1000), repeat=5,
+                   progress=None):
+    results = []
+    for name, params, setup in cases(manifolds, field_counts, sweep_lengths):
+        result = dict(name=name, params=params, **measure(setup, repeat))
+        results.append(result)
+
+        if progress is not None:
+            progress(result)
+
+    return {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+
+
+def _key(result):
+    return (result["name"],) + tuple(sorted(result["params"].items()))
+
+
+def compare(report, baseline, threshold=0.2):
+    # Cases of `report` whose throughput is below (1 - threshold) times that
+    # of the same case in `baseline`, as (result, baseline result) pairs.
+    reference = {_key(r): r for r in baseline["results"]}
+    regressions = []
+
+    for result in report["results"]:
+        ref = reference.get(_key(result))
+        if ref is not None and result["throughput"] < (1 - threshold) * ref["throughput"]:
+            regressions.append((result, ref))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rate equation pipeline.")
+    parser.add_argument("--quick", action="store_true", help="small manifolds and sweeps only")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative throughput drop counted as regression")
+    args = parser.parse_args(argv)
+
+    def _progress(result):
+        print(f"{result['name']:>13} {json.dumps(result['params'])}: "
+              f"{result['throughput']:.4g} {result['unit']}, {result['peak_memory'] / 1e6:.3g} MB", file=sys.stderr)
+
+    if args.quick:
+        report = run_benchmarks(QUICK_MANIFOLDS, (1, 2), (10, 100), args.repeat, _progress)
+    else:
+        report = run_benchmarks(repeat=args.repeat, progress=_progress)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+
+        for result, ref in regressions:
+            print(f"REGRESSION {result['name']} {json.dumps(result['params'])}: "
+                  f"{result['throughput']:.4g} < {ref['throughput']:.4g} {result['unit']}", file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import functools
+import numpy as np
+from collections import namedtuple
+
+from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+from rate_equation.intermediate_field import IntermediateFieldDetuning
+from rate_equation.solver import steady_state
+
+# Ensemble averages over the quadrature nodes, for n_points scan points:
+#   populations:      (n_points, N_g) ground state populations
+#   field_scattering: (n_points, N_fields) photons scattered from each field
+#                     per atom and second (absorption)
+#   force:            (n_points,) radiation force
+BroadenedResult = namedtuple("BroadenedResult", ["populations", "field_scattering", "force"])
+
+
+@functools.lru_cache(maxsize=None)
+def gauss_hermite(num_of_nodes):
+    # nodes x and weights w with \sum_i w_i f(x_i) ~ E[f(x)], x ~ N(0, 1)
+    x, w = np.polynomial.hermite_e.hermegauss(num_of_nodes)
+    w = w / np.sqrt(2 * np.pi)
+    x.flags.writeable = w.flags.writeable = False
+
+    return x, w
+
+
+@functools.lru_cache(maxsize=None)
+def gauss_legendre(num_of_nodes):
+    # nodes x and weights w with \sum_i w_i f(x_i) ~ \int_{-1}^{1} f(x) dx
+    x, w = np.polynomial.legendre.leggauss(num_of_nodes)
+    x.flags.writeable = w.flags.writeable = False
+
+    return x, w
+
+
+def velocity_nodes(sigma, line_width, resonances, num_of_sigmas=6, num_of_panel_nodes=4):
+    # Nodes v and weights w, both of shape (n_points, n_nodes), with
+    # \sum_j w_ij f_i(v_ij) ~ E[f_i(v)], v ~ N(0, sigma^2), for integrands f_i
+    # with Lorentzian features of FWHM `line_width` at the velocities
+    # `resonances[i]` (shape (n_points, n_res), NaN entries are ignored).
+    #
+    # Composite Gauss-Legendre quadrature over +-`num_of_sigmas` sigma, on
+    # panels of sigma / 2 that are split geometrically towards every
+    # resonance down to line_width / 2, so that the features are resolved
+    # however wide the Gaussian is.
+    resonances = np.asarray(resonances, dtype=float)
+    num_of_points = len(resonances)
+    v_max = num_of_sigmas * sigma
+
+    # resonances closer than a quarter line width share their panels
+    step = line_width / 4
+    resonances = np.where(np.isnan(resonances), -v_max, np.round(resonances / step) * step)
+
+    num_of_levels = max(int(np.ceil(np.log2(sigma / line_width))) + 1, 1)
+    offsets = line_width / 2 * 2.0 ** np.arange(num_of_levels)
+    offsets = np.concatenate([-offsets[::-1], [0], offsets])
+
+    coarse = np.linspace(-v_max, v_max, 4 * num_of_sigmas + 1)
+    edges = np.concatenate([np.broadcast_to(coarse, (num_of_points, len(coarse))),
+                            (resonances[..., np.newaxis] + offsets).reshape((num_of_points, -1))], axis=-1)
+    edges = np.sort(np.clip(edges, -v_max, v_max), axis=-1)
+
+    x, w = gauss_legendre(num_of_panel_nodes)
+    half_width = np.diff(edges, axis=-1)[..., np.newaxis] / 2
+    velocities = (edges[:, :-1, np.newaxis] + half_width * (1 + x)).reshape((num_of_points, -1))
+    weights = (half_width * w).reshape((num_of_points, -1)) * np.exp(-velocities**2 / (2 * sigma**2))
+
+    # drop the nodes of empty panels, keeping the same number for every point
+    num_of_nodes = np.max(np.count_nonzero(weights, axis=-1))
+    order = np.argsort(weights == 0, axis=-1, kind="stable")[:, :num_of_nodes]
+    velocities = np.take_along_axis(velocities, order, axis=-1)
+    weights = np.take_along_axis(weights, order, axis=-1)
+
+    return velocities, weights / weights.sum(axis=-1, keepdims=True)
+
+
+def resonant_velocities(rate_eqn, field_frequency=None, b_field=None):
+    # Velocities at which every field of `rate_eqn` is Doppler shifted into
+    # resonance with every transition, shape (n_points, N_fields, N_trans)
+    # (NaN for transitions the field does not drive), for the field
+    # frequencies of a scan as in `RateEquation.sweep` and optionally another
+    # `b_field` (T). Includes the shifts of all other detunings, but not the
+    # velocity of a `DopplerDetuning`.
+    from scipy.constants import c
+
+    tp = rate_eqn.trans_profile
+    fields = rate_eqn.radiation.fields
+
+    field_freqs = np.array([[field.frequency for field in fields]], dtype=float)
+    if field_frequency is not None:
+        field_freqs = np.asarray(field_frequency, dtype=float)
+        field_freqs = field_freqs if field_freqs.ndim == 2 else field_freqs[:, np.newaxis]
+        field_freqs = np.broadcast_to(field_freqs, (len(field_freqs), len(fields)))
+    field_freqs = field_freqs[..., np.newaxis]  # (n_points, N_fields, 1)
+
+    directions = np.array([field.direction for field in fields], dtype=float)[:, np.newaxis]
+    delta_m = np.array([field.delta_m for field in fields], dtype=int)[:, np.newaxis]
+
+    detunings = [det for det in rate_eqn.detunings if not isinstance(det, DopplerDetuning)]
+    if b_field is not None:
+        detunings = [det.with_b_field(b_field) if isinstance(det, (ZeemanDetuning, IntermediateFieldDetuning))
+                     else det for det in detunings]
+
+    trans_freqs = tp.trans_frequency + sum(np.asarray(det.get_detuning_array(field_freqs, tp, directions))
+                                           for det in detunings)
+
+    # trans_freq - f + direction * f * v / c vanishes at
+    velocities = directions * c * (field_freqs - trans_freqs) / field_freqs
+
+    return np.where(delta_m == tp.trans_delta_m, velocities, np.nan)
+
+
+class BroadenedRateEquation:
+    # Steady state of `rate_eqn` averaged over inhomogeneous broadening: the
+    # velocity along the beams (Maxwell-Boltzmann at `temperature` K for atoms
+    # of `mass` kg, i.e. Gaussian with sigma = sqrt(k T / m), around the
+    # velocity of the DopplerDetuning of `rate_eqn` if it has one) and
+    # optionally a Gaussian distribution of magnetic fields (`b_field_mean`,
+    # `b_field_sigma` T, replacing the field of the Zeeman detuning).
+    #
+    # While the Doppler width sigma stays below the natural line width (in
+    # velocity, gamma * wavelength), the velocities are integrated with
+    # Gauss-Hermite quadrature on `n_velocity` nodes. Wider distributions,
+    # e.g. of a vapor cell, are integrated piecewise with panels refined
+    # around the Doppler-resonant velocities of every scan point (see
+    # `velocity_nodes`). The B field distribution uses `n_b_field`
+    # Gauss-Hermite nodes. The nodes of all scan points are evaluated
+    # together in one batched sweep. Results are cached per temperature,
+    # scan and configuration of `rate_eqn` (its fields and detunings, e.g.
+    # as changed by `set_field`), so revisiting a spectrum costs nothing.
+
+    def __init__(self, rate_eqn, mass, temperature, n_velocity=16, b_field_mean=None, b_field_sigma=0,
+                 n_b_field=8, cache_size=64):
+        self.rate_eqn = rate_eqn
+        self.mass = mass
+        self.temperature = temperature
+        self.n_velocity = n_velocity
+        self.b_field_mean = b_field_mean
+        self.b_field_sigma = b_field_sigma
+        self.n_b_field = n_b_field if b_field_mean is not None and b_field_sigma else 1
+        self.cache_size = cache_size
+
+        self._cache = {}
+
+    @property
+    def mean_velocity(self):
+        # velocity of the DopplerDetuning of `rate_eqn` (0 without one)
+        return sum(det.velocity for det in self.rate_eqn.detunings if isinstance(det, DopplerDetuning))
+
+    def nodes(self, field_frequency=None, temperature=None):
+        # Velocities (offsets from `mean_velocity`), B fields (or None) and
+        # weights of the quadrature nodes, all of shape (n_points, n_nodes),
+        # for the field frequencies of a scan as in `average` (n_points = 1
+        # without, and if the nodes do not depend on them).
+        from scipy.constants import k, c
+
+        temperature = self.temperature if temperature is None else temperature
+        tp = self.rate_eqn.trans_profile
+
+        sigma = np.sqrt(k * temperature / self.mass)
+        line_width = c * tp.gamma / np.max(tp.trans_frequency)
+
+        if sigma <= line_width:
+            x_v, w_v = gauss_hermite(self.n_velocity)
+            velocities, w_v = sigma * x_v[np.newaxis], w_v[np.newaxis]
+        else:
+            resonances = resonant_velocities(self.rate_eqn, field_frequency, self.b_field_mean) - self.mean_velocity
+            velocities, w_v = velocity_nodes(sigma, line_width, resonances.reshape((len(resonances), -1)))
+
+        if self.b_field_mean is None:
+            return velocities, None, w_v
+
+        x_b, w_b = gauss_hermite(self.n_b_field) if self.n_b_field > 1 else (np.zeros(1), np.ones(1))
+        b_fields = self.b_field_mean + self.b_field_sigma * x_b
+
+        return (np.repeat(velocities, len(b_fields), axis=-1),
+                np.tile(b_fields, velocities.shape),
+                (w_v[..., np.newaxis] * w_b).reshape((len(w_v), -1)))
+
+    def average(self, field_frequency=None, normalized_intensity=None, temperature=None):
+        # `BroadenedResult` for scan points given as in `RateEquation.sweep`
+        # (shape (n_points,) or (n_points, N_fields)); without any, for the
+        # fields of `rate_eqn` (n_points = 1).
+        temperature = self.temperature if temperature is None else temperature
+        key = (temperature, self.n_velocity, self.b_field_mean, self.b_field_sigma, self.n_b_field,
+               tuple(self.rate_eqn.radiation.fields), tuple(det.cache_key() for det in self.rate_eqn.detunings)) + \
+            tuple(None if p is None else np.asarray(p, dtype=float).tobytes() + bytes(str(np.shape(p)), "ascii")
+                  for p in (field_frequency, normalized_intensity))
+
+        if key not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                self._cache.pop(next(iter(self._cache)))
+
+            self._cache[key] = self._average(field_frequency, normalized_intensity, temperature)
+
+        return self._cache[key]
+
+    def _average(self, field_frequency, normalized_intensity, temperature):
+        rate_eqn = self.rate_eqn
+        tp = rate_eqn.trans_profile
+        velocities, b_fields, weights = self.nodes(field_frequency, temperature)
+
+        scan = [np.asarray(p, dtype=float) for p in (field_frequency, normalized_intensity) if p is not None]
+        n_points = len(scan[0]) if scan else 1
+        n_nodes = weights.shape[-1]
+
+        velocities, weights = (np.broadcast_to(x, (n_points, n_nodes)) for x in (velocities, weights))
+        if b_fields is not None:
+            b_fields = np.broadcast_to(b_fields, (n_points, n_nodes))
+
+        def _per_node(param):
+            # scan point i, node j -> row i * n_nodes + j
+            return None if param is None else np.repeat(np.asarray(param, dtype=float), n_nodes, axis=0)
+
+        b_field = None if b_fields is None else b_fields.ravel()
+        rates = rate_eqn.sweep_scattering_rates(_per_node(field_frequency), _per_node(normalized_intensity),
+                                                b_field, (self.mean_velocity + velocities).ravel())
+        strengths = rate_eqn.sweep_transition_strengths(b_field)
+
+        popu = steady_state(rate_eqn.assemble_matrix(rates.sum(axis=-2), strengths))
+        force, _ = rate_eqn.force_from_rates(rates, popu)
+        field_scattering = np.einsum("...ft,...t->...f", rates, popu[..., tp.trans_ground])
+
+        def _mean(values):
+            values = values.reshape((n_points, n_nodes) + values.shape[1:])
+            return np.einsum("pn...,pn->p...", values, weights)
+
+        return BroadenedResult(_mean(popu), _mean(field_scattering), _mean(force))
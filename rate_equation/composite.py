@@ -0,0 +1,279 @@
+import numpy as np
+from collections import namedtuple
+from scipy import sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from rate_equation.radiation_field import RadiationFieldProfile
+from rate_equation.rate_equation import RateEquation
+from rate_equation.solver import steady_state
+
+# One independent block of a `CompositeRateEquation`:
+#   species       index of the species (transition profile) it belongs to
+#   trans_profile profile of its ground states, excited states and transitions
+#   ground_index  positions of its ground states in the global population vector
+#   trans_index   positions of its transitions in the global transition list
+#   weight        fraction of all atoms in this block
+Block = namedtuple("Block", ["species", "trans_profile", "ground_index", "trans_index", "weight"])
+
+
+def split_profile(trans_profile):
+    # Independent parts of `trans_profile`: sets of ground states connected
+    # through shared excited states, between which no population can flow.
+    # Returns (ground, excited, transition) index arrays for every part.
+    tp = trans_profile
+    num_of_gs, num_of_es = len(tp.ground_states), len(tp.excited_states)
+
+    # bipartite graph of ground states (0 ... N_g - 1) and excited states
+    graph = sp.csr_matrix((np.ones(len(tp.transitions)), (tp.trans_ground, num_of_gs + tp.trans_excited)),
+                          shape=(num_of_gs + num_of_es,) * 2)
+    num_of_comps, labels = connected_components(graph, directed=False)
+
+    parts = []
+    for comp in range(num_of_comps):
+        ground = np.flatnonzero(labels[:num_of_gs] == comp)
+        if not len(ground):
+            continue  # excited states without any transition
+
+        parts.append((ground, np.flatnonzero(labels[num_of_gs:] == comp),
+                      np.flatnonzero(labels[tp.trans_ground] == comp)))
+
+    return parts
+
+
+class CompositeRateEquation:
+    # Rate equation of several species, or of transition profiles with
+    # several independent parts (e.g. F = 2 -> F' = 3 and F = 1 -> F' = 0),
+    # assembled and solved block by block.
+    #
+    # `species` is a list of (trans_profile, detunings) pairs, one per species
+    # (e.g. isotope), all driven by `radiation_field_profile`. Every profile
+    # is split into blocks of ground states that exchange population
+    # (`split_profile`), and each block gets its own `RateEquation` over the
+    # fields that can drive it: those with a delta_m of its transitions and,
+    # with `detuning_window` (Hz), within it of the resonance of one of its
+    # transitions (at any point of a sweep). Within a block, a field then
+    # only scatters on the transition groups it is within the window of
+    # (`group_mask`). Resonances include the Zeeman and Doppler shifts of the
+    # detunings, so the window follows a sweep over b_field or velocity.
+    # Far-detuned fields are thus skipped entirely, and the far wings of the
+    # others are dropped.
+    #
+    # Population is conserved within every block, so the steady state of the
+    # whole system depends on how atoms are distributed over the blocks. This
+    # is given by `abundances` (fraction of atoms per species, default: equal)
+    # and, within a species, by the number of ground states of the block
+    # (as for an initially uniform population). Results are stitched back
+    # into global arrays over the concatenated ground states
+    # (`ground_states`, (species, State) pairs) and transitions of all species;
+    # forces and scattering rates are per atom of the whole ensemble.
+    #
+    # A block without any driving field (at a point of a sweep) is not
+    # solved: its atoms stay uniformly distributed over its ground states,
+    # and it neither scatters nor feels a force.
+
+    def __init__(self, species, radiation_field_profile, detuning_window=None, abundances=None, sparse=False):
+        self.species = [(tp, list(detunings)) for tp, detunings in species]
+        self.radiation = radiation_field_profile
+        self.detuning_window = detuning_window
+        self.sparse = sparse
+
+        abundances = np.ones(len(self.species)) if abundances is None else np.asarray(abundances, dtype=float)
+        assert len(abundances) == len(self.species), "One abundance per species is required."
+        abundances = abundances / abundances.sum()
+
+        self.ground_states = []
+        self.blocks = []
+        num_of_trans = 0
+
+        for n, (tp, _) in enumerate(self.species):
+            offset = len(self.ground_states)
+
+            for ground, excited, trans in split_profile(tp):
+                self.blocks.append(Block(n, tp.subprofile(ground, excited, trans), offset + ground,
+                                         num_of_trans + trans, abundances[n] * len(ground) / len(tp.ground_states)))
+
+            self.ground_states += [(n, gs) for gs in tp.ground_states]
+            num_of_trans += len(tp.transitions)
+
+        self.num_of_transitions = num_of_trans
+        self._equations = {}  # (block index, field indices) -> RateEquation
+
+    def group_mask(self, index, field_frequency=None, b_field=None, velocity=None):
+        # Mask of shape (n_points, N_fields, N_trans) over all fields and the
+        # transitions of block `index`: whether the field is within
+        # `detuning_window` of the (shifted) resonance of a transition it
+        # drives in the group of the transition, for the parameter points of
+        # `RateEquation.sweep`. None without a window.
+        if self.detuning_window is None:
+            return None
+
+        rate_eqn = self._equation(index, tuple(range(len(self.radiation.fields))))
+        tp = rate_eqn.trans_profile
+
+        delta_m = np.array([field.delta_m for field in self.radiation.fields], dtype=int)
+        detuning = np.abs(rate_eqn.sweep_detunings(field_frequency, b_field, velocity))
+        near = (detuning <= self.detuning_window) & (delta_m[:, np.newaxis] == tp.trans_delta_m)
+
+        mask = np.zeros(near.shape, dtype=bool)
+        for n in np.unique(tp.trans_group).tolist():
+            in_group = tp.trans_group == n
+            mask[..., in_group] = np.any(near[..., in_group], axis=-1, keepdims=True)
+
+        return mask
+
+    def block_fields(self, index, field_frequency=None, b_field=None, velocity=None):
+        # Indices of the fields driving block `index`, for the parameters of
+        # this rate equation or those of a sweep (as in `RateEquation.sweep`).
+        return self._driving_fields(index, self.group_mask(index, field_frequency, b_field, velocity))
+
+    def _driving_fields(self, index, mask):
+        tp = self.blocks[index].trans_profile
+        driving = np.isin([field.delta_m for field in self.radiation.fields], tp.trans_delta_m)
+
+        if mask is not None:
+            driving &= np.any(mask, axis=(0, 2))
+
+        return tuple(np.flatnonzero(driving).tolist())
+
+    def block_equation(self, index, field_frequency=None, b_field=None, velocity=None):
+        # `RateEquation` of block `index` over its driving fields (see `block_fields`)
+        fields = self.block_fields(index, field_frequency, b_field, velocity)
+
+        return self._equation(index, fields), fields
+
+    def _equation(self, index, fields):
+        key = (index, fields)
+
+        if key not in self._equations:
+            block = self.blocks[index]
+            self._equations[key] = RateEquation(block.trans_profile,
+                                                RadiationFieldProfile([self.radiation.fields[f] for f in fields]),
+                                                self.species[block.species][1], sparse=self.sparse)
+
+        return self._equations[key]
+
+    @property
+    def field_scattering_rates(self):
+        # (N_fields, N_trans) over the transitions of all species
+        rates = np.zeros((len(self.radiation.fields), self.num_of_transitions))
+
+        for n, block in enumerate(self.blocks):
+            _, fields, block_rates = self._block_rates(n)
+            if fields:
+                rates[np.ix_(fields, block.trans_index)] = block_rates[0]
+
+        return rates
+
+    def calculate_static_state_population(self, on_degenerate="raise"):
+        popu = np.zeros(len(self.ground_states))
+
+        for n, block in enumerate(self.blocks):
+            rate_eqn, fields, rates = self._block_rates(n)
+            if not fields:
+                popu[block.ground_index] = block.weight / len(block.ground_index)
+                continue
+
+            popu[block.ground_index] = self._block_steady_state(n, rate_eqn, rates, None, on_degenerate)[0]
+
+        return popu
+
+    def calculate_force(self, ground_state_population):
+        popu = np.asarray(ground_state_population, dtype=float)
+
+        force = 0
+        for n, block in enumerate(self.blocks):
+            rate_eqn, fields, rates = self._block_rates(n)
+            if fields:
+                force += rate_eqn.force_from_rates(rates[0], popu[block.ground_index])[0]
+
+        return force
+
+    def sweep_steady_state(self, field_frequency=None, normalized_intensity=None, b_field=None, velocity=None,
+                           on_degenerate="raise"):
+        # Steady-state populations for the parameter points of
+        # `RateEquation.sweep`, shape (n_points, N_g) over all species.
+        popu = np.zeros((_num_of_points(field_frequency, normalized_intensity, b_field, velocity),
+                         len(self.ground_states)))
+
+        for n, block in enumerate(self.blocks):
+            rate_eqn, fields, rates = self._block_rates(n, field_frequency, normalized_intensity, b_field, velocity)
+            if not fields:
+                popu[:, block.ground_index] = block.weight / len(block.ground_index)
+                continue
+
+            popu[:, block.ground_index] = self._block_steady_state(n, rate_eqn, rates, b_field, on_degenerate)
+
+        return popu
+
+    def calculate_force_array(self, ground_state_population=None, field_frequency=None,
+                              normalized_intensity=None, b_field=None, velocity=None):
+        # Force and total scattering rate per atom, both of shape (n_points,),
+        # as `RateEquation.calculate_force_array` (with steady-state
+        # populations of all blocks if `ground_state_population` is not given).
+        if ground_state_population is None:
+            ground_state_population = self.sweep_steady_state(field_frequency, normalized_intensity, b_field,
+                                                              velocity)
+
+        popu = np.asarray(ground_state_population, dtype=float)
+        force = scattering = np.zeros(popu.shape[:-1])
+
+        for n, block in enumerate(self.blocks):
+            rate_eqn, fields, rates = self._block_rates(n, field_frequency, normalized_intensity, b_field, velocity)
+            if not fields:
+                continue
+
+            block_force, block_scattering = rate_eqn.force_from_rates(rates, popu[..., block.ground_index])
+
+            force = force + block_force
+            scattering = scattering + block_scattering
+
+        return force, scattering
+
+    def _block_steady_state(self, index, rate_eqn, rates, b_field, on_degenerate):
+        # Weighted steady-state populations of block `index` for its
+        # `_block_rates`, shape (n_points, N_g). Points at which the mask
+        # leaves no field driving the block stay uniform, as undriven blocks.
+        block = self.blocks[index]
+        popu = np.full((len(rates), len(block.ground_index)), 1 / len(block.ground_index))
+
+        driven = np.flatnonzero(np.any(rates, axis=(-2, -1)))
+        strengths = rate_eqn.sweep_transition_strengths(b_field)
+        strengths = strengths[driven] if strengths.ndim == 2 else strengths
+
+        if len(driven):
+            popu[driven] = steady_state(rate_eqn.assemble_matrix(rates[driven].sum(axis=-2), strengths),
+                                        on_degenerate=on_degenerate)
+
+        return block.weight * popu
+
+    def _block_rates(self, index, field_frequency=None, normalized_intensity=None, b_field=None, velocity=None):
+        # Block rate equation, its driving fields and their scattering rates
+        # on its transitions for the parameter points of `RateEquation.sweep`,
+        # restricted by `group_mask`, shape (n_points, N_fields, N_trans)
+        # (n_points = 1 if nothing is swept; (None, (), None) without fields).
+        mask = self.group_mask(index, field_frequency, b_field, velocity)
+        fields = self._driving_fields(index, mask)
+        if not fields:
+            return None, fields, None
+
+        def _select(value):
+            value = None if value is None else np.asarray(value, dtype=float)
+            return value[:, list(fields)] if value is not None and value.ndim == 2 else value
+
+        rate_eqn = self._equation(index, fields)
+        rates = rate_eqn.sweep_scattering_rates(_select(field_frequency), _select(normalized_intensity), b_field,
+                                                velocity)
+
+        if mask is not None:
+            rates = rates * mask[:, list(fields)]
+
+        return rate_eqn, fields, rates
+
+
+def _num_of_points(*params):
+    # number of points of a sweep over `params` (see `RateEquation.sweep`)
+    for value in params:
+        if value is not None:
+            return len(value)
+
+    return 1
@@ -1,38 +1,165 @@
 import numpy as np
+from types import MappingProxyType
+from weakref import WeakKeyDictionary
 
+from rate_equation import instrumentation
 from rate_equation.transition_profile import State
 
 
 class Detuning:
-    def get_detuning(self, field_freq, ground_state, excited_state):  # get detuning normalized by gamma
+    def get_detuning(self, field_freq, ground_state, excited_state, field_direction=1):  # get detuning normalized by gamma
+        # `field_direction` is +1 (-1) for a field propagating along (against)
+        # the velocity axis
         raise NotImplementedError
 
+    def get_detuning_array(self, field_freqs, trans_profile, field_directions=1):
+        # Vectorized `get_detuning` over all transitions of `trans_profile`.
+        # `field_freqs` has shape (..., 1) (usually (..., N_fields, 1)), and
+        # the result must broadcast against (..., N_fields, N_trans): its last
+        # axis is either N_trans (a shift per transition) or 1 (a shift common
+        # to all transitions, e.g. Doppler). Parameters of the detuning may
+        # themselves be arrays broadcasting against it, which is how parameter
+        # sweeps are evaluated in one pass.
+        # `field_directions` (broadcasting like `field_freqs`) is +1 (-1) for
+        # fields propagating along (against) the velocity axis.
+        # This fallback loops over the transitions; subclasses override it.
+        field_freqs, field_directions = np.broadcast_arrays(field_freqs, field_directions)
+        field_freqs, field_directions = field_freqs[..., 0], field_directions[..., 0]
+        instrumentation.count("get_detuning", len(trans_profile.transitions))
+
+        return np.stack([
+            np.broadcast_to(self.get_detuning(field_freqs, t.ground_state, t.excited_state, field_directions),
+                            field_freqs.shape)
+            for t in trans_profile.transitions], axis=-1)
+
+    def get_transition_strengths(self, trans_profile):
+        # Normalized strengths of the transitions of `trans_profile`, for
+        # detunings that also mix the states (shape (..., N_trans) like
+        # `get_detuning_array`). None keeps the strengths of the profile.
+        return None
+
+    def cache_key(self):
+        # Hashable description of this detuning, used to cache results that
+        # depend on it (e.g. propagators). Subclasses return their parameters.
+        return self
+
 
 class ZeemanDetuning(Detuning):
+    # Zeeman shifts are cached: per state (hyperfine, m) for `get_detuning`,
+    # and per transition profile as a vector over its transitions for
+    # `get_detuning_array`. The per-state coefficients mu_B g m / h only
+    # depend on `g_factors`, so changing `b_field` rescales them without any
+    # per-transition Python arithmetic. Assigning `g_factors` or `b_field`
+    # invalidates the affected caches (`g_factors` is read-only in place).
+
     def __init__(self, g_factors, b_field):  # B in Tesla, gamma in Hz (w/o 2\pi)
+        from scipy.constants import physical_constants, h
+        self._mu_B_over_h = physical_constants['Bohr magneton'][0] / h  # Hz / T
+
         self.g_factors = g_factors  # dict: hyperfine label -> g factor
         self.b_field = b_field
 
-    def get_detuning(self, field_freq, ground_state, excited_state):
-        from scipy.constants import physical_constants, h
-        mu_B = physical_constants['Bohr magneton'][0]  # J / T
+    @property
+    def g_factors(self):
+        return MappingProxyType(self._g_factors)
+
+    @g_factors.setter
+    def g_factors(self, g_factors):
+        self._g_factors = dict(g_factors)
+        self._coefficients = {}  # (hyperfine, m) -> mu_B g m / h
+        self._trans_coefficients = WeakKeyDictionary()  # profile -> per-transition coefficients
+        self._trans_shifts = WeakKeyDictionary()  # profile -> per-transition shifts at `b_field`
+
+    @property
+    def b_field(self):
+        return self._b_field
+
+    @b_field.setter
+    def b_field(self, b_field):
+        self._b_field = b_field
+        self._trans_shifts = WeakKeyDictionary()
+
+    def __getstate__(self):
+        # caches hold weak references and are rebuilt on demand
+        return {"_mu_B_over_h": self._mu_B_over_h, "g_factors": self._g_factors, "b_field": self._b_field}
+
+    def __setstate__(self, state):
+        self._mu_B_over_h = state["_mu_B_over_h"]
+        self.g_factors = state["g_factors"]
+        self.b_field = state["b_field"]
+
+    def __copy__(self):
+        return self.with_b_field(self.b_field)
+
+    def with_b_field(self, b_field):
+        # the same detuning at another (possibly swept) field, sharing the
+        # cached coefficients
+        det = ZeemanDetuning.__new__(ZeemanDetuning)
+        det._mu_B_over_h = self._mu_B_over_h
+        det._g_factors = self._g_factors
+        det._coefficients = self._coefficients
+        det._trans_coefficients = self._trans_coefficients
+        det.b_field = b_field
 
-        gs_det = mu_B * self.g_factors[ground_state.hyperfine] \
-                * ground_state.m * self.b_field / h
+        return det
 
-        es_det = mu_B * self.g_factors[excited_state.hyperfine] \
-                * excited_state.m * self.b_field / h
+    def _coefficient(self, state):
+        try:
+            return self._coefficients[state]
+        except KeyError:
+            coeff = self._mu_B_over_h * self._g_factors[state.hyperfine] * state.m
+            self._coefficients[state] = coeff
 
-        return es_det - gs_det
+            return coeff
+
+    def get_detuning(self, field_freq, ground_state, excited_state, field_direction=1):
+        return (self._coefficient(excited_state) - self._coefficient(ground_state)) * self.b_field
+
+    def get_transition_coefficients(self, trans_profile):
+        # Zeeman shift per unit field (Hz / T) of every transition of `trans_profile`
+        try:
+            return self._trans_coefficients[trans_profile]
+        except KeyError:
+            gs_coeff = np.array([self._coefficient(gs) for gs in trans_profile.ground_states])
+            es_coeff = np.array([self._coefficient(es) for es in trans_profile.excited_states])
+
+            coeff = es_coeff[trans_profile.trans_excited] - gs_coeff[trans_profile.trans_ground]
+            self._trans_coefficients[trans_profile] = coeff
+
+            return coeff
+
+    def get_detuning_array(self, field_freqs, trans_profile, field_directions=1):
+        if np.ndim(self.b_field) > 0:
+            # swept field, nothing worth caching
+            return self.get_transition_coefficients(trans_profile) * np.asarray(self.b_field)
+
+        try:
+            return self._trans_shifts[trans_profile]
+        except KeyError:
+            shifts = self.get_transition_coefficients(trans_profile) * self.b_field
+            self._trans_shifts[trans_profile] = shifts
+
+            return shifts
+
+    def cache_key(self):
+        return (type(self).__name__, tuple(sorted(self._g_factors.items())), self.b_field)
 
 
 class DopplerDetuning(Detuning):
     def __init__(self, velocity):  # velocity in m/s
+        from scipy.constants import c
+        self._c = c
+
         self.velocity = velocity
 
-    def get_detuning(self, field_freq, ground_state, excited_state):
+    def get_detuning(self, field_freq, ground_state, excited_state, field_direction=1):
         # opposite direction (v<0) light creates positive shift in atomic resonance frequency
-        from scipy.constants import c
-
         # positive shift in resonance frequency <=> negative shift in laser frequency it sees
-        return field_freq / c * self.velocity
+        # a counter-propagating field sees the opposite shift
+        return field_direction * field_freq / self._c * self.velocity
+
+    def get_detuning_array(self, field_freqs, trans_profile, field_directions=1):
+        return np.asarray(field_directions) * np.asarray(field_freqs) / self._c * np.asarray(self.velocity)
+
+    def cache_key(self):
+        return (type(self).__name__, self.velocity)
@@ -0,0 +1,192 @@
+import os
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from rate_equation import instrumentation
+from rate_equation.solver import steady_state
+
+# Memory-mapped results of a grid sweep, each of shape grid_shape + (...):
+#   populations: (..., N_g) steady-state populations (NaN if not unique)
+#   force:       (...) radiation force
+#   scattering:  (...) total scattering rate
+SweepResult = namedtuple("SweepResult", ["populations", "force", "scattering"])
+
+AXIS_NAMES = ("field_frequency", "normalized_intensity", "b_field", "velocity")
+
+
+def grid_axes(axes):
+    # Checked axes of an outer-product grid sweep (parameter name ->
+    # float array of its values, in order) and the shape of the grid.
+    for name in axes:
+        assert name in AXIS_NAMES, f"Unknown sweep axis {name}, expected one of {', '.join(AXIS_NAMES)}."
+
+    axes = {name: np.asarray(values, dtype=float) for name, values in axes.items()}
+
+    return axes, tuple(len(values) for values in axes.values())
+
+
+def grid_points(axes, shape, start, stop):
+    # `RateEquation.sweep` parameters of the grid points start ... stop - 1
+    # of the grid flattened in C order
+    grid_index = np.unravel_index(np.arange(start, stop), shape)
+
+    return {name: values[idx] for (name, values), idx in zip(axes.items(), grid_index)}
+
+
+class SweepExecutor:
+    # Steady state and force of `rate_eqn` on the outer-product grid of
+    # `axes`, an ordered dict of parameter name (see `RateEquation.sweep`) to
+    # the values along that axis. Field parameters may also be given per
+    # field, with shape (n_values, N_fields).
+    #
+    # The flattened grid is cut into chunks of `chunk_size` points that are
+    # distributed over a process pool. Workers write their results straight
+    # into memory-mapped .npy files in `output_dir`, so nothing but chunk
+    # indices is sent back. Finished chunks are recorded in `done.npy`; running
+    # again on the same directory only computes the missing chunks, which
+    # resumes an interrupted sweep.
+
+    def __init__(self, rate_eqn, axes, output_dir, chunk_size=10000):
+        self.rate_eqn = rate_eqn
+        self.axes, self.shape = grid_axes(axes)
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+        self.num_of_points = int(np.prod(self.shape))
+        self.num_of_chunks = int(np.ceil(self.num_of_points / chunk_size))
+
+    def _path(self, name):
+        return os.path.join(self.output_dir, name + ".npy")
+
+    def _prepare(self):
+        # create the output files, or check that existing ones belong to this sweep
+        num_of_gs = len(self.rate_eqn.trans_profile.ground_states)
+        axes_path = os.path.join(self.output_dir, "axes.npz")
+
+        if os.path.exists(axes_path):
+            with np.load(axes_path) as saved:
+                assert set(saved.keys()) == set(self.axes) | {"chunk_size"} \
+                        and all(np.array_equal(saved[name], values) for name, values in self.axes.items()) \
+                        and saved["chunk_size"] == self.chunk_size, \
+                        f"{self.output_dir} holds the results of a different sweep."
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        for name, shape in [("populations", self.shape + (num_of_gs,)),
+                            ("force", self.shape),
+                            ("scattering", self.shape)]:
+            out = np.lib.format.open_memmap(self._path(name), mode="w+", dtype=float, shape=shape)
+            out[...] = np.nan
+            out.flush()
+
+        np.lib.format.open_memmap(self._path("done"), mode="w+", dtype=bool, shape=(self.num_of_chunks,)).flush()
+
+        # written last: marks the directory as initialized
+        np.savez(axes_path, chunk_size=self.chunk_size, **self.axes)
+
+    def pending_chunks(self):
+        if not os.path.exists(self._path("done")):
+            return list(range(self.num_of_chunks))
+
+        done = np.load(self._path("done"))
+
+        return [int(i) for i in np.flatnonzero(~done)]
+
+    def run(self, n_workers=None, progress=None):
+        # Compute all pending chunks, calling progress(num_done, num_of_chunks)
+        # after each one. With n_workers=1 everything runs in this process.
+        self._prepare()
+
+        pending = self.pending_chunks()
+        done = np.lib.format.open_memmap(self._path("done"), mode="r+")
+        num_done = self.num_of_chunks - len(pending)
+
+        def _finish(chunk):
+            nonlocal num_done
+            done[chunk] = True
+            done.flush()
+            num_done += 1
+
+            if progress is not None:
+                progress(num_done, self.num_of_chunks)
+
+        if n_workers == 1:
+            _init_worker(self)
+            try:
+                for chunk in pending:
+                    _finish(_run_chunk(chunk))
+            finally:
+                _release_worker()
+        else:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(self,)) as pool:
+                if instrumentation.recorder is None:
+                    futures = [pool.submit(_run_chunk, chunk) for chunk in pending]
+                else:
+                    futures = [pool.submit(instrumentation.call_recorded, _run_chunk, chunk) for chunk in pending]
+
+                for future in as_completed(futures):
+                    chunk = future.result()
+                    if instrumentation.recorder is not None:
+                        chunk, rec = chunk
+                        instrumentation.merge(rec)
+
+                    _finish(chunk)
+
+        del done
+
+        return self.load()
+
+    def load(self):
+        return SweepResult(*(np.load(self._path(name), mmap_mode="r")
+                             for name in SweepResult._fields))
+
+    def _compute_chunk(self, chunk, outputs):
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.num_of_points)
+
+        params = grid_points(self.axes, self.shape, start, stop)
+
+        rate_eqn = self.rate_eqn
+        rates = rate_eqn.sweep_scattering_rates(**params)
+        strengths = rate_eqn.sweep_transition_strengths(params.get("b_field"))
+        popu = steady_state(rate_eqn.assemble_matrix(rates.sum(axis=-2), strengths), on_degenerate="nan")
+        force, scattering = rate_eqn.force_from_rates(rates, popu)
+
+        populations, force_out, scattering_out = outputs
+        populations[start:stop] = popu
+        force_out[start:stop] = force
+        scattering_out[start:stop] = scattering
+
+        for out in outputs:
+            out.flush()
+
+
+# per-process state of the pool workers
+_worker = None
+
+
+def _init_worker(executor):
+    global _worker
+
+    outputs = []
+    for name in ("populations", "force", "scattering"):
+        out = np.lib.format.open_memmap(executor._path(name), mode="r+")
+        outputs.append(out.reshape((executor.num_of_points,) + out.shape[len(executor.shape):]))
+
+    _worker = (executor, outputs)
+
+
+def _release_worker():
+    # drops the memory maps of an in-process worker once its sweep is done
+    global _worker
+
+    _worker = None
+
+
+def _run_chunk(chunk):
+    executor, outputs = _worker
+    executor._compute_chunk(chunk, outputs)
+
+    return chunk
@@ -0,0 +1,153 @@
+import functools
+import contextlib
+from time import perf_counter
+
+import numpy as np
+
+# Opt-in instrumentation of the rate equation pipeline.
+#
+#   with instrumentation.record() as rec:
+#       rate_eqn.calculate_static_state_population()
+#   rec.summary()  # {"stages": {...}, "counters": {...}, "values": {...}}
+#
+# While a `record` block is active, instrumented functions add their wall
+# time and call count to a stage (e.g. "matrix_assembly", "steady_state"),
+# and call sites add counters (e.g. "get_detuning" calls) and observed values
+# (e.g. "matrix_size", "condition_number"). Outside of it, instrumented
+# functions only check that `recorder` is None.
+#
+# Pool workers of SweepExecutor and TrajectorySimulator record into their own
+# Recorder, which is sent back and merged into the active one, so totals
+# cover whole batched sweeps.
+
+recorder = None  # the active Recorder
+
+
+class Recorder:
+    def __init__(self):
+        self.stages = {}  # name -> [calls, seconds]
+        self.counters = {}  # name -> count
+        self.values = {}  # name -> [count, sum, min, max]
+
+    def add_time(self, stage, seconds):
+        entry = self.stages.setdefault(stage, [0, 0.])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return
+
+        entry = self.values.get(name)
+        if entry is None:
+            self.values[name] = [len(values), values.sum(), values.min(), values.max()]
+        else:
+            self.values[name] = [entry[0] + len(values), entry[1] + values.sum(),
+                                 min(entry[2], values.min()), max(entry[3], values.max())]
+
+    def merge(self, other):
+        for stage, (calls, seconds) in other.stages.items():
+            entry = self.stages.setdefault(stage, [0, 0.])
+            entry[0] += calls
+            entry[1] += seconds
+
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+        for name, (n, total, lo, hi) in other.values.items():
+            entry = self.values.get(name)
+            self.values[name] = [n, total, lo, hi] if entry is None else \
+                    [entry[0] + n, entry[1] + total, min(entry[2], lo), max(entry[3], hi)]
+
+    def summary(self):
+        # plain (JSON serializable) dict of everything recorded
+        return {
+            "stages": {stage: {"calls": calls, "seconds": seconds}
+                       for stage, (calls, seconds) in self.stages.items()},
+            "counters": dict(self.counters),
+            "values": {name: {"count": n, "mean": total / n, "min": float(lo), "max": float(hi)}
+                       for name, (n, total, lo, hi) in self.values.items()},
+        }
+
+
+@contextlib.contextmanager
+def record(callback=None):
+    # Record within the block into a new Recorder (yielded). At the end,
+    # `callback(summary)` is called (e.g. to feed a metrics exporter), and an
+    # enclosing `record` block receives everything recorded here as well.
+    global recorder
+
+    previous = recorder
+    rec = recorder = Recorder()
+
+    try:
+        yield rec
+    finally:
+        recorder = previous
+        if previous is not None:
+            previous.merge(rec)
+
+        if callback is not None:
+            callback(rec.summary())
+
+
+def log_summary(logger, level=20):
+    # `record` callback writing one line per stage, counter and value to `logger`
+    def _callback(summary):
+        for stage, entry in summary["stages"].items():
+            logger.log(level, "stage %s: %d calls, %.6f s", stage, entry["calls"], entry["seconds"])
+        for name, n in summary["counters"].items():
+            logger.log(level, "counter %s: %d", name, n)
+        for name, entry in summary["values"].items():
+            logger.log(level, "value %s: n=%d mean=%.6g min=%.6g max=%.6g", name,
+                       entry["count"], entry["mean"], entry["min"], entry["max"])
+
+    return _callback
+
+
+def timed(stage):
+    # decorator adding the wall time of every call to `stage`
+    def _decorate(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            rec = recorder
+            if rec is None:
+                return func(*args, **kwargs)
+
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                rec.add_time(stage, perf_counter() - start)
+
+        return _wrapper
+
+    return _decorate
+
+
+def count(name, n=1):
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def observe(name, values):
+    if recorder is not None:
+        recorder.observe(name, values)
+
+
+def call_recorded(func, *args):
+    # Run `func(*args)` (in a pool worker) recording into a fresh Recorder,
+    # returns (result, recorder) for `merge`.
+    with record() as rec:
+        result = func(*args)
+
+    return result, rec
+
+
+def merge(rec):
+    if recorder is not None:
+        recorder.merge(rec)
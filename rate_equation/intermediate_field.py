@@ -0,0 +1,287 @@
+import numpy as np
+from collections import namedtuple
+
+from rate_equation.atomic_data import LINES, hyperfine_levels, hyperfine_shift, group_frequency, \
+        ground_label, excited_label, m_values
+from rate_equation.detuning import Detuning
+from rate_equation.transition_profile import TransitionProfile, State, TransitionGroupLabel, Transition
+from rate_equation.wigner import wigner_3j, hyperfine_amplitudes
+
+# Eigensystems of both fine-structure levels for an array of fields B.
+#   ground_energies, excited_energies: (n_B, N) level energies (Hz, relative
+#       to the fine-structure level), one column per |F, m> label
+#   ground_vectors, excited_vectors: dict m -> (n_B, k, k) eigenvectors of the
+#       block of that m in the |F, m> basis, column i labelled by the i-th F
+Eigensystem = namedtuple("Eigensystem", ["ground_energies", "excited_energies", "ground_vectors", "excited_vectors"])
+
+
+class _FineStructureLevel:
+    # Hyperfine + Zeeman Hamiltonian of one fine-structure level in the
+    # |F, m> basis of all its hyperfine levels,
+    #   H = A I.J + B Q + mu_B g_J J_z B_z  (nuclear Zeeman term neglected).
+    # m = m_I + m_J is conserved along the field, so H is block diagonal in m.
+
+    def __init__(self, nuclear_spin, j, a, b, g_j):
+        from scipy.constants import physical_constants, h
+
+        self.fs = hyperfine_levels(nuclear_spin, j)
+        self.states = [(f, m) for f in self.fs for m in m_values(f)]
+        self.index = {s: n for n, s in enumerate(self.states)}
+
+        energies = {f: hyperfine_shift(a, b, nuclear_spin, j, f) for f in self.fs}
+        mu_b_over_h = physical_constants['Bohr magneton'][0] / h
+
+        self.blocks = {}  # m -> (F basis, hyperfine energies, Zeeman matrix per Tesla, state indices)
+        for m in m_values(max(self.fs)):
+            basis = [f for f in self.fs if f >= abs(m)]
+
+            m_j = np.array([j - n for n in range(int(round(2 * j)) + 1)])
+            # <J m_J, I m-m_J | F m>, shape (k, 2J+1)
+            cg = np.array([(-1.) ** np.rint(j - nuclear_spin + m) * np.sqrt(2 * f + 1)
+                           * wigner_3j(j, nuclear_spin, f, m_j, m - m_j, -m) for f in basis])
+
+            zeeman = mu_b_over_h * g_j * (cg * m_j) @ cg.T
+
+            self.blocks[m] = (basis, np.array([energies[f] for f in basis]), zeeman,
+                              np.array([self.index[(f, m)] for f in basis]))
+
+        self.zero_field_energies = np.array([energies[f] for f, _ in self.states])
+
+    def diagonalize(self, b_fields):
+        # Energies (n_B, N) and eigenvectors {m: (n_B, k, k)} for 1-d `b_fields`.
+        #
+        # States of equal m never cross as B varies (they are coupled by H),
+        # so each eigenvector keeps the rank of its energy within its block
+        # for all B. Ranking the zero-field energies therefore labels the
+        # eigenvectors of every B with the |F, m> they connect to
+        # adiabatically, without following the sweep point by point. The sign
+        # of each eigenvector is fixed by a non-negative component on its own
+        # label.
+        energies = np.empty((len(b_fields), len(self.states)))
+        vectors = {}
+
+        for m, (basis, hf_energies, zeeman, indices) in self.blocks.items():
+            hamiltonian = np.diag(hf_energies) + b_fields[:, np.newaxis, np.newaxis] * zeeman
+            w, v = np.linalg.eigh(hamiltonian)
+
+            rank = np.argsort(np.argsort(hf_energies))
+            w, v = w[:, rank], v[:, :, rank]
+
+            diag = np.arange(len(basis))
+            v = v * np.where(v[:, diag, diag] < 0, -1., 1.)[:, np.newaxis, :]
+
+            energies[:, indices] = w
+            vectors[m] = v
+
+        return energies, vectors
+
+
+class IntermediateField:
+    # Field-dependent level structure of `line` (a name in LINES or an
+    # AtomicLine) for magnetic fields where |F, m_F> are no longer the
+    # eigenstates (intermediate field up to Paschen-Back regime).
+    #
+    # `profile` is the TransitionProfile of the hyperfine levels `ground_fs`
+    # -> `excited_fs` (default: all), as from `atomic_data.build_profile`, but
+    # with every pair of states with |delta_m| <= 1 as a transition (zero
+    # strength at zero field if forbidden there). Its states stand for the
+    # eigenstates adiabatically connected to them. Use it with an
+    # `IntermediateFieldDetuning` in place of a ZeemanDetuning.
+    #
+    # The Hamiltonians of both fine-structure levels (all hyperfine levels,
+    # also those not in `profile`) are diagonalized for whole arrays of B with
+    # a batched `np.linalg.eigh`, one call per m block. Eigensystems are cached
+    # per field value; with `b_resolution` (T), fields are rounded to its
+    # multiples first, so that nearby points of a sweep share one
+    # eigensystem (at the price of a shift error up to ~14 GHz/T *
+    # b_resolution / 2).
+
+    def __init__(self, line, ground_fs=None, excited_fs=None, b_resolution=None, cache_size=100000):
+        line = LINES[line] if isinstance(line, str) else line
+        i = line.nuclear_spin
+
+        self.line = line
+        self.b_resolution = b_resolution
+        self.cache_size = cache_size
+
+        self.ground = _FineStructureLevel(i, line.j_ground, line.a_ground, 0, line.g_j_ground)
+        self.excited = _FineStructureLevel(i, line.j_excited, line.a_excited, line.b_excited, line.g_j_excited)
+
+        ground_fs = self.ground.fs if ground_fs is None else ground_fs
+        excited_fs = self.excited.fs if excited_fs is None else excited_fs
+
+        ground_states = [State(ground_label(f), m) for f in ground_fs for m in m_values(f)]
+        excited_states = [State(excited_label(f), m) for f in excited_fs for m in m_values(f)]
+
+        transitions = []
+        frequencies = {}
+        self._trans_states = []  # (ground (F, m), excited (F', m')) of every transition
+
+        for f_g in ground_fs:
+            for f_e in excited_fs:
+                grp = TransitionGroupLabel(ground_label(f_g), excited_label(f_e))
+                frequencies[grp] = group_frequency(line, f_g, f_e)
+
+                amplitudes = hyperfine_amplitudes(i, line.j_ground, line.j_excited, f_g, f_e)
+
+                for n_g, m_g in enumerate(m_values(f_g)):
+                    for n_e, m_e in enumerate(m_values(f_e)):
+                        if abs(m_e - m_g) > 1:
+                            continue
+
+                        transitions.append(Transition(State(grp.ground_state_hyperfine, m_g),
+                                                      State(grp.excited_state_hyperfine, m_e),
+                                                      grp, m_e - m_g, amplitudes[n_g, n_e] ** 2))
+                        self._trans_states.append(((f_g, m_g), (f_e, m_e)))
+
+        self.profile = TransitionProfile(ground_states, excited_states, transitions, frequencies, line.gamma)
+
+        # the profile's transitions may be ordered differently from `transitions`
+        trans_states = {(t.ground_state, t.excited_state): s for t, s in zip(transitions, self._trans_states)}
+        self._trans_states = [trans_states[(t.ground_state, t.excited_state)] for t in self.profile.transitions]
+        self.transition_index = {(t.ground_state, t.excited_state): n
+                                 for n, t in enumerate(self.profile.transitions)}
+
+        raw = np.array([t.strength for t in transitions])
+        self._scale = self.profile.trans_strength.max() / raw.max()  # normalization of `profile`
+
+        self._compile_dipole_blocks()
+        self._cache = {}  # B -> flattened eigensystem
+
+    def _compile_dipole_blocks(self):
+        # Transitions grouped by the pair of m blocks they connect, with the
+        # dipole matrix elements between the |F, m> bases of the two blocks.
+        i, line = self.line.nuclear_spin, self.line
+        self._dipole_blocks = []
+
+        pairs = {}
+        for t, ((f_g, m_g), (f_e, m_e)) in enumerate(self._trans_states):
+            pairs.setdefault((m_g, m_e), []).append(t)
+
+        for (m_g, m_e), trans in pairs.items():
+            basis_g = self.ground.blocks[m_g][0]
+            basis_e = self.excited.blocks[m_e][0]
+
+            dipole = np.zeros((len(basis_g), len(basis_e)))
+            for a, f_g in enumerate(basis_g):
+                for b, f_e in enumerate(basis_e):
+                    amplitudes = hyperfine_amplitudes(i, line.j_ground, line.j_excited, f_g, f_e)
+                    dipole[a, b] = amplitudes[m_values(f_g).index(m_g), m_values(f_e).index(m_e)]
+
+            pos_g = np.array([basis_g.index(self._trans_states[t][0][0]) for t in trans])
+            pos_e = np.array([basis_e.index(self._trans_states[t][1][0]) for t in trans])
+
+            self._dipole_blocks.append((m_g, m_e, dipole, np.array(trans), pos_g, pos_e))
+
+    def eigensystem(self, b_fields):
+        # `Eigensystem` for the 1-d array `b_fields` (T). Field values missing
+        # from the cache are diagonalized together in one batch.
+        b_fields = np.asarray(b_fields, dtype=float).ravel()
+        if self.b_resolution:
+            b_fields = np.round(b_fields / self.b_resolution) * self.b_resolution
+
+        keys = b_fields.tolist()
+        missing = np.unique([b for b in keys if b not in self._cache])
+
+        if len(missing):
+            if len(self._cache) + len(missing) > self.cache_size:
+                self._cache.clear()
+
+            for b, row in zip(missing.tolist(), self._flatten(*self.ground.diagonalize(missing),
+                                                              *self.excited.diagonalize(missing))):
+                self._cache[b] = row
+
+        rows = np.stack([self._cache[b] for b in keys]) if keys else np.empty((0, 0))
+
+        return self._unflatten(rows)
+
+    def _flatten(self, gnd_energies, gnd_vectors, exc_energies, exc_vectors):
+        # one row per field: energies, then all eigenvector blocks
+        parts = [gnd_energies, exc_energies]
+        parts += [v.reshape((len(v), -1)) for v in gnd_vectors.values()]
+        parts += [v.reshape((len(v), -1)) for v in exc_vectors.values()]
+
+        return np.concatenate(parts, axis=1)
+
+    def _unflatten(self, rows):
+        n_g, n_e = len(self.ground.states), len(self.excited.states)
+        offset = n_g + n_e
+
+        vectors = []
+        for level in (self.ground, self.excited):
+            level_vectors = {}
+            for m, (basis, _, _, _) in level.blocks.items():
+                k = len(basis)
+                level_vectors[m] = rows[:, offset:offset + k * k].reshape((len(rows), k, k))
+                offset += k * k
+            vectors.append(level_vectors)
+
+        return Eigensystem(rows[:, :n_g], rows[:, n_g:n_g + n_e], *vectors)
+
+    def transition_data(self, b_fields):
+        # Frequency shifts (Hz, relative to the zero-field transition
+        # frequencies of `profile`) and normalized strengths of all
+        # transitions of `profile`, both of shape np.shape(b_fields) + (N_trans,).
+        b_fields = np.asarray(b_fields, dtype=float)
+        eig = self.eigensystem(b_fields)
+
+        ground_idx = np.array([self.ground.index[g] for g, _ in self._trans_states])
+        excited_idx = np.array([self.excited.index[e] for _, e in self._trans_states])
+
+        shifts = (eig.excited_energies - self.excited.zero_field_energies)[:, excited_idx] \
+            - (eig.ground_energies - self.ground.zero_field_energies)[:, ground_idx]
+
+        strengths = np.empty(shifts.shape)
+        for m_g, m_e, dipole, trans, pos_g, pos_e in self._dipole_blocks:
+            # dipole matrix elements between the eigenvectors of both blocks
+            elements = np.matmul(np.swapaxes(eig.ground_vectors[m_g], -1, -2), dipole @ eig.excited_vectors[m_e])
+            strengths[:, trans] = elements[:, pos_g, pos_e] ** 2
+
+        shape = b_fields.shape + (len(self._trans_states),)
+
+        return shifts.reshape(shape), (strengths * self._scale).reshape(shape)
+
+    def transition_shifts(self, b_fields):
+        return self.transition_data(b_fields)[0]
+
+    def transition_strengths(self, b_fields):
+        return self.transition_data(b_fields)[1]
+
+
+class IntermediateFieldDetuning(Detuning):
+    # Detuning (and state mixing) of the transitions of `model.profile` at
+    # magnetic field `b_field` (T), the replacement of ZeemanDetuning for an
+    # `IntermediateField`. Like there, `b_field` may be an array broadcasting
+    # against (..., N_trans), e.g. of shape (n_points, 1, 1) in a sweep.
+
+    def __init__(self, model, b_field):
+        self.model = model
+        self.b_field = b_field
+
+    def with_b_field(self, b_field):
+        return IntermediateFieldDetuning(self.model, b_field)
+
+    def _per_transition(self, trans_profile, data):
+        assert trans_profile is self.model.profile, "Detuning belongs to another transition profile."
+
+        b_field = np.asarray(self.b_field, dtype=float)
+        if b_field.ndim == 0:
+            return self.model.transition_data(b_field)[data]
+
+        assert b_field.shape[-1] == 1, "b_field must broadcast against (..., N_trans)."
+
+        return self.model.transition_data(b_field[..., 0])[data]
+
+    def get_detuning(self, field_freq, ground_state, excited_state, field_direction=1):
+        t = self.model.transition_index[(ground_state, excited_state)]
+
+        return self.model.transition_shifts(self.b_field)[..., t]
+
+    def get_detuning_array(self, field_freqs, trans_profile, field_directions=1):
+        return self._per_transition(trans_profile, 0)
+
+    def get_transition_strengths(self, trans_profile):
+        return self._per_transition(trans_profile, 1)
+
+    def cache_key(self):
+        return (type(self).__name__, self.model, self.b_field)
@@ -1,7 +1,12 @@
 import numpy as np
 from collections import namedtuple
 
-RadiationField = namedtuple("RadiationField", ["frequency", "delta_m", "normalized_intensity"])
+from rate_equation import instrumentation
+
+# direction - +1 (-1) for a field propagating along (against) the axis that
+#   velocities and forces are projected on
+RadiationField = namedtuple("RadiationField", ["frequency", "delta_m", "normalized_intensity", "direction"],
+                            defaults=(1,))
 
 
 # some utilities
@@ -28,11 +33,14 @@ class RadiationFieldProfile:
             if field.delta_m != delta_m:
                 continue
 
+            instrumentation.count("get_detuning", len(detunings))
+
             field_freq = field.frequency
 
             det = base_frequency - field_freq
 
-            det += sum([ det.get_detuning(field_freq, transition.ground_state, transition.excited_state) \
+            det += sum([ det.get_detuning(field_freq, transition.ground_state, transition.excited_state,
+                                          field.direction) \
                     for det in detunings ])
 
             i_sat_ratio = field.normalized_intensity
@@ -41,3 +49,100 @@ class RadiationFieldProfile:
 
         return tot_Gamma_p
 
+    @instrumentation.timed("scattering_rates")
+    def get_effective_scattering_rate_array(self, trans_profile, detunings, frequencies=None,
+                                            normalized_intensities=None, per_field=False, transitions=None):
+        # Vectorized `get_effective_scattering_rate` over all transitions of
+        # `trans_profile`, returns shape (..., N_trans), or with `per_field`
+        # the contribution of every field, shape (..., N_fields, N_trans).
+        # `frequencies` and `normalized_intensities` (shape (..., N_fields))
+        # override those of the fields, their leading axes (and those of the
+        # detuning parameters) become the leading axes of the result.
+        # `transitions` (index array) restricts the result to those transitions.
+        if transitions is None:
+            transitions = slice(None)
+
+        det, i_sat_ratio, allowed = self._detuning_array(trans_profile, detunings, frequencies,
+                                                         normalized_intensities, transitions)
+
+        Gamma_p = _lorentzian(det, trans_profile.gamma, i_sat_ratio)
+        Gamma_p = np.where(allowed, Gamma_p, 0)
+
+        if per_field:
+            return Gamma_p
+
+        return Gamma_p.sum(axis=-2)
+
+    @instrumentation.timed("scattering_rates")
+    def get_scattering_rate_derivative_array(self, trans_profile, detunings, frequencies=None,
+                                             normalized_intensities=None):
+        # Per-field scattering rates as from `get_effective_scattering_rate_array`
+        # with `per_field`, and their partial derivatives with respect to the
+        # detuning and to the normalized intensity of the field, all of shape
+        # (..., N_fields, N_trans).
+        det, i_sat_ratio, allowed = self._detuning_array(trans_profile, detunings, frequencies,
+                                                         normalized_intensities, slice(None))
+
+        return tuple(np.where(allowed, x, 0)
+                     for x in _lorentzian_derivatives(det, trans_profile.gamma, i_sat_ratio))
+
+    def get_detuning_array(self, trans_profile, detunings, frequencies=None, transitions=None):
+        # Detuning (Hz) of every transition of `trans_profile` from every
+        # field, shifts of `detunings` included, shape (..., N_fields, N_trans)
+        # (`frequencies` and `transitions` as in
+        # `get_effective_scattering_rate_array`).
+        if frequencies is None:
+            frequencies = [field.frequency for field in self.fields]
+
+        if transitions is None:
+            transitions = slice(None)
+
+        field_freqs = np.asarray(frequencies, dtype=float)[..., np.newaxis]  # (..., N_fields, 1)
+        directions = np.array([field.direction for field in self.fields], dtype=float)[:, np.newaxis]
+
+        det = trans_profile.trans_frequency[transitions] - field_freqs
+
+        return det + _detuning_shifts(detunings, field_freqs, trans_profile, directions, transitions)
+
+    def _detuning_array(self, trans_profile, detunings, frequencies, normalized_intensities, transitions):
+        # detunings (..., N_fields, N_trans), saturation parameters
+        # (..., N_fields, 1) and the mask of transitions driven by each field
+        if normalized_intensities is None:
+            normalized_intensities = [field.normalized_intensity for field in self.fields]
+
+        i_sat_ratio = np.asarray(normalized_intensities, dtype=float)[..., np.newaxis]
+        delta_m = np.array([field.delta_m for field in self.fields], dtype=int)
+
+        det = self.get_detuning_array(trans_profile, detunings, frequencies, transitions)
+
+        return det, i_sat_ratio, delta_m[:, np.newaxis] == trans_profile.trans_delta_m[transitions]
+
+@instrumentation.timed("detuning")
+def _detuning_shifts(detunings, field_freqs, trans_profile, directions, transitions):
+    total = 0
+    for detuning in detunings:
+        shift = np.asarray(detuning.get_detuning_array(field_freqs, trans_profile, directions))
+        assert shift.ndim and shift.shape[-1] in (1, len(trans_profile.transitions)), \
+            "get_detuning_array must return a last axis of length N_trans or 1."
+
+        if shift.shape[-1] != 1:
+            shift = shift[..., transitions]
+
+        total = total + shift
+
+    return total
+
+
+@instrumentation.timed("lorentzian")
+def _lorentzian(det, gamma, i_sat_ratio):
+    return np.pi * gamma * i_sat_ratio / (1 + i_sat_ratio + (2*det / gamma)**2)
+
+
+def _lorentzian_derivatives(det, gamma, i_sat_ratio):
+    # the Lorentzian L of `_lorentzian` with dL/d(det) and dL/d(i_sat_ratio)
+    broadening = 1 + (2*det / gamma)**2
+    denominator = broadening + i_sat_ratio
+
+    return (np.pi * gamma * i_sat_ratio / denominator,
+            -8 * np.pi * i_sat_ratio * det / (gamma * denominator**2),
+            np.pi * gamma * broadening / denominator**2)
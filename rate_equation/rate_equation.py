@@ -1,9 +1,24 @@
-import itertools
+import copy
 import numpy as np
-from scipy.linalg import null_space
+from collections import namedtuple
+from scipy import sparse as sp
 
+from rate_equation import instrumentation
 from rate_equation.transition_profile import Transition, TransitionProfile
-from rate_equation.radiation_field import RadiationField
+from rate_equation.radiation_field import RadiationField, RadiationFieldProfile
+from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+from rate_equation.intermediate_field import IntermediateFieldDetuning
+from rate_equation.solver import steady_state, steady_state_derivative, evolve
+from rate_equation.executor import grid_axes, grid_points
+
+# Result of `RateEquation.gradient` for n_points parameter points and the
+# n_params parameters listed in `parameters`, as (name, field index) pairs
+# (field index None for "b_field" and "velocity"):
+#   populations (n_points, N_g), force and scattering (n_points,)
+#   d_populations (n_points, n_params, N_g), d_force and d_scattering
+#   (n_points, n_params), d_scattering_rates (n_points, n_params, N_fields, N_trans)
+Gradient = namedtuple("Gradient", ["parameters", "populations", "force", "scattering", "d_populations", "d_force",
+                                   "d_scattering", "d_scattering_rates"])
 
 
 class RateEquation:
@@ -12,42 +27,364 @@ class RateEquation:
     #    (j: all ground states, k: all excited states)
     # Out = Gn \sum_k Rnk \beta_nk (1 - \beta_nk)
     #    (k: all excited states)
+    #
+    # With `sparse`, rate matrices are assembled as scipy.sparse CSR matrices
+    # (lists of them for sweeps), and steady state and time evolution use
+    # sparse LU and expm_multiply. Memory and time then scale with the number
+    # of transitions rather than N_g^2, which pays off for large manifolds.
+    #
+    # Fields and detunings can be changed through `set_field` and
+    # `set_detuning`. Only the scattering rates of the affected
+    # (transition group, delta_m) blocks are then recomputed, and the rate
+    # matrix is patched in place on the next `build_matrix`. Once most
+    # transitions are affected (e.g. by any detuning change), patching costs
+    # more than it saves, and everything is rebuilt instead.
+    #
+    # Detunings that also mix the states (`IntermediateFieldDetuning`) set
+    # field-dependent transition strengths, which replace those of the
+    # transition profile everywhere (including sweeps over b_field).
 
-    def __init__(self, trans_profile, radiation_field_profile, detunings):
+    def __init__(self, trans_profile, radiation_field_profile, detunings, sparse=False):
         self.trans_profile = trans_profile
         self.radiation = radiation_field_profile
         self.detunings = detunings
-        self.pump_terms = {es: self.build_pump_terms(es) for es in self.trans_profile.excited_states}
+        self.sparse = sparse
+
+        tp = trans_profile
+        self._blocks = {}  # (group index, delta_m) -> transition indices
+        for t, block in enumerate(zip(tp.trans_group.tolist(), tp.trans_delta_m.tolist())):
+            self._blocks.setdefault(block, []).append(t)
+
+        self._stale = set()
+        self._matrix = None
+        self._pump_terms = None
+        self._pump_rates = None
+        self._set_strengths(self.transition_strengths(detunings))
+        self._field_rates = self.build_scattering_rates()  # (N_fields, N_trans)
+        self._rates = self._field_rates.sum(axis=0)
+
+    @property
+    def field_scattering_rates(self):
+        self._refresh()
+        return self._field_rates
+
+    @property
+    def scattering_rates(self):
+        self._refresh()
+        return self._rates
+
+    @property
+    def transition_pump_rates(self):
+        # P_t = R_t \beta_t of every transition, shape (N_trans,)
+        self._refresh()
+        if self._pump_rates is None:
+            self._pump_rates = self._rates * self._strengths
+
+        return self._pump_rates
+
+    @property
+    def pump_terms(self):
+        # label-keyed view of `transition_pump_rates`:
+        # {excited state: {ground state: pump term}}
+        self._refresh()
+        if self._pump_terms is None:
+            self._pump_terms = {es: self.build_pump_terms(es) for es in self.trans_profile.excited_states}
+
+        return self._pump_terms
+
+    def set_field(self, index, **params):
+        # Change parameters (e.g. frequency=..., normalized_intensity=...) of
+        # radiation field `index`. The radiation field profile is replaced, not
+        # modified, as it may be shared with other rate equations.
+        fields = list(self.radiation.fields)
+        old, fields[index] = fields[index], fields[index]._replace(**params)
+        self.radiation = RadiationFieldProfile(fields)
+
+        self._stale.update(block for block in self._blocks if block[1] in (old.delta_m, fields[index].delta_m))
+
+    def set_detuning(self, index, detuning=None, **params):
+        # Replace detuning `index` with `detuning`, or with a copy of it with
+        # changed parameters (e.g. b_field=...).
+        if detuning is not None and params:
+            raise ValueError("Pass either a detuning or parameters to change, not both.")
+
+        if detuning is None:
+            detuning = copy.copy(self.detunings[index])
+            for name, value in params.items():
+                setattr(detuning, name, value)
+
+        self.detunings = list(self.detunings)
+        self.detunings[index] = detuning
+
+        self._stale.update(self._blocks)
+
+        strengths = self.transition_strengths(self.detunings)
+        if not np.array_equal(strengths, self._strengths):
+            self._set_strengths(strengths)
+            self._matrix = None
+
+    def transition_strengths(self, detunings=None):
+        # normalized strengths of all transitions under `detunings` (default:
+        # those of this rate equation), shape (..., N_trans)
+        detunings = self.detunings if detunings is None else detunings
+        strengths = [det.get_transition_strengths(self.trans_profile) for det in detunings]
+        strengths = [s for s in strengths if s is not None]
+        assert len(strengths) <= 1, "Only one detuning may set the transition strengths."
+
+        return np.asarray(strengths[0], dtype=float) if strengths else self.trans_profile.trans_strength
+
+    def _set_strengths(self, strengths):
+        tp = self.trans_profile
+        self._strengths = strengths
+        self._branching_ratio = np.zeros(tp.branching_ratio.shape)
+        self._branching_ratio[tp.trans_ground, tp.trans_excited] = strengths
+        self._pump_terms = None
+        self._pump_rates = None
+
+    def _refresh(self):
+        # recompute the scattering rates of stale blocks and patch the matrix
+        # (or rebuild both if most transitions are stale)
+        if not self._stale:
+            return
+
+        tp = self.trans_profile
+        trans = np.unique(np.concatenate([self._blocks[block] for block in self._stale]))
+        self._stale.clear()
+
+        if 2 * len(trans) > len(tp.transitions):
+            self._field_rates = self.build_scattering_rates()
+            self._rates = self._field_rates.sum(axis=0)
+            self._pump_terms = None
+            self._pump_rates = None
+            self._matrix = None
+            return
+
+        field_rates = self.radiation.get_effective_scattering_rate_array(tp, self.detunings, per_field=True,
+                                                                         transitions=trans)
+        rates = field_rates.sum(axis=0)
+        delta = (rates - self._rates[trans]) * self._strengths[trans]
+
+        self._field_rates[:, trans] = field_rates
+        self._rates[trans] = rates
+        self._pump_terms = None
+        self._pump_rates = None
+
+        if self._matrix is None:
+            return
+
+        if self.sparse:
+            self._matrix = None
+            return
+
+        # G = \beta P^T - diag(\sum_k P_nk), P_jk changed by `delta` for transitions j -> k
+        gnd = tp.trans_ground[trans]
+        np.add.at(self._matrix, (slice(None), gnd), self._branching_ratio[:, tp.trans_excited[trans]] * delta)
+        np.add.at(self._matrix, (gnd, gnd), -delta)
+
+    def build_scattering_rates(self):
+        # contribution of every field to R_jk of every transition in
+        # `trans_profile.transitions`
+        return self.radiation.get_effective_scattering_rate_array(self.trans_profile, self.detunings,
+                                                                  per_field=True)
 
     def build_matrix(self):
-        ground_states = self.trans_profile.ground_states
-        num_of_gs = len(ground_states)
+        self._refresh()
+        if self._matrix is None:
+            self._matrix = self.assemble_matrix(self._rates)
+
+        return self._matrix.copy()
+
+    def sweep(self, field_frequency=None, normalized_intensity=None, b_field=None, velocity=None):
+        # Rate matrices for a set of parameter points, shape (n_points, N_g, N_g)
+        # (a list of n_points sparse matrices with `sparse`).
+        #
+        # Each given parameter is an array with one entry per point. For the
+        # radiation fields, a 1-d array applies to every field, while an array
+        # of shape (n_points, N_fields) sets each field separately. `b_field`
+        # replaces the field of the `ZeemanDetuning`, `velocity` the one of the
+        # `DopplerDetuning` (added if there is none). Parameters not given
+        # keep the values of this rate equation.
+        rates = self.sweep_scattering_rates(field_frequency, normalized_intensity, b_field, velocity)
+
+        return self.assemble_matrix(rates.sum(axis=-2), self.sweep_transition_strengths(b_field))
+
+    def sweep_scattering_rates(self, field_frequency=None, normalized_intensity=None, b_field=None,
+                               velocity=None):
+        # Contribution of every field to the scattering rate of every
+        # transition for the parameter points of `sweep`, shape
+        # (n_points, N_fields, N_trans).
+        detunings, frequencies, intensities, n_points = self._sweep_arguments(field_frequency, normalized_intensity,
+                                                                              b_field, velocity)
+        if n_points is None:
+            return self.field_scattering_rates[np.newaxis]
+
+        rates = self.radiation.get_effective_scattering_rate_array(self.trans_profile, detunings,
+                                                                   frequencies, intensities, per_field=True)
+
+        return np.broadcast_to(rates, (n_points,) + self.field_scattering_rates.shape)
+
+    def sweep_detunings(self, field_frequency=None, b_field=None, velocity=None):
+        # Detuning (Hz) of every transition from every field, Zeeman and
+        # Doppler shifts included, for the parameter points of `sweep`, shape
+        # (n_points, N_fields, N_trans) (n_points = 1 if nothing is swept).
+        detunings, frequencies, _, n_points = self._sweep_arguments(field_frequency, None, b_field, velocity)
+        det = self.radiation.get_detuning_array(self.trans_profile, detunings, frequencies)
+
+        return np.broadcast_to(det, (n_points or 1,) + self._field_rates.shape)
+
+    def _sweep_arguments(self, field_frequency, normalized_intensity, b_field, velocity):
+        # detunings, field frequencies and intensities for the parameter points
+        # of `sweep`, and the number of points (None if nothing is swept)
+        fields = self.radiation.fields
+        frequencies = np.array([field.frequency for field in fields], dtype=float)
+        intensities = np.array([field.normalized_intensity for field in fields], dtype=float)
+        detunings = list(self.detunings)
+        n_points = []
+
+        def _field_param(value, default):
+            value = np.asarray(value, dtype=float)
+            if value.ndim == 1:
+                value = value[:, np.newaxis]
+            assert value.ndim == 2, "Field parameters must be of shape (n_points,) or (n_points, N_fields)."
+            n_points.append(value.shape[0])
+
+            return np.broadcast_to(value, (value.shape[0], len(default)))
+
+        def _point_param(value):
+            value = np.asarray(value, dtype=float)
+            assert value.ndim == 1, "Detuning parameters must be of shape (n_points,)."
+            n_points.append(value.shape[0])
+
+            return value[:, np.newaxis, np.newaxis]  # broadcast against (n_points, N_fields, N_trans)
+
+        if field_frequency is not None:
+            frequencies = _field_param(field_frequency, frequencies)
+
+        if normalized_intensity is not None:
+            intensities = _field_param(normalized_intensity, intensities)
+
+        if b_field is not None:
+            for i in self._b_field_detunings():
+                detunings[i] = detunings[i].with_b_field(_point_param(b_field))
+
+        if velocity is not None:
+            detunings = [det for det in detunings if not isinstance(det, DopplerDetuning)]
+            detunings.append(DopplerDetuning(_point_param(velocity)))
+
+        assert len(set(n_points)) <= 1, "All swept parameters must have the same number of points."
+
+        return detunings, frequencies, intensities, n_points[0] if n_points else None
+
+    def iter_sweep(self, axes, chunk_size=10000, t_eval=None, p0=None):
+        # Streaming sweep over the outer-product grid of `axes`, an ordered
+        # dict of `sweep` parameter name to its values (as for SweepExecutor).
+        # Yields (start, populations) for consecutive chunks of `chunk_size`
+        # grid points (flattened in C order): steady-state populations of
+        # shape (n, N_g) (NaN if not unique), or with `t_eval`, populations
+        # evolved from `p0` (default: uniform), shape (n, len(t_eval), N_g).
+        # Only one chunk is held in memory at a time.
+        axes, shape = grid_axes(axes)
+        num_of_points = int(np.prod(shape))
+
+        if t_eval is not None and p0 is None:
+            p0 = np.full(len(self.trans_profile.ground_states), 1 / len(self.trans_profile.ground_states))
+
+        return self._iter_sweep(axes, shape, num_of_points, chunk_size, t_eval, p0)
 
-        mat = np.zeros((num_of_gs, num_of_gs))
+    def _iter_sweep(self, axes, shape, num_of_points, chunk_size, t_eval, p0):
+        # generator behind `iter_sweep`, so that its axes are checked when it is called
+        for start in range(0, num_of_points, chunk_size):
+            mats = self.sweep(**grid_points(axes, shape, start, min(start + chunk_size, num_of_points)))
 
-        inds = np.arange(num_of_gs)
+            if t_eval is None:
+                yield start, steady_state(mats, on_degenerate="nan")
+            else:
+                yield start, evolve(mats, p0, t_eval)
 
-        for i, j in itertools.product(inds, inds):
-            mat[i][j] = self.calculate_matrix_element(ground_states[i], ground_states[j])
+    def sweep_transition_strengths(self, b_field=None):
+        # Transition strengths for the points of a sweep over `b_field`, shape
+        # (n_points, N_trans), or (N_trans,) if they do not depend on it.
+        if b_field is not None:
+            detunings = list(self.detunings)
+            for i in self._b_field_detunings():
+                detunings[i] = detunings[i].with_b_field(np.asarray(b_field, dtype=float)[:, np.newaxis])
+
+            return self.transition_strengths(detunings)
+
+        return self._strengths
+
+    def _b_field_detunings(self):
+        b_field_dets = [i for i, det in enumerate(self.detunings)
+                        if isinstance(det, (ZeemanDetuning, IntermediateFieldDetuning))]
+        assert b_field_dets, "Sweeping b_field requires a ZeemanDetuning or IntermediateFieldDetuning."
+
+        return b_field_dets
+
+    @instrumentation.timed("matrix_assembly")
+    def assemble_matrix(self, scattering_rates, trans_strength=None):
+        # With P_jk = R_jk \beta_jk (pump term of transition j -> k),
+        #   In  (n != j): \sum_k \beta_nk P_jk         -> (\beta P^T)_nj
+        #   Out (n == j): \sum_k P_nk (1 - \beta_nk)   -> (\beta P^T)_nn - \sum_k P_nk
+        # so G = \beta P^T - diag(\sum_k P_nk).
+        # `scattering_rates` may carry leading (sweep) axes: (..., N_trans).
+        # `trans_strength` (default: the current ones) broadcasts against it.
+        tp = self.trans_profile
+        scattering_rates = np.asarray(scattering_rates, dtype=float)
+        trans_strength = self._strengths if trans_strength is None else np.asarray(trans_strength, dtype=float)
+        batch_shape = np.broadcast_shapes(scattering_rates.shape, trans_strength.shape)[:-1]
+
+        instrumentation.count("matrices", int(np.prod(batch_shape)))
+        instrumentation.observe("matrix_size", len(tp.ground_states))
+
+        if self.sparse:
+            if batch_shape:
+                scattering_rates = np.broadcast_to(scattering_rates, batch_shape + scattering_rates.shape[-1:])
+                trans_strength = np.broadcast_to(trans_strength, scattering_rates.shape)
+
+                return [self._assemble_sparse_matrix(rates, strength)
+                        for rates, strength in zip(scattering_rates.reshape((-1, scattering_rates.shape[-1])),
+                                                   trans_strength.reshape((-1, trans_strength.shape[-1])))]
+
+            return self._assemble_sparse_matrix(scattering_rates, trans_strength)
+
+        pump = np.zeros(batch_shape + tp.branching_ratio.shape)
+        pump[..., tp.trans_ground, tp.trans_excited] = scattering_rates * trans_strength
+
+        if trans_strength is self._strengths:
+            branching_ratio = self._branching_ratio
+        else:
+            branching_ratio = np.zeros(trans_strength.shape[:-1] + tp.branching_ratio.shape)
+            branching_ratio[..., tp.trans_ground, tp.trans_excited] = trans_strength
+
+        mat = np.matmul(branching_ratio, np.swapaxes(pump, -1, -2))
+
+        diag = np.arange(len(tp.ground_states))
+        mat[..., diag, diag] -= pump.sum(axis=-1)
 
         return mat
 
+    def _assemble_sparse_matrix(self, scattering_rates, trans_strength):
+        tp = self.trans_profile
+        shape = (len(tp.ground_states), len(tp.excited_states))
+
+        beta = sp.csr_matrix((trans_strength, (tp.trans_ground, tp.trans_excited)), shape=shape)
+        pump = sp.csr_matrix((scattering_rates * trans_strength, (tp.trans_ground, tp.trans_excited)),
+                             shape=shape)
+
+        mat = beta @ pump.T - sp.diags(np.asarray(pump.sum(axis=1)).ravel())
+
+        return mat.tocsr()
+
+    @instrumentation.timed("pump_terms")
     def build_pump_terms(self, excited_state):
         #    pump_term_j_k = Gj \sum_k Rjk \beta_jk
 
-        e_to_all_gs = self.trans_profile.get_exc_to_gnd(excited_state)
-
-        terms = {}
+        tp = self.trans_profile
+        trans = tp.excited_transitions(tp.excited_index[excited_state]).tolist()
 
-        for g_to_e in e_to_all_gs:
-            base_freq = self.trans_profile.frequencies[g_to_e.group]
-            tot_Gamma_p = self.radiation.get_effective_scattering_rate(g_to_e,
-                                                                       base_freq,
-                                                                       self.detunings,
-                                                                       self.trans_profile.gamma)
-            terms[g_to_e.ground_state] = tot_Gamma_p * g_to_e.strength
+        ground_states = [tp.transitions[t].ground_state for t in trans]
 
-        return terms
+        return dict(zip(ground_states, self.transition_pump_rates[trans].tolist()))
 
     def calculate_matrix_element(self, gs1, gs2):
         # d/dt Gn = In - Out
@@ -56,51 +393,157 @@ class RateEquation:
         # Out (j==n) = Gn \sum_k Rnk \beta_nk (1 - \beta_nk)
         #    (k: all excited states)
 
-        gs1_to_es = self.trans_profile.get_gnd_to_exc(gs1)
+        tp = self.trans_profile
+        n1, n2 = tp.ground_index[gs1], tp.ground_index[gs2]
 
-        if gs1 != gs2:
-            # `In` term
-            _in = 0
-
-            for g_to_e in gs1_to_es:  # sum over k
-                pump = self.pump_terms[g_to_e.excited_state].get(gs2, 0)
-                _in += pump * g_to_e.strength
+        trans = tp.ground_transitions(n2)  # sum over k: the transitions of gs2
+        pump = self.transition_pump_rates.take(trans)
+        beta = self._branching_ratio[n1].take(tp.trans_excited.take(trans))
 
-            return _in
+        if n1 != n2:
+            # `In` term
+            return float(pump @ beta)
         else:
             # `Out term`
-            _out = 0
-
-            for g_to_e in gs1_to_es:  # sum over k
-                pump = self.pump_terms[g_to_e.excited_state].get(gs2, 0)
-                _out += pump * (1 - g_to_e.strength)
-
-            return -1 * _out
+            return -float(pump @ (1 - beta))
 
     def calculate_static_state_population(self):
-        mat = self.build_matrix()
+        return steady_state(self.build_matrix())
 
-        equlb = null_space(mat)
-        equlb = equlb / np.sum(equlb)
+    def evolve(self, p0, t_eval, mats=None):
+        # Ground state populations at times `t_eval`, shape (len(t_eval), N_g),
+        # starting from `p0` at t = 0. `mats` can be a stack of matrices (e.g.
+        # from `sweep`) to evolve instead of this rate equation's matrix, the
+        # result is then of shape (n_points, len(t_eval), N_g).
+        if mats is None:
+            mats = self.build_matrix()
 
-        return equlb.flatten()
+        return evolve(mats, p0, t_eval)
 
     def calculate_force(self, ground_state_population):
-        from scipy.constants import h, c
-        ground_states = self.trans_profile.ground_states
+        force, _ = self.force_from_rates(self.field_scattering_rates, ground_state_population)
 
-        force = 0
+        return force
 
-        for gs, popu in zip(ground_states, ground_state_population):
-            g_to_all_es = self.trans_profile.get_gnd_to_exc(gs)
+    def calculate_force_array(self, ground_state_population=None, field_frequency=None,
+                              normalized_intensity=None, b_field=None, velocity=None):
+        # Radiation force (N, signed by the field directions) and total
+        # scattering rate (1/s) for the parameter points of `sweep`, both of
+        # shape (n_points,). If `ground_state_population` (shape (N_g,) or
+        # (n_points, N_g)) is not given, steady-state populations are used.
+        rates = self.sweep_scattering_rates(field_frequency, normalized_intensity, b_field, velocity)
 
-            for g_to_e in g_to_all_es:
-                base_freq = self.trans_profile.frequencies[g_to_e.group]
-                tot_Gamma_p = self.radiation.get_effective_scattering_rate(g_to_e,
-                                                                           base_freq,
-                                                                           self.detunings,
-                                                                           self.trans_profile.gamma)
+        if ground_state_population is None:
+            ground_state_population = steady_state(self.assemble_matrix(rates.sum(axis=-2),
+                                                                        self.sweep_transition_strengths(b_field)))
 
-                force += popu * h * base_freq / c * tot_Gamma_p
+        return self.force_from_rates(rates, ground_state_population)
 
-        return force
+    def gradient(self, field_frequency=None, normalized_intensity=None, b_field=None, velocity=None,
+                 wrt=("frequency", "normalized_intensity")):
+        # Steady-state populations, force and total scattering rate (as from
+        # `calculate_force_array`) with their derivatives with respect to the
+        # parameters in `wrt`, for the parameter points of `sweep`:
+        #   "frequency", "normalized_intensity"  of every radiation field
+        #   "b_field"                             of the ZeemanDetuning
+        #   "velocity"                            (0 without DopplerDetuning)
+        #
+        # The scattering rates are differentiated in closed form from the
+        # Lorentzian, and the steady state by implicit differentiation
+        # (`solver.steady_state_derivative`), for all points and parameters
+        # in one batched pass. G is linear in the scattering rates, so the
+        # derivatives of the rate matrices are
+        # assemble_matrix(d_scattering_rates[:, x].sum(axis=-2)).
+        # Detunings other than DopplerDetuning are taken to be independent of
+        # the field frequency; field-dependent transition strengths
+        # (IntermediateFieldDetuning) are not supported.
+        from scipy.constants import c
+
+        assert set(wrt) <= {"frequency", "normalized_intensity", "b_field", "velocity"}, \
+            f"Unknown parameters {set(wrt)}."
+        assert not any(isinstance(det, IntermediateFieldDetuning) for det in self.detunings), \
+            "Gradients with field-dependent transition strengths are not supported."
+
+        tp = self.trans_profile
+        fields = self.radiation.fields
+        detunings, frequencies, intensities, n_points = self._sweep_arguments(field_frequency, normalized_intensity,
+                                                                              b_field, velocity)
+        shape = (n_points or 1, len(fields), len(tp.transitions))
+
+        rates, d_detuning, d_intensity = [
+            np.broadcast_to(x, shape)
+            for x in self.radiation.get_scattering_rate_derivative_array(tp, detunings, frequencies, intensities)]
+
+        directions = np.array([field.direction for field in fields], dtype=float)[:, np.newaxis]
+        field_freqs = np.asarray(frequencies, dtype=float)[..., np.newaxis]
+        velocities = sum(np.asarray(det.velocity, dtype=float) for det in detunings
+                         if isinstance(det, DopplerDetuning))
+
+        parameters = []
+        d_rates = []  # (n_points, n_params, N_fields, N_trans) blocks
+        field_diag = np.eye(len(fields))[:, :, np.newaxis]  # a field parameter only changes its own rates
+
+        if "frequency" in wrt:
+            parameters += [("frequency", f) for f in range(len(fields))]
+            d_rates.append((d_detuning * (directions * velocities / c - 1))[:, np.newaxis] * field_diag)
+
+        if "normalized_intensity" in wrt:
+            parameters += [("normalized_intensity", f) for f in range(len(fields))]
+            d_rates.append(d_intensity[:, np.newaxis] * field_diag)
+
+        if "b_field" in wrt:
+            coeff = sum(self.detunings[i].get_transition_coefficients(tp) for i in self._b_field_detunings())
+            parameters.append(("b_field", None))
+            d_rates.append((d_detuning * coeff)[:, np.newaxis])
+
+        if "velocity" in wrt:
+            parameters.append(("velocity", None))
+            d_rates.append(np.broadcast_to(d_detuning * directions * field_freqs / c, shape)[:, np.newaxis])
+
+        d_rates = np.concatenate(d_rates, axis=1)
+
+        mats = self.assemble_matrix(rates.sum(axis=-2))
+        popu = steady_state(mats)
+        d_popu = steady_state_derivative(mats, self._apply_matrix_derivative(d_rates.sum(axis=-2), popu))
+
+        force, scattering = self.force_from_rates(rates, popu)
+        d_force, d_scattering = [a + b for a, b in zip(self.force_from_rates(d_rates, popu[:, np.newaxis]),
+                                                        self.force_from_rates(rates[:, np.newaxis], d_popu))]
+
+        return Gradient(parameters, popu, force, scattering, d_popu, d_force, d_scattering, d_rates)
+
+    def _apply_matrix_derivative(self, d_scattering_rates, popu):
+        # (dG/dx) p for rate derivatives (..., n_params, N_trans) and populations
+        # (..., N_g), without assembling dG: with dP_t = dR_t \beta_t,
+        #   ((dG/dx) p)_n = \sum_t (\beta_{n e_t} - \delta_{n g_t}) dP_t p_{g_t}
+        tp = self.trans_profile
+        shape = (len(tp.ground_states), len(tp.excited_states))
+        num_of_trans = len(tp.transitions)
+
+        beta = sp.csr_matrix((self._strengths, (tp.trans_ground, tp.trans_excited)), shape=shape)
+        ground = sp.csr_matrix((np.ones(num_of_trans), (tp.trans_ground, np.arange(num_of_trans))),
+                               shape=(shape[0], num_of_trans))
+        coupling = (beta[:, tp.trans_excited] - ground).tocsr()  # (N_g, N_trans)
+
+        flow = d_scattering_rates * self._strengths * popu[..., np.newaxis, tp.trans_ground]
+        dg_p = coupling @ flow.reshape((-1, num_of_trans)).T
+
+        return np.asarray(dg_p).T.reshape(flow.shape[:-1] + (shape[0],))
+
+    @instrumentation.timed("force")
+    def force_from_rates(self, field_scattering_rates, ground_state_population):
+        # Force and total scattering rate for per-field scattering rates of
+        # shape (..., N_fields, N_trans), as from `sweep_scattering_rates`.
+        # Every scattered photon of a field transfers the momentum h \nu / c
+        # along its direction.
+        from scipy.constants import h, c
+        tp = self.trans_profile
+
+        directions = np.array([field.direction for field in self.radiation.fields], dtype=float)
+
+        popu = np.asarray(ground_state_population, dtype=float)[..., tp.trans_ground]  # (..., N_trans)
+        scattering = field_scattering_rates * popu[..., np.newaxis, :]  # (..., N_fields, N_trans)
+
+        force = np.einsum("...ft,f,t->...", scattering, directions, h * tp.trans_frequency / c)
+
+        return force, scattering.sum(axis=(-2, -1))
@@ -0,0 +1,102 @@
+import numpy as np
+from collections import namedtuple
+from scipy.linalg import expm
+
+from rate_equation.rate_equation import RateEquation
+from rate_equation.radiation_field import RadiationFieldProfile
+from rate_equation.solver import steady_state, evolve
+
+# One piece of a piecewise-constant sequence: during `duration` (in s) the
+# atoms see the fields of `radiation` (a RadiationFieldProfile, None for dark
+# time) and `detunings`.
+Segment = namedtuple("Segment", ["duration", "radiation", "detunings"])
+
+
+class PulseSequence:
+    # A cycle of segments, e.g. pump - dark - repump - probe.
+    #
+    # The propagator exp(G T) of every segment is computed once and cached by
+    # segment configuration (fields, detunings and duration), so segments that
+    # appear several times, or in other sequences sharing the same `cache`
+    # dict, are computed only once. A cycle is then a product of propagators,
+    # and N repetitions a matrix power of the cycle propagator.
+
+    def __init__(self, trans_profile, segments, cache=None):
+        self.trans_profile = trans_profile
+        self.segments = [Segment(*seg) for seg in segments]
+        self._cache = {} if cache is None else cache
+
+    def _config_key(self, segment):
+        radiation = segment.radiation
+        fields = () if radiation is None else tuple(radiation.fields)
+
+        return (self.trans_profile, fields, tuple(det.cache_key() for det in segment.detunings))
+
+    def segment_matrix(self, segment):
+        key = ("matrix",) + self._config_key(segment)
+
+        if key not in self._cache:
+            radiation = segment.radiation
+            if radiation is None:
+                radiation = RadiationFieldProfile([])
+
+            self._cache[key] = RateEquation(self.trans_profile, radiation, segment.detunings).build_matrix()
+
+        return self._cache[key]
+
+    def segment_propagator(self, segment):
+        key = ("propagator", segment.duration) + self._config_key(segment)
+
+        if key not in self._cache:
+            self._cache[key] = expm(self.segment_matrix(segment) * segment.duration)
+
+        return self._cache[key]
+
+    def propagator(self, repetitions=1):
+        # U such that p(after `repetitions` cycles) = U p(0)
+        num_of_gs = len(self.trans_profile.ground_states)
+
+        key = ("cycle", tuple((seg.duration,) + self._config_key(seg) for seg in self.segments))
+
+        if key not in self._cache:
+            cycle = np.eye(num_of_gs)
+            for seg in self.segments:
+                cycle = self.segment_propagator(seg) @ cycle
+
+            self._cache[key] = cycle
+
+        return np.linalg.matrix_power(self._cache[key], repetitions)
+
+    @property
+    def duration(self):
+        return sum(seg.duration for seg in self.segments)
+
+    def run(self, p0, repetitions=1):
+        # populations after `repetitions` cycles, `p0` of shape (N_g,) or (..., N_g)
+        return np.matmul(np.asarray(p0, dtype=float), self.propagator(repetitions).T)
+
+    def evolve(self, p0, samples_per_segment=50):
+        # Populations during one cycle, sampled `samples_per_segment` times in
+        # every segment. Returns times (n_t,) and populations (n_t, N_g).
+        times = []
+        popu = []
+        t0 = 0
+        p = np.asarray(p0, dtype=float)
+
+        for seg in self.segments:
+            t_eval = np.linspace(0, seg.duration, samples_per_segment)
+
+            times.append(t0 + t_eval)
+            popu.append(evolve(self.segment_matrix(seg), p, t_eval))
+
+            p = self.segment_propagator(seg) @ p
+            t0 += seg.duration
+
+        return np.concatenate(times), np.concatenate(popu)
+
+    def stroboscopic_steady_state(self):
+        # Populations reproduced after every cycle, U p = p. Like a rate
+        # matrix, every column of U - 1 sums up to zero.
+        num_of_gs = len(self.trans_profile.ground_states)
+
+        return steady_state(self.propagator() - np.eye(num_of_gs))
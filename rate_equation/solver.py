@@ -0,0 +1,262 @@
+import numpy as np
+from scipy import sparse as sp
+
+from rate_equation import instrumentation
+
+
+class DegenerateSteadyStateError(np.linalg.LinAlgError):
+    # Raised when a rate matrix has more than one closed set of ground states
+    # (e.g. several dark states), so its steady state depends on the initial
+    # population and is not unique.
+    def __init__(self, degenerate, num_of_classes):
+        self.degenerate = degenerate  # bool mask over the stack of matrices
+        self.num_of_classes = num_of_classes  # null space dimension of each matrix
+
+        indices = np.argwhere(np.atleast_1d(degenerate))
+        super().__init__(f"Steady state is not unique for {len(indices)} matrices "
+                         f"(first at index {tuple(indices[0])}, null space dimension "
+                         f"{np.atleast_1d(num_of_classes)[tuple(indices[0])]}).")
+
+
+@instrumentation.timed("closed_classes")
+def count_closed_classes(mats, tol=1e-12):
+    # Number of closed (absorbing) sets of ground states of rate matrices with
+    # shape (..., N, N). For a rate matrix this is exactly the dimension of its
+    # null space, but it is determined from the coupling graph and therefore
+    # free of round-off ambiguity.
+    # Couplings smaller than `tol` times the largest rate are treated as absent.
+    if sp.issparse(mats):
+        return _count_closed_classes_sparse(mats, tol)
+
+    if _is_sparse_list(mats):
+        return np.array([_count_closed_classes_sparse(mat, tol) for mat in mats])
+
+    # All matrices of the stack form one block-diagonal coupling graph, whose
+    # strongly connected components are found in a single pass, O(nnz).
+    mats = np.asarray(mats, dtype=float)
+    batch_shape, num_of_gs = mats.shape[:-2], mats.shape[-1]
+    mats = mats.reshape((-1, num_of_gs, num_of_gs))
+
+    scale = np.abs(mats).max(axis=(-2, -1), keepdims=True)
+    flow = (mats > tol * scale) & ~np.eye(num_of_gs, dtype=bool)
+
+    b, dst, src = np.nonzero(flow)  # population flows from src to dst in matrix b
+    counts = _count_sink_components(b * num_of_gs + src, b * num_of_gs + dst, len(mats), num_of_gs)
+
+    return counts.reshape(batch_shape)
+
+
+@instrumentation.timed("steady_state")
+def steady_state(mats, tol=1e-12, on_degenerate="raise"):
+    # Normalized steady-state populations of rate matrices with shape
+    # (..., N, N), returned with shape (..., N).
+    #
+    # Every column of a rate matrix sums up to zero (population is conserved),
+    # so one row of G p = 0 is redundant and can be replaced by the
+    # normalization \sum_n p_n = 1. The resulting system is solved for the
+    # whole stack with a single batched LU solve.
+    #
+    # Matrices whose null space is more than one dimensional (see
+    # `count_closed_classes`) have no unique steady state. They raise a
+    # `DegenerateSteadyStateError`, or with on_degenerate="nan" their
+    # populations are set to NaN.
+    # Sparse matrices (or lists of them) are solved with a sparse LU instead.
+    assert on_degenerate in ("raise", "nan"), f"Unknown on_degenerate mode {on_degenerate}."
+
+    if sp.issparse(mats) or _is_sparse_list(mats):
+        return _steady_state_sparse(mats, tol, on_degenerate)
+
+    mats = np.asarray(mats, dtype=float)
+    num_of_gs = mats.shape[-1]
+
+    num_of_classes = count_closed_classes(mats, tol)
+    degenerate = num_of_classes != 1
+
+    if on_degenerate == "raise" and np.any(degenerate):
+        raise DegenerateSteadyStateError(degenerate, num_of_classes)
+
+    a = mats.copy()
+    a[..., 0, :] = 1
+    a = np.where(degenerate[..., np.newaxis, np.newaxis], np.eye(num_of_gs), a)
+
+    b = np.zeros(mats.shape[:-1] + (1,))
+    b[..., 0, :] = 1
+
+    if instrumentation.recorder is not None:
+        instrumentation.observe("condition_number", np.linalg.cond(a))
+
+    popu = np.linalg.solve(a, b)[..., 0]
+    popu[degenerate] = np.nan
+
+    return popu
+
+
+@instrumentation.timed("steady_state_derivative")
+def steady_state_derivative(mats, dg_p):
+    # Derivatives dp/dx of the steady states p of rate matrices `mats` (shape
+    # (..., N, N)) with respect to parameters x, given (dG/dx) p with shape
+    # (..., n_params, N). Returned with the shape of `dg_p`.
+    #
+    # Differentiating G p = 0 and \sum_n p_n = 1 gives G dp = -(dG/dx) p and
+    # \sum_n dp_n = 0. This is the system of `steady_state` with another
+    # right hand side (the columns of dG/dx sum up to zero as well, so the
+    # replaced row is again redundant), solved for all parameters and
+    # matrices in one batched LU solve. Derivatives for NaN populations
+    # (degenerate matrices, see `steady_state`) are NaN.
+    if sp.issparse(mats) or _is_sparse_list(mats):
+        return _steady_state_derivative_sparse(mats, dg_p)
+
+    mats = np.asarray(mats, dtype=float)
+    dg_p = np.asarray(dg_p, dtype=float)
+    num_of_gs = mats.shape[-1]
+
+    degenerate = np.any(np.isnan(dg_p), axis=(-2, -1))
+
+    a = mats.copy()
+    a[..., 0, :] = 1
+    a = np.where(degenerate[..., np.newaxis, np.newaxis], np.eye(num_of_gs), a)
+
+    b = -np.swapaxes(np.nan_to_num(dg_p), -1, -2)  # (..., N, n_params)
+    b[..., 0, :] = 0
+
+    dp = np.swapaxes(np.linalg.solve(a, b), -1, -2)
+    dp[degenerate] = np.nan
+
+    return dp
+
+
+@instrumentation.timed("evolve")
+def evolve(mats, p0, t_eval, cond_limit=1e10):
+    # Populations p(t) = exp(G t) p0 of rate matrices with shape (..., N, N)
+    # at all times in `t_eval`, returned with shape (..., len(t_eval), N).
+    # `p0` has shape (N,) or broadcasts against (..., N).
+    #
+    # G is time-invariant, so it is diagonalized once, G = V diag(w) V^-1, and
+    # p(t) = V diag(exp(w t)) V^-1 p0 is evaluated for all times at once.
+    # Matrices that are not (numerically) diagonalizable, i.e. whose
+    # eigenvector matrix has a condition number above `cond_limit`, fall back
+    # to `scipy.sparse.linalg.expm_multiply` (or `scipy.linalg.expm` for
+    # non-uniform time grids).
+    # Sparse matrices (or lists of them) always use expm_multiply.
+    if sp.issparse(mats):
+        return _evolve_expm(mats.tocsr(), np.asarray(p0, dtype=float), np.asarray(t_eval, dtype=float))
+
+    if _is_sparse_list(mats):
+        p0 = np.broadcast_to(np.asarray(p0, dtype=float), (len(mats), mats[0].shape[-1]))
+
+        return np.stack([evolve(mat, p, t_eval) for mat, p in zip(mats, p0)])
+
+    mats = np.asarray(mats, dtype=float)
+    t_eval = np.asarray(t_eval, dtype=float)
+    batch_shape = mats.shape[:-2]
+    num_of_gs = mats.shape[-1]
+
+    p0 = np.broadcast_to(np.asarray(p0, dtype=float), batch_shape + (num_of_gs,))
+
+    w, v = np.linalg.eig(mats)
+    cond = np.linalg.cond(v)
+    defective = ~(cond < cond_limit)  # also catches NaN
+    instrumentation.observe("eigenvector_condition_number", cond)
+
+    v = np.where(defective[..., np.newaxis, np.newaxis], np.eye(num_of_gs), v)
+    coeff = np.linalg.solve(v, p0[..., np.newaxis].astype(complex))[..., 0]
+
+    # (..., n_t, N) modes, scaled by their initial weights
+    modes = np.exp(w[..., np.newaxis, :] * t_eval[:, np.newaxis]) * coeff[..., np.newaxis, :]
+    popu = np.matmul(modes, np.swapaxes(v, -1, -2)).real
+
+    for idx in map(tuple, np.argwhere(defective)):
+        popu[idx] = _evolve_expm(mats[idx], p0[idx], t_eval)
+
+    return popu
+
+
+def _evolve_expm(mat, p0, t_eval):
+    from scipy.linalg import expm
+    from scipy.sparse.linalg import expm_multiply
+
+    if len(t_eval) > 1 and np.allclose(np.diff(t_eval), t_eval[1] - t_eval[0]):
+        return expm_multiply(mat, p0, start=t_eval[0], stop=t_eval[-1],
+                             num=len(t_eval), endpoint=True)
+
+    if sp.issparse(mat):
+        return np.stack([expm_multiply(mat * t, p0) for t in t_eval])
+
+    return np.matmul(expm(mat * t_eval[:, np.newaxis, np.newaxis]), p0)
+
+
+def _is_sparse_list(mats):
+    return isinstance(mats, (list, tuple)) and len(mats) > 0 and sp.issparse(mats[0])
+
+
+def _count_closed_classes_sparse(mat, tol):
+    mat = sp.coo_matrix(mat)
+    scale = np.abs(mat.data).max() if mat.nnz else 0
+
+    flow = (mat.row != mat.col) & (mat.data > tol * scale)
+
+    return _count_sink_components(mat.col[flow], mat.row[flow], 1, mat.shape[-1])[0]
+
+
+def _count_sink_components(src, dst, num_of_mats, num_of_gs):
+    # Closed classes are the strongly connected components of the coupling
+    # graph that no population leaves. Nodes b * num_of_gs + n (state n of
+    # matrix b), edges src -> dst; returns the count of each matrix.
+    from scipy.sparse.csgraph import connected_components
+
+    num_of_nodes = num_of_mats * num_of_gs
+    graph = sp.csr_matrix((np.ones(len(src)), (src, dst)), shape=(num_of_nodes, num_of_nodes))
+    num_of_comps, labels = connected_components(graph, directed=True, connection="strong")
+
+    closed = np.ones(num_of_comps, dtype=bool)
+    closed[labels[src[labels[src] != labels[dst]]]] = False
+
+    comp_matrix = np.zeros(num_of_comps, dtype=int)
+    comp_matrix[labels] = np.arange(num_of_nodes) // num_of_gs
+
+    return np.bincount(comp_matrix[closed], minlength=num_of_mats)
+
+
+def _steady_state_sparse(mats, tol, on_degenerate):
+    from scipy.sparse.linalg import splu
+
+    mat_list = mats if _is_sparse_list(mats) else [mats]
+    num_of_gs = mat_list[0].shape[-1]
+
+    num_of_classes = np.array([_count_closed_classes_sparse(mat, tol) for mat in mat_list])
+    degenerate = num_of_classes != 1
+
+    if on_degenerate == "raise" and np.any(degenerate):
+        if mat_list is not mats:
+            degenerate, num_of_classes = degenerate[0], num_of_classes[0]
+
+        raise DegenerateSteadyStateError(degenerate, num_of_classes)
+
+    b = np.zeros(num_of_gs)
+    b[0] = 1
+
+    popu = np.full((len(mat_list), num_of_gs), np.nan)
+
+    for i in np.flatnonzero(~degenerate):
+        a = sp.vstack([sp.csr_matrix(np.ones((1, num_of_gs))), sp.csr_matrix(mat_list[i])[1:]])
+        popu[i] = splu(a.tocsc()).solve(b)
+
+    return popu if mat_list is mats else popu[0]
+
+
+def _steady_state_derivative_sparse(mats, dg_p):
+    from scipy.sparse.linalg import splu
+
+    mat_list = mats if _is_sparse_list(mats) else [mats]
+    num_of_gs = mat_list[0].shape[-1]
+
+    dg_p = np.asarray(dg_p, dtype=float).reshape((len(mat_list),) + np.shape(dg_p)[-2:])
+    dp = np.full(dg_p.shape, np.nan)
+
+    for i in np.flatnonzero(~np.any(np.isnan(dg_p), axis=(-2, -1))):
+        a = sp.vstack([sp.csr_matrix(np.ones((1, num_of_gs))), sp.csr_matrix(mat_list[i])[1:]])
+        b = -dg_p[i].T
+        b[0] = 0
+        dp[i] = splu(a.tocsc()).solve(np.ascontiguousarray(b)).T
+
+    return dp if mat_list is mats else dp[0]
@@ -0,0 +1,114 @@
+import numpy as np
+from collections import namedtuple
+
+from rate_equation.solver import steady_state
+
+# Spectrum of a rate equation versus the frequency of one (probe) field, all
+# other fields (e.g. pumps) kept fixed. For n_points probe frequencies
+# (ascending):
+#   frequencies (n_points,)      probe frequency, Hz
+#   scattering  (n_points,)      photons scattered from all fields per atom
+#                                and second, i.e. fluorescence
+#   absorption  (n_points,)      photons scattered from the probe field per
+#                                atom and second
+#   populations (n_points, N_g)  steady-state ground state populations
+Spectrum = namedtuple("Spectrum", ["frequencies", "scattering", "absorption", "populations"])
+
+
+def line_centers(rate_eqn, probe):
+    # Probe frequencies (sorted, unique) at which a transition driven by field
+    # `probe` (i.e. of the same delta_m) is resonant, including the shifts of
+    # the detunings of `rate_eqn` (e.g. Zeeman, Doppler) at the current probe
+    # frequency.
+    tp = rate_eqn.trans_profile
+    field = rate_eqn.radiation.fields[probe]
+    driven = tp.trans_delta_m == field.delta_m
+
+    # the detuning trans_frequency - f + shift vanishes at f = trans_frequency + shift
+    field_freq = np.array([[field.frequency]])
+    shifts = sum(np.asarray(det.get_detuning_array(field_freq, tp, field.direction)) for det in rate_eqn.detunings)
+    centers = np.broadcast_to(tp.trans_frequency + shifts, (1, len(tp.transitions)))[0]
+
+    return np.unique(centers[driven])
+
+
+def spectrum(rate_eqn, probe, frequency_range=None, num_of_points=33, tol=1e-3, min_spacing=None,
+             max_points=5000, on_degenerate="raise"):
+    # `Spectrum` of `rate_eqn` versus the frequency of field `probe` over
+    # `frequency_range` (default: all line centers +- 10 gamma).
+    #
+    # The probe frequencies are sampled adaptively. The initial grid of
+    # `num_of_points` uniform points is seeded with the line centers (see
+    # `line_centers`) and their half-width points, so narrow resonances are
+    # never missed. Then every interval is bisected as long as the value at
+    # its midpoint deviates from the linear interpolation of its end points
+    # by more than `tol` (relative to the largest value of scattering or
+    # absorption), and it is wider than `min_spacing` (default: gamma / 100).
+    # All midpoints of a refinement level are solved as one batch. Once
+    # `max_points` would be exceeded, the intervals with the largest error
+    # of their parent interval are refined first; the initial grid must fit
+    # within `max_points`.
+    tp = rate_eqn.trans_profile
+    gamma = tp.gamma
+    centers = line_centers(rate_eqn, probe)
+
+    if frequency_range is None:
+        assert len(centers), f"Field {probe} drives no transition, a frequency_range is required."
+        frequency_range = (centers.min() - 10 * gamma, centers.max() + 10 * gamma)
+    start, stop = frequency_range
+    min_spacing = gamma / 100 if min_spacing is None else min_spacing
+
+    seeds = (centers[:, np.newaxis] + np.array([-gamma / 2, 0, gamma / 2])).ravel()
+    freqs = np.unique(np.concatenate([np.linspace(start, stop, num_of_points),
+                                      seeds[(seeds > start) & (seeds < stop)]]))
+    assert len(freqs) <= max_points, \
+        f"max_points ({max_points}) is below the {len(freqs)} points of the initial grid."
+
+    popu, values = _evaluate(rate_eqn, probe, freqs, on_degenerate)
+
+    # intervals (freqs[i], freqs[i + 1]) to refine, with the error estimate of their parent
+    errors = np.full(len(freqs) - 1, np.inf)
+
+    while len(freqs) < max_points:
+        refine = np.flatnonzero(~np.isnan(errors) & (np.diff(freqs) > 2 * min_spacing))
+        if not len(refine):
+            break
+
+        if len(freqs) + len(refine) > max_points:
+            refine = np.sort(refine[np.argsort(-errors[refine], kind="stable")[:max_points - len(freqs)]])
+
+        mid = (freqs[refine] + freqs[refine + 1]) / 2
+        mid_popu, mid_values = _evaluate(rate_eqn, probe, mid, on_degenerate)
+
+        scale = np.maximum(np.abs(values).max(axis=0), np.abs(mid_values).max(axis=0))
+        scale[scale == 0] = 1
+        interpolated = (values[refine] + values[refine + 1]) / 2
+        mid_errors = np.max(np.abs(mid_values - interpolated) / scale, axis=-1)
+
+        # both halves of an interval inherit its error if it is above `tol`
+        inherited = np.where(mid_errors > tol, mid_errors, np.nan)
+        left_errors = np.full(len(errors), np.nan)
+        left_errors[refine] = inherited
+
+        order = np.argsort(np.concatenate([freqs, mid]), kind="stable")
+        freqs = np.concatenate([freqs, mid])[order]
+        popu = np.concatenate([popu, mid_popu])[order]
+        values = np.concatenate([values, mid_values])[order]
+        errors = np.concatenate([left_errors, np.full(1, np.nan), inherited])[order][:-1]
+
+    return Spectrum(freqs, values[:, 0], values[:, 1], popu)
+
+
+def _evaluate(rate_eqn, probe, probe_freqs, on_degenerate):
+    # steady-state populations (n, N_g) and (scattering, absorption) (n, 2)
+    # at the probe frequencies, solved as one batch
+    tp = rate_eqn.trans_profile
+
+    field_freqs = np.array([[field.frequency for field in rate_eqn.radiation.fields]] * len(probe_freqs))
+    field_freqs[:, probe] = probe_freqs
+
+    rates = rate_eqn.sweep_scattering_rates(field_frequency=field_freqs)
+    popu = steady_state(rate_eqn.assemble_matrix(rates.sum(axis=-2)), on_degenerate=on_degenerate)
+    field_scattering = np.einsum("nft,nt->nf", rates, popu[:, tp.trans_ground])
+
+    return popu, np.stack([field_scattering.sum(axis=-1), field_scattering[:, probe]], axis=-1)
@@ -0,0 +1,189 @@
+import os
+import json
+import numpy as np
+
+from rate_equation.executor import grid_axes
+
+# Chunked, compressed on-disk arrays for results that do not fit in memory.
+#
+# An array is a directory holding
+#   meta.json    shape, dtype, chunk length (rows along the first axis) and
+#                free-form JSON attributes
+#   arrays.npz   named metadata arrays (e.g. the axes of a sweep)
+#   <n>.npz      chunk n, i.e. rows n * chunk_len ... (n + 1) * chunk_len - 1
+# Rows are appended by a `ChunkedArrayWriter` and read lazily, chunk by
+# chunk, through a `ChunkedArray`.
+
+
+class ChunkedArrayWriter:
+    # Appends blocks of rows of shape (n, *row_shape) to a new array at `path`.
+    # Rows are buffered until a chunk of `chunk_len` rows is complete; chunks
+    # are stored with zlib compression unless `compress` is False. Use it as a
+    # context manager, or call `close` to write the last, partial chunk.
+
+    def __init__(self, path, row_shape, dtype=float, chunk_len=1024, compress=True, attrs=None, arrays=None):
+        assert not os.path.exists(os.path.join(path, "meta.json")), f"{path} already holds an array."
+
+        self.path = path
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_len = chunk_len
+        self.compress = compress
+        self.attrs = dict(attrs or {})
+
+        self._buffer = np.empty((chunk_len,) + self.row_shape, dtype=self.dtype)
+        self._buffered = 0
+        self._num_of_chunks = 0
+        self.closed = False
+
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, "arrays.npz"), **(arrays or {}))
+        self._write_meta()
+
+    def __len__(self):
+        return self._num_of_chunks * self.chunk_len + self._buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, block):
+        assert not self.closed, "Writer is closed."
+        block = np.asarray(block, dtype=self.dtype)
+        assert block.shape[1:] == self.row_shape, f"Rows must be of shape {self.row_shape}."
+
+        while len(block):
+            n = min(len(block), self.chunk_len - self._buffered)
+            self._buffer[self._buffered:self._buffered + n] = block[:n]
+            self._buffered += n
+            block = block[n:]
+
+            if self._buffered == self.chunk_len:
+                self._flush()
+
+    def close(self):
+        if self.closed:
+            return
+
+        if self._buffered:
+            self._flush()
+        self.closed = True
+
+    def _flush(self):
+        save = np.savez_compressed if self.compress else np.savez
+        save(os.path.join(self.path, f"{self._num_of_chunks}.npz"), data=self._buffer[:self._buffered])
+
+        length = len(self)
+        self._num_of_chunks += 1
+        self._buffered = 0
+        self._write_meta(length)
+
+    def _write_meta(self, length=0):
+        # rewritten after every chunk, so that an interrupted run leaves a
+        # readable array of the rows written so far
+        meta = {"shape": [length] + list(self.row_shape), "dtype": self.dtype.str,
+                "chunk_len": self.chunk_len, "attrs": self.attrs}
+
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+
+class ChunkedArray:
+    # Read-only view of an array written by `ChunkedArrayWriter`. Indexing
+    # (a[i], a[i:j], a[idx_array, ...]) only loads the chunks holding the
+    # selected rows; the most recently used chunk is kept in memory.
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.chunk_len = meta["chunk_len"]
+        self.attrs = meta["attrs"]
+
+        with np.load(os.path.join(path, "arrays.npz")) as arrays:
+            self.arrays = dict(arrays)
+
+        self._cached = (None, None)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def chunk(self, n):
+        if self._cached[0] != n:
+            with np.load(os.path.join(self.path, f"{n}.npz")) as data:
+                self._cached = (n, data["data"])
+
+        return self._cached[1]
+
+    def iter_chunks(self):
+        # (start row, rows) of all chunks in order
+        for n in range(int(np.ceil(len(self) / self.chunk_len))):
+            yield n * self.chunk_len, self.chunk(n)
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        rows, rest = key[0], key[1:]
+
+        if rows is Ellipsis:
+            rows, rest = slice(None), (Ellipsis,) + rest
+
+        scalar = np.ndim(rows) == 0 and not isinstance(rows, slice)
+        rows = np.arange(len(self))[rows]
+        rows = np.atleast_1d(rows)
+
+        out = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        chunks = rows // self.chunk_len
+
+        for n in np.unique(chunks):
+            selected = chunks == n
+            out[selected] = self.chunk(n)[rows[selected] - n * self.chunk_len]
+
+        if scalar:
+            return out[0][rest] if rest else out[0]
+
+        return out[(slice(None),) + rest] if rest else out
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+def write_sweep(rate_eqn, axes, path, chunk_size=10000, t_eval=None, p0=None, chunk_len=None, compress=True):
+    # Stream `rate_eqn.iter_sweep(axes, ...)` into a chunked array at `path`,
+    # one row per grid point (flattened in C order), and return it for
+    # reading. The sweep axes (arrays "axis_<name>"), `t_eval`, the grid shape
+    # and the ground state labels are stored alongside, e.g. to find the row
+    # of a grid point with np.ravel_multi_index(idx, array.attrs["grid_shape"]).
+    axes, grid_shape = grid_axes(axes)
+    tp = rate_eqn.trans_profile
+    num_of_gs = len(tp.ground_states)
+
+    row_shape = (num_of_gs,) if t_eval is None else (len(t_eval), num_of_gs)
+    attrs = {
+        "axes": list(axes),
+        "grid_shape": list(grid_shape),
+        "ground_states": [[s.hyperfine, s.m] for s in tp.ground_states],
+        "quantity": "steady_state_population" if t_eval is None else "population",
+    }
+    arrays = {f"axis_{name}": values for name, values in axes.items()}
+    if t_eval is not None:
+        arrays["t_eval"] = np.asarray(t_eval, dtype=float)
+
+    with ChunkedArrayWriter(path, row_shape, chunk_len=chunk_len or chunk_size, compress=compress,
+                            attrs=attrs, arrays=arrays) as writer:
+        for _, popu in rate_eqn.iter_sweep(axes, chunk_size, t_eval, p0):
+            writer.append(popu)
+
+    return ChunkedArray(path)
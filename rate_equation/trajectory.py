@@ -0,0 +1,136 @@
+import functools
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from rate_equation import instrumentation
+from rate_equation.solver import evolve
+
+# Snapshots of an ensemble, taken every `save_every` steps.
+#   times:       (n_saved,)
+#   positions:   (n_saved, n_atoms, dim)
+#   velocities:  (n_saved, n_atoms, dim)
+#   populations: (n_saved, n_atoms, N_g)
+TrajectoryResult = namedtuple("TrajectoryResult", ["times", "positions", "velocities", "populations"])
+
+
+class TrajectorySimulator:
+    # Rate equations coupled to classical motion of an ensemble of atoms.
+    #
+    # All radiation fields of `rate_eqn` propagate along the last coordinate
+    # axis (z, the beam line); positions and velocities have shape
+    # (n_atoms, dim) with dim 1 or 3. At every step the local magnetic field
+    # `b_field_profile(z)` (replacing the field of the Zeeman detuning of
+    # `rate_eqn`) and the velocity v_z set the detunings of all atoms at once,
+    # populations are propagated exactly over the step with the rate matrices
+    # frozen, and the radiation force accelerates the atoms along z.
+    #
+    # With `heating`, the number of photons scattered from every field is
+    # drawn from a Poisson distribution, and spontaneous emission gives
+    # isotropic recoil kicks (in the Gaussian approximation), so the ensemble
+    # heats up to the Doppler limit instead of following the mean force.
+
+    def __init__(self, rate_eqn, mass, b_field_profile=None):
+        self.rate_eqn = rate_eqn
+        self.mass = mass  # kg
+        self.b_field_profile = b_field_profile  # callable, z (m) array -> B (T) array
+
+    def _local_b_field(self, positions):
+        if self.b_field_profile is None:
+            return None
+
+        return np.asarray(self.b_field_profile(positions[:, -1]), dtype=float)
+
+    def scattering_rates(self, positions, velocities):
+        # (n_atoms, N_fields, N_trans) scattering rates at the atoms' positions and velocities
+        return self.rate_eqn.sweep_scattering_rates(b_field=self._local_b_field(positions),
+                                                    velocity=velocities[:, -1])
+
+    def run(self, positions, velocities, dt, n_steps, populations=None, save_every=1,
+            heating=False, seed=None, n_workers=1, chunk_size=1000):
+        # Integrate the ensemble over `n_steps` steps of `dt` seconds.
+        # The ensemble is split into chunks of `chunk_size` atoms integrated
+        # by `n_workers` processes. Every chunk has its own random stream
+        # spawned from `seed`, and the chunks do not depend on `n_workers`,
+        # so neither do the results (only on `seed` and `chunk_size`).
+        positions = np.array(positions, dtype=float)
+        velocities = np.array(velocities, dtype=float)
+        n_atoms, dim = positions.shape
+        num_of_gs = len(self.rate_eqn.trans_profile.ground_states)
+
+        assert dim in (1, 3), "Positions must be of shape (n_atoms, 1) or (n_atoms, 3)."
+        assert velocities.shape == positions.shape, "Positions and velocities must have the same shape."
+
+        if populations is None:
+            populations = np.full((n_atoms, num_of_gs), 1 / num_of_gs)
+        populations = np.array(np.broadcast_to(populations, (n_atoms, num_of_gs)), dtype=float)
+
+        chunks = [slice(i, i + chunk_size) for i in range(0, n_atoms, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+        args = [(positions[c], velocities[c], populations[c], dt, n_steps, save_every, heating, s)
+                for c, s in zip(chunks, seeds)]
+
+        if n_workers == 1:
+            results = [self._integrate(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(n_workers) as pool:
+                if instrumentation.recorder is None:
+                    results = list(pool.map(self._integrate, *zip(*args)))
+                else:
+                    results = []
+                    for result, rec in pool.map(functools.partial(instrumentation.call_recorded, self._integrate),
+                                                *zip(*args)):
+                        instrumentation.merge(rec)
+                        results.append(result)
+
+        return TrajectoryResult(
+                times=results[0].times,
+                positions=np.concatenate([r.positions for r in results], axis=1),
+                velocities=np.concatenate([r.velocities for r in results], axis=1),
+                populations=np.concatenate([r.populations for r in results], axis=1))
+
+    def _integrate(self, positions, velocities, populations, dt, n_steps, save_every, heating, seed):
+        from scipy.constants import h, c
+
+        rate_eqn = self.rate_eqn
+        tp = rate_eqn.trans_profile
+        rng = np.random.default_rng(seed)
+
+        n_atoms, dim = positions.shape
+        directions = np.array([field.direction for field in rate_eqn.radiation.fields], dtype=float)
+        v_recoil = h * np.mean(tp.trans_frequency) / c / self.mass
+
+        pos, vel, popu = positions.copy(), velocities.copy(), populations.copy()
+        saved = [(0., pos.copy(), vel.copy(), popu.copy())]
+
+        for step in range(1, n_steps + 1):
+            b_field = self._local_b_field(pos)
+            rates = rate_eqn.sweep_scattering_rates(b_field=b_field, velocity=vel[:, -1])
+
+            if heating:
+                # photons scattered from every field during this step
+                field_rates = np.sum(rates * popu[:, np.newaxis, tp.trans_ground], axis=-1)
+                n_photons = rng.poisson(field_rates * dt)
+
+                dv = np.zeros_like(vel)
+                dv[:, -1] = v_recoil * (n_photons @ directions)
+                # isotropic emission: each axis gets 1/3 of the recoil energy
+                dv += v_recoil * np.sqrt(n_photons.sum(axis=-1) / 3)[:, np.newaxis] \
+                        * rng.standard_normal((n_atoms, dim))
+            else:
+                force, _ = rate_eqn.force_from_rates(rates, popu)
+                dv = np.zeros_like(vel)
+                dv[:, -1] = force / self.mass * dt
+
+            mats = rate_eqn.assemble_matrix(rates.sum(axis=-2), rate_eqn.sweep_transition_strengths(b_field))
+            popu = evolve(mats, popu, [dt])[:, 0]
+            vel += dv
+            pos += vel * dt
+
+            if step % save_every == 0:
+                saved.append((step * dt, pos.copy(), vel.copy(), popu.copy()))
+
+        times, pos, vel, popu = zip(*saved)
+
+        return TrajectoryResult(np.array(times), np.stack(pos), np.stack(vel), np.stack(popu))
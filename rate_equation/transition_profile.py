@@ -1,6 +1,7 @@
 import re
 from collections import namedtuple
 import itertools
+import numpy as np
 
 # delta_m - in [-1, 0, 1], assuming dipole transition
 # strength - can be unnormalized
@@ -39,6 +40,12 @@ def group(label):
     return TransitionGroupLabel(mg[1], mg[2])
 
 
+def _stored_m(m):
+    # m as saved by TransitionProfile.save: integer m back to int, half-integer
+    # m kept as float
+    return int(m) if float(m).is_integer() else m
+
+
 class TransitionProfile:
     def __init__(self, ground_states, excited_states, transitions, frequencies, gamma):
         from scipy.constants import c
@@ -58,59 +65,161 @@ class TransitionProfile:
         # There are also symmetry (Steck, sodium number eqn. 40) that guarantees
         # the sum transition strengths of any ground state to all possible excited
         # state (vice versa) sum to a fixed number. So this can be a consistency check.
-        self._exc_to_gnd_trans = self._normalize_trans_strength(
-                self._build_exc_to_gnd_map(transitions))  # indexed by excited state label
-
-        self._gnd_to_exc_trans = self._build_gnd_to_exc_map(
-                itertools.chain.from_iterable(self._exc_to_gnd_trans.values()))
+        self._compile(self._normalize_trans_strength(*self._group_by_excited_state(transitions)))
+
+    def _compile(self, transitions):
+        # Index arrays of all (normalized) transitions, grouped by excited
+        # state, used by the vectorized matrix assembly and all lookups.
+        # Transition t links ground state trans_ground[t] to excited state
+        # trans_excited[t], belongs to group groups[trans_group[t]] (base
+        # frequency group_frequencies[trans_group[t]]) and has normalized
+        # strength trans_strength[t].
+        self.ground_index = dict(zip(self.ground_states, itertools.count()))
+        self.excited_index = dict(zip(self.excited_states, itertools.count()))
+        self.groups = list(self.frequencies.keys())
+        self.group_frequencies = np.array([self.frequencies[g] for g in self.groups], dtype=float)
+
+        group_index = dict(zip(self.groups, itertools.count()))
+        num_of_trans = len(transitions)
+
+        def _index_array(values):
+            return np.fromiter(values, dtype=int, count=num_of_trans)
+
+        self.transitions = transitions
+        self.trans_ground = _index_array(map(self.ground_index.__getitem__, (t.ground_state for t in transitions)))
+        self.trans_excited = _index_array(map(self.excited_index.__getitem__,
+                                              (t.excited_state for t in transitions)))
+        self.trans_group = _index_array(map(group_index.__getitem__, (t.group for t in transitions)))
+        self.trans_delta_m = _index_array(t.delta_m for t in transitions)
+        self.trans_strength = np.fromiter((t.strength for t in transitions), dtype=float, count=num_of_trans)
+        self.trans_frequency = self.group_frequencies[self.trans_group]
+
+        # Adjacency in CSR layout: the transitions of ground state n are
+        # gnd_trans[gnd_offsets[n]:gnd_offsets[n + 1]], those of excited state
+        # k are exc_trans[exc_offsets[k]:exc_offsets[k + 1]] (in the order of
+        # `transitions`).
+        self.gnd_trans = np.argsort(self.trans_ground, kind="stable")
+        self.gnd_offsets = np.searchsorted(self.trans_ground[self.gnd_trans], np.arange(len(self.ground_states) + 1))
+        self.exc_trans = np.argsort(self.trans_excited, kind="stable")
+        self.exc_offsets = np.searchsorted(self.trans_excited[self.exc_trans],
+                                           np.arange(len(self.excited_states) + 1))
+
+        # beta_nk: normalized strength between ground state n and excited state k
+        self.branching_ratio = np.zeros((len(self.ground_states), len(self.excited_states)))
+        self.branching_ratio[self.trans_ground, self.trans_excited] = self.trans_strength
+
+    def ground_transitions(self, n):
+        # indices of the transitions of ground state n
+        return self.gnd_trans[self.gnd_offsets[n]:self.gnd_offsets[n + 1]]
+
+    def excited_transitions(self, k):
+        # indices of the transitions of excited state k
+        return self.exc_trans[self.exc_offsets[k]:self.exc_offsets[k + 1]]
+
+    def save(self, path):
+        # Store the compiled profile (integer-indexed state tables, transitions
+        # grouped by excited state in CSR layout, normalized strengths) in an
+        # uncompressed .npz file, which `load` reads back without parsing
+        # labels or normalizing strengths again. m is stored as float, which
+        # holds half-integer m (J = 1/2 fine-structure levels) exactly.
+        hyperfines = sorted({s.hyperfine for s in self.ground_states + self.excited_states}
+                            | set(itertools.chain.from_iterable(self.groups)))
+        hyperfine_index = {hf: n for n, hf in enumerate(hyperfines)}
+
+        order, exc_offsets = self.exc_trans, self.exc_offsets
+
+        np.savez(path,
+                 hyperfines=np.array(hyperfines, dtype=str),
+                 ground_hyperfine=np.array([hyperfine_index[s.hyperfine] for s in self.ground_states], dtype=int),
+                 ground_m=np.array([s.m for s in self.ground_states], dtype=float),
+                 excited_hyperfine=np.array([hyperfine_index[s.hyperfine] for s in self.excited_states], dtype=int),
+                 excited_m=np.array([s.m for s in self.excited_states], dtype=float),
+                 group_hyperfines=np.array([[hyperfine_index[hf] for hf in g] for g in self.groups],
+                                           dtype=int).reshape((-1, 2)),
+                 group_frequencies=self.group_frequencies,
+                 exc_offsets=exc_offsets,
+                 trans_ground=self.trans_ground[order],
+                 trans_group=self.trans_group[order],
+                 trans_strength=self.trans_strength[order],
+                 gamma=self.gamma)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            data = dict(data)
+
+        hyperfines = data["hyperfines"].tolist()
+        ground_states = [State(hyperfines[hf], _stored_m(m))
+                         for hf, m in zip(data["ground_hyperfine"].tolist(), data["ground_m"].tolist())]
+        excited_states = [State(hyperfines[hf], _stored_m(m))
+                          for hf, m in zip(data["excited_hyperfine"].tolist(), data["excited_m"].tolist())]
+        groups = [TransitionGroupLabel(hyperfines[g], hyperfines[e]) for g, e in data["group_hyperfines"].tolist()]
+
+        trans_excited = np.repeat(np.arange(len(excited_states)), np.diff(data["exc_offsets"]))
+        transitions = [Transition(ground_states[g], excited_states[e], groups[n],
+                                  excited_states[e].m - ground_states[g].m, strength)
+                       for g, e, n, strength in zip(data["trans_ground"].tolist(), trans_excited.tolist(),
+                                                    data["trans_group"].tolist(), data["trans_strength"].tolist())]
+
+        profile = cls.__new__(cls)
+        profile.ground_states = ground_states
+        profile.excited_states = excited_states
+        profile.gamma = float(data["gamma"])
+        profile.frequencies = dict(zip(groups, data["group_frequencies"].tolist()))
+        profile._compile(transitions)
+
+        return profile
+
+    def subprofile(self, ground, excited, transitions):
+        # Profile of the ground states, excited states and transitions with
+        # (sorted) indices `ground`, `excited` and `transitions`, keeping the
+        # normalized strengths and the order of all three.
+        transitions = [self.transitions[t] for t in transitions]
+        groups = {t.group for t in transitions}
+
+        profile = TransitionProfile.__new__(TransitionProfile)
+        profile.ground_states = [self.ground_states[g] for g in ground]
+        profile.excited_states = [self.excited_states[e] for e in excited]
+        profile.gamma = self.gamma
+        profile.frequencies = {g: freq for g, freq in self.frequencies.items() if g in groups}
+        profile._compile(transitions)
+
+        return profile
 
     @staticmethod
-    def _build_exc_to_gnd_map(transitions):
-        _exc_to_gnd_trans = {}
-        for trans in transitions:
-            if trans.excited_state not in _exc_to_gnd_trans:
-                _exc_to_gnd_trans[trans.excited_state] = []
+    def _group_by_excited_state(transitions):
+        # `transitions` grouped by excited state (in order of first
+        # appearance), and the number of the group of each
+        transitions = list(transitions)
+        exc_numbers = {}
+        keys = np.fromiter((exc_numbers.setdefault(t.excited_state, len(exc_numbers)) for t in transitions),
+                           dtype=int, count=len(transitions))
+        order = np.argsort(keys, kind="stable")
 
-            _exc_to_gnd_trans[trans.excited_state].append(trans)
-
-        return _exc_to_gnd_trans
+        return [transitions[t] for t in order.tolist()], keys[order]
 
     @staticmethod
-    def _normalize_trans_strength(exc_to_gnd_trans):
+    def _normalize_trans_strength(transitions, exc_keys):
         # normalize transition strength, so that for a given excited state,
         # all transitions, who link it to the ground states, sum up to 1
-        strength_sum = None
-        for exc_state, trans in exc_to_gnd_trans.items():
-            _strength_sum = sum([t.strength for t in trans])
-            assert strength_sum is None or strength_sum == _strength_sum, \
-                    f"Inconsistent transition strength related to {exc_state}."  # see above comment
-            strength_sum = _strength_sum
-
-            new_trans = []
-            for t in trans:
-                new_trans.append(t._replace(strength=t.strength / strength_sum))
-
-            exc_to_gnd_trans[exc_state] = new_trans
-
-        return exc_to_gnd_trans
-
-    @staticmethod
-    def _build_gnd_to_exc_map(transitions):
-        _gnd_to_exc_trans = {}
-        for trans in transitions:
-            if trans.ground_state not in _gnd_to_exc_trans:
-                _gnd_to_exc_trans[trans.ground_state] = []
+        strengths = np.fromiter((t.strength for t in transitions), dtype=float, count=len(transitions))
+        strength_sum = np.bincount(exc_keys, strengths)
 
-            _gnd_to_exc_trans[trans.ground_state].append(trans)
+        if len(strength_sum):
+            inconsistent = ~np.isclose(strength_sum, strength_sum[0])  # see above comment
+            assert not np.any(inconsistent), \
+                    f"Inconsistent transition strength related to " \
+                    f"{transitions[np.searchsorted(exc_keys, np.argmax(inconsistent))].excited_state}."
 
-        return _gnd_to_exc_trans
+        return [Transition(t.ground_state, t.excited_state, t.group, t.delta_m, strength)
+                for t, strength in zip(transitions, (strengths / strength_sum[exc_keys]).tolist())]
 
     def get_gnd_to_exc(self, gs):
-        assert gs in self.ground_states
+        assert gs in self.ground_index
 
-        return self._gnd_to_exc_trans[gs] if gs in self._gnd_to_exc_trans else []
+        return [self.transitions[t] for t in self.ground_transitions(self.ground_index[gs]).tolist()]
 
     def get_exc_to_gnd(self, es):
-        assert es in self.excited_states
+        assert es in self.excited_index
 
-        return self._exc_to_gnd_trans[es] if es in self._exc_to_gnd_trans else []
+        return [self.transitions[t] for t in self.excited_transitions(self.excited_index[es]).tolist()]
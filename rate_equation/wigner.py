@@ -0,0 +1,136 @@
+import functools
+from fractions import Fraction
+from math import factorial, sqrt
+
+import numpy as np
+
+# Wigner 3j / 6j symbols and the hyperfine transition strengths built from them.
+# Angular momenta may be integers or half-integers (e.g. 3/2).
+
+
+def _doubled(j):
+    # 2j as an exact integer
+    dj = int(round(2 * j))
+    assert abs(dj - 2 * j) < 1e-9, f"{j} is not a multiple of 1/2."
+
+    return dj
+
+
+def _triangle(dj1, dj2, dj3):
+    # |j1 - j2| <= j3 <= j1 + j2 with integer j1 + j2 + j3 (all doubled)
+    return abs(dj1 - dj2) <= dj3 <= dj1 + dj2 and (dj1 + dj2 + dj3) % 2 == 0
+
+
+def _delta(dj1, dj2, dj3):
+    # triangle coefficient (j1+j2-j3)!(j1-j2+j3)!(-j1+j2+j3)!/(j1+j2+j3+1)!
+    return Fraction(factorial((dj1 + dj2 - dj3) // 2) * factorial((dj1 - dj2 + dj3) // 2)
+                    * factorial((-dj1 + dj2 + dj3) // 2), factorial((dj1 + dj2 + dj3) // 2 + 1))
+
+
+@functools.lru_cache(maxsize=4096)
+def wigner_6j(j1, j2, j3, j4, j5, j6):
+    # {j1 j2 j3; j4 j5 j6}, Racah formula, summed in exact arithmetic
+    dj = [_doubled(j) for j in (j1, j2, j3, j4, j5, j6)]
+    triads = [(dj[0], dj[1], dj[2]), (dj[0], dj[4], dj[5]), (dj[3], dj[1], dj[5]), (dj[3], dj[4], dj[2])]
+
+    if not all(_triangle(*triad) for triad in triads):
+        return 0.
+
+    a = [sum(triad) // 2 for triad in triads]
+    b = [(dj[0] + dj[1] + dj[3] + dj[4]) // 2, (dj[1] + dj[2] + dj[4] + dj[5]) // 2,
+         (dj[2] + dj[0] + dj[5] + dj[3]) // 2]
+
+    total = 0
+    for t in range(max(a), min(b) + 1):
+        denominator = 1
+        for n in [t - a_n for a_n in a] + [b_n - t for b_n in b]:
+            denominator *= factorial(n)
+        total += Fraction((-1) ** t * factorial(t + 1), denominator)
+
+    prefactor = 1
+    for triad in triads:
+        prefactor *= _delta(*triad)
+
+    return float(total) * sqrt(prefactor)
+
+
+def wigner_3j(j1, j2, j3, m1, m2, m3):
+    # (j1 j2 j3; m1 m2 m3), Racah formula. The j's are scalars, the m's may be
+    # arrays; the result has their broadcast shape. All terms of the sum over
+    # k are evaluated at once from a table of factorials.
+    dj1, dj2, dj3 = _doubled(j1), _doubled(j2), _doubled(j3)
+    m1, m2, m3 = np.broadcast_arrays(*(np.asarray(m, dtype=float) for m in (m1, m2, m3)))
+
+    if not _triangle(dj1, dj2, dj3):
+        return np.zeros(m1.shape)
+
+    # everything below is an integer when the m's are valid
+    j1, j2, j3 = dj1 / 2, dj2 / 2, dj3 / 2
+    valid = (np.abs(m1 + m2 + m3) < 1e-9) & (np.abs(m1) <= j1) & (np.abs(m2) <= j2) & (np.abs(m3) <= j3) \
+        & (np.abs(np.rint(j1 + m1) - (j1 + m1)) < 1e-9) & (np.abs(np.rint(j2 + m2) - (j2 + m2)) < 1e-9)
+
+    # move invalid entries to harmless values, they are zeroed at the end
+    m1 = np.where(valid, m1, j1 - np.floor(j1))
+    m2 = np.where(valid, m2, j2 - np.floor(j2))
+    m3 = np.where(valid, m3, -m1 - m2)
+
+    fact = np.cumprod(np.concatenate([[1.], np.arange(1, (dj1 + dj2 + dj3) // 2 + 2)]))
+
+    def _f(n):
+        return fact[np.rint(n).astype(int)]
+
+    k = np.arange((dj1 + dj2 - dj3) // 2 + 1).reshape((-1,) + (1,) * m1.ndim)
+    args = np.broadcast_arrays(k, j3 - j2 + k + m1, j3 - j1 + k - m2, j1 + j2 - j3 - k, j1 - k - m1, j2 - k + m2)
+    in_range = np.all([arg > -0.5 for arg in args], axis=0)
+
+    terms = (-1.) ** k / np.prod([_f(np.where(in_range, arg, 0)) for arg in args], axis=0)
+    total = np.sum(np.where(in_range, terms, 0), axis=0)
+
+    delta = _f(j1 + j2 - j3) * _f(j1 - j2 + j3) * _f(-j1 + j2 + j3) / _f(j1 + j2 + j3 + 1)
+    norm = np.sqrt(delta * _f(j1 + m1) * _f(j1 - m1) * _f(j2 + m2) * _f(j2 - m2) * _f(j3 + m3) * _f(j3 - m3))
+    sign = (-1.) ** np.rint(j1 - j2 - m3)
+
+    return np.where(valid, sign * norm * total, 0.)
+
+
+@functools.lru_cache(maxsize=1024)
+def hyperfine_amplitudes(nuclear_spin, j_ground, j_excited, f_ground, f_excited):
+    # Signed dipole matrix elements <F m_g| d_q |F' m_e> between hyperfine
+    # levels F (of J) and F' (of J'), q = m_g - m_e (Steck, eqn. 36-40)
+    #   (-1)^(2F'+J+I+m_g) sqrt((2J'+1)(2F+1)(2F'+1)) {J J' 1; F' F I} (F' 1 F; m_e q -m_g),
+    # in units where they square up to `hyperfine_strengths`. Shape
+    # (2F+1, 2F'+1), m_g and m_e from highest to lowest. Read-only, as it is cached.
+    six_j = wigner_6j(j_ground, j_excited, 1, f_excited, f_ground, nuclear_spin)
+
+    m_g = np.array([f_ground - n for n in range(_doubled(f_ground) + 1)])[:, np.newaxis]
+    m_e = np.array([f_excited - n for n in range(_doubled(f_excited) + 1)])[np.newaxis, :]
+    three_j = wigner_3j(f_excited, 1, f_ground, m_e, m_g - m_e, -m_g)
+
+    sign = (-1.) ** np.rint(2 * f_excited + j_ground + nuclear_spin + m_g)
+    amplitudes = sign * np.sqrt((2 * j_excited + 1) * (2 * f_ground + 1) * (2 * f_excited + 1)) * six_j * three_j
+    amplitudes.flags.writeable = False
+
+    return amplitudes
+
+
+@functools.lru_cache(maxsize=1024)
+def hyperfine_strengths(nuclear_spin, j_ground, j_excited, f_ground, f_excited):
+    # Relative strengths {(m_g, m_e): strength} of the dipole transitions
+    # between hyperfine levels F (of J) and F' (of J'), (Steck, eqn. 36-40)
+    #   (2J'+1)(2F+1)(2F'+1) {J J' 1; F' F I}^2 (F' 1 F; m_e q -m_g)^2.
+    # The strengths from one excited state to all ground levels F sum up to 1.
+    # Forbidden transitions (zero strength) are left out.
+    strengths = hyperfine_amplitudes(nuclear_spin, j_ground, j_excited, f_ground, f_excited) ** 2
+
+    m_g = np.array([f_ground - n for n in range(_doubled(f_ground) + 1)])[:, np.newaxis]
+    m_e = np.array([f_excited - n for n in range(_doubled(f_excited) + 1)])[np.newaxis, :]
+    m_g, m_e = np.broadcast_arrays(m_g, m_e)
+    allowed = strengths > 1e-12
+
+    return {(_to_number(g), _to_number(e)): float(s)
+            for g, e, s in zip(m_g[allowed], m_e[allowed], strengths[allowed])}
+
+
+def _to_number(m):
+    # integer quantum numbers as int, half-integers as float
+    return int(m) if float(m).is_integer() else float(m)
@@ -0,0 +1,33 @@
+from rate_equation.transition_profile import TransitionProfile, state, transition, group
+
+
+def create_87Rb_trans():
+    # 87Rb D2-line, Fg=2 -> Fe=3
+    trans = TransitionProfile(
+            ground_states=[state(s) for s in ["G2", "G1", "G0", "G-1", "G-2"]],
+            excited_states=[state(s) for s in ["E3", "E2", "E1", "E0", "E-1", "E-2", "E-3"]],
+            transitions=[
+                # Metcalf, Appendix D
+                transition("G-2", "E-3", 60),
+                transition("G-2", "E-2", 20),
+                transition("G-2", "E-1", 4),
+                transition("G-1", "E-2", 40),
+                transition("G-1", "E-1", 32),
+                transition("G-1", "E0",  12),
+                transition("G0", "E-1",  24),
+                transition("G0", "E0",   36),
+                transition("G0", "E1",   24),
+                transition("G1", "E0",   12),
+                transition("G1", "E1",   32),
+                transition("G1", "E2",   40),
+                transition("G2", "E1",   4),
+                transition("G2", "E2",   20),
+                transition("G2", "E3",   60),
+                ],
+            frequencies={
+                group("G->E"): 384.2304844685e12
+                },
+            gamma=6.0666e6
+            )
+
+    return trans
@@ -0,0 +1,21 @@
+import json
+
+from rate_equation import benchmark
+
+
+class TestBenchmark:
+    def test_run_and_compare(self):
+        report = benchmark.run_benchmarks([("hyperfine", 1), ("ring", 10)], field_counts=(2,), sweep_lengths=(5,),
+                                          repeat=1)
+        report = json.loads(json.dumps(report))  # JSON serializable
+
+        assert [r["name"] for r in report["results"]] == ["init", "build_matrix", "steady_state", "force", "sweep"] * 2
+        assert all(r["throughput"] > 0 and r["peak_memory"] > 0 for r in report["results"])
+        assert report["results"][4]["params"]["num_of_points"] == 5
+
+        assert benchmark.compare(report, report) == []
+
+        faster = json.loads(json.dumps(report))
+        faster["results"][0]["throughput"] *= 2
+        regressions = benchmark.compare(report, faster, threshold=0.2)
+        assert [result["name"] for result, _ in regressions] == ["init"]
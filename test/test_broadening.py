@@ -0,0 +1,135 @@
+import numpy as np
+
+from rate_equation.atomic_data import build_profile
+from rate_equation.broadening import BroadenedRateEquation, gauss_hermite
+from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.rate_equation import RateEquation
+
+
+class TestBroadening:
+    mass = 86.909 * 1.66054e-27  # 87Rb, kg
+
+    def _create_rate_eqn(self):
+        trans = build_profile("87Rb D2", [2, 1], [2])
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=trans.frequencies[trans.groups[0]], delta_m=+1, normalized_intensity=0.2),
+            RadiationField(frequency=trans.frequencies[trans.groups[1]], delta_m=0, normalized_intensity=0.2),
+            ])
+
+        return RateEquation(trans, fields, [ZeemanDetuning({"G2": 1/2, "G1": -1/2, "E2": 2/3}, 1e-4)])
+
+    def test_gauss_hermite(self):
+        x, w = gauss_hermite(10)
+        assert np.isclose(w.sum(), 1)
+        assert np.isclose(np.sum(w * x**2), 1)
+        assert np.isclose(np.sum(w * x**4), 3)
+
+    def test_velocity_average(self):
+        from scipy.constants import k
+
+        rate_eqn = self._create_rate_eqn()
+        temperature = 1e-3
+        broadened = BroadenedRateEquation(rate_eqn, self.mass, temperature, n_velocity=40)
+
+        freq = np.array([[field.frequency for field in rate_eqn.radiation.fields]] * 4)
+        freq[:, 0] += np.linspace(-3, 3, 4) * 6e6
+        result = broadened.average(field_frequency=freq)
+        assert result.populations.shape == (4, 8)
+        assert result.field_scattering.shape == (4, 2)
+        assert result.force.shape == (4,)
+        assert np.allclose(result.populations.sum(axis=-1), 1)
+
+        # brute force: one rate equation per velocity class on a fine grid
+        sigma = np.sqrt(k * temperature / self.mass)
+        velocities = np.linspace(-6, 6, 801) * sigma
+        weights = np.exp(-velocities**2 / (2 * sigma**2))
+        weights /= weights.sum()
+
+        for i in [0, 2]:
+            popu = 0
+            fields = RadiationFieldProfile([rate_eqn.radiation.fields[0]._replace(frequency=freq[i, 0]),
+                                            rate_eqn.radiation.fields[1]])
+            for v, w in zip(velocities, weights):
+                popu = popu + w * RateEquation(rate_eqn.trans_profile, fields,
+                                               rate_eqn.detunings + [DopplerDetuning(v)]
+                                               ).calculate_static_state_population()
+
+            assert np.allclose(result.populations[i], popu, atol=2e-3)
+
+        # the cache returns the same result, another temperature a new one
+        assert broadened.average(field_frequency=freq) is result
+        assert broadened.average(field_frequency=freq, temperature=2e-3) is not result
+
+        # changes of the wrapped rate equation are not served from the cache
+        unscanned = broadened.average()
+        rate_eqn.set_field(1, normalized_intensity=0.4)
+        assert not np.allclose(broadened.average().populations, unscanned.populations)
+        rate_eqn.set_detuning(0, b_field=3e-4)
+        changed = broadened.average()
+        assert not np.allclose(changed.populations, unscanned.populations)
+
+        expected = BroadenedRateEquation(RateEquation(rate_eqn.trans_profile, rate_eqn.radiation, rate_eqn.detunings),
+                                         self.mass, temperature, n_velocity=40).average()
+        assert np.allclose(changed.populations, expected.populations)
+        assert np.allclose(changed.force, expected.force)
+
+    def test_thermal(self):
+        from scipy.constants import k
+        from rate_equation.atomic_data import g_factors
+        from rate_equation.solver import steady_state
+
+        # vapor cell: the Doppler width (~170 m/s) is far above the natural
+        # line width (~5 m/s), cooling transition cycling with a repumper
+        line = "87Rb D2"
+        trans = build_profile(line, [2, 1], [3, 2])
+        freqs = {grp: f for grp, f in trans.frequencies.items()}
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freqs[("G2", "E3")], delta_m=+1, normalized_intensity=0.5),
+            RadiationField(frequency=freqs[("G1", "E2")], delta_m=0, normalized_intensity=0.5),
+            ])
+        rate_eqn = RateEquation(trans, fields, [ZeemanDetuning(g_factors(line, [2, 1], [3, 2]), 1e-4)])
+
+        temperature = 300
+        broadened = BroadenedRateEquation(rate_eqn, self.mass, temperature)
+
+        freq = np.array([[field.frequency for field in fields.fields]] * 3)
+        freq[:, 0] += np.array([-300e6, 0, 150e6])
+        result = broadened.average(field_frequency=freq)
+
+        # brute force: velocity classes much narrower than the line width
+        sigma = np.sqrt(k * temperature / self.mass)
+        velocities = np.linspace(-6, 6, 20001) * sigma
+        weights = np.exp(-velocities**2 / (2 * sigma**2))
+        weights /= weights.sum()
+
+        for i in range(3):
+            rates = rate_eqn.sweep_scattering_rates(field_frequency=np.repeat(freq[[i]], len(velocities), axis=0),
+                                                    velocity=velocities)
+            popu = steady_state(rate_eqn.assemble_matrix(rates.sum(axis=-2)))
+            field_scattering = np.einsum("nft,nt->nf", rates, popu[:, trans.trans_ground])
+
+            assert np.allclose(result.populations[i], weights @ popu, rtol=0, atol=1e-6)
+            assert np.allclose(result.field_scattering[i], weights @ field_scattering, rtol=1e-4)
+
+    def test_zero_width(self):
+        rate_eqn = self._create_rate_eqn()
+        broadened = BroadenedRateEquation(rate_eqn, self.mass, 0, n_velocity=3, b_field_mean=1e-4, b_field_sigma=0)
+
+        result = broadened.average()
+        assert np.allclose(result.populations[0], rate_eqn.calculate_static_state_population())
+
+        # field distribution: nodes of both distributions
+        broadened = BroadenedRateEquation(rate_eqn, self.mass, 1e-3, n_velocity=4, b_field_mean=1e-4,
+                                          b_field_sigma=1e-5, n_b_field=3)
+        velocities, b_fields, weights = broadened.nodes()
+        assert velocities.shape == b_fields.shape == weights.shape == (1, 12)
+        assert np.isclose(weights.sum(), 1)
+        assert np.isclose(np.sum(weights * b_fields), 1e-4)
+        assert np.allclose(broadened.average().populations.sum(axis=-1), 1)
+
+        # the velocity distribution is centered on the one of the DopplerDetuning
+        moving = RateEquation(rate_eqn.trans_profile, rate_eqn.radiation, rate_eqn.detunings + [DopplerDetuning(3.)])
+        broadened = BroadenedRateEquation(moving, self.mass, 0, n_velocity=3)
+        assert broadened.mean_velocity == 3
+        assert np.allclose(broadened.average().populations[0], moving.calculate_static_state_population())
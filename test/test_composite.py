@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+
+from rate_equation.atomic_data import build_profile, g_factors
+from rate_equation.composite import CompositeRateEquation, split_profile
+from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.rate_equation import RateEquation
+from rate_equation.transition_profile import group
+from rate_equation.solver import evolve, DegenerateSteadyStateError
+
+
+class TestComposite:
+    def _create_fields(self, trans):
+        # cooling light on G2 -> E3 and pumping light on G1 -> E0
+        freq_cool = trans.frequencies[trans.groups[0]] - 6e6
+        freq_pump = [f for grp, f in trans.frequencies.items() if grp.ground_state_hyperfine == "G1"][0]
+
+        return RadiationFieldProfile([
+            RadiationField(frequency=freq_cool, delta_m=+1, normalized_intensity=0.5),
+            RadiationField(frequency=freq_cool, delta_m=-1, normalized_intensity=0.5, direction=-1),
+            RadiationField(frequency=freq_pump, delta_m=0, normalized_intensity=0.1),
+            RadiationField(frequency=freq_pump, delta_m=+1, normalized_intensity=0.1),
+            ])
+
+    def _create_detunings(self, line):
+        return [ZeemanDetuning(g_factors(line, range(5), range(6)), 1e-4), DopplerDetuning(0.3)]
+
+    def test_split(self):
+        trans = build_profile("87Rb D2", [2, 1], [3, 0])
+        parts = split_profile(trans)
+
+        assert [len(ground) for ground, _, _ in parts] == [5, 3]
+        assert sum(len(t) for _, _, t in parts) == len(trans.transitions)
+
+        # all hyperfine levels are coupled
+        assert len(split_profile(build_profile("87Rb D2"))) == 1
+
+    def test_blocks(self):
+        line = "87Rb D2"
+        trans = build_profile(line, [2, 1], [3, 0])
+        fields = self._create_fields(trans)
+        detunings = self._create_detunings(line)
+
+        # the monolithic matrix has two closed classes
+        rate_eqn = RateEquation(trans, fields, detunings)
+        with pytest.raises(DegenerateSteadyStateError):
+            rate_eqn.calculate_static_state_population()
+
+        composite = CompositeRateEquation([(trans, detunings)], fields)
+        assert [block.weight for block in composite.blocks] == [5/8, 3/8]
+
+        # long-time limit of the monolithic system from a uniform population
+        popu = composite.calculate_static_state_population()
+        expected = evolve(rate_eqn.build_matrix(), np.full(8, 1/8), [1e-2])[0]
+        assert np.allclose(popu, expected, atol=1e-9)
+
+        assert np.allclose(composite.field_scattering_rates, rate_eqn.field_scattering_rates)
+        assert np.isclose(composite.calculate_force(popu), rate_eqn.calculate_force(popu))
+
+        # sweeps, also per field and with the sparse backend
+        freqs = np.array([[f.frequency for f in fields.fields]] * 5)
+        freqs[:, :2] += np.linspace(-2, 2, 5)[:, np.newaxis] * 6e6
+        velocities = np.linspace(-1, 1, 5)
+
+        for sparse in [False, True]:
+            composite = CompositeRateEquation([(trans, detunings)], fields, sparse=sparse)
+            popu = composite.sweep_steady_state(field_frequency=freqs, velocity=velocities)
+            expected = evolve(rate_eqn.sweep(field_frequency=freqs, velocity=velocities), np.full(8, 1/8), [1e-2])[:, 0]
+            assert np.allclose(popu, expected, atol=1e-9)
+
+            force, scattering = composite.calculate_force_array(field_frequency=freqs, velocity=velocities)
+            expected_force, expected_scattering = rate_eqn.calculate_force_array(popu, field_frequency=freqs,
+                                                                                 velocity=velocities)
+            assert np.allclose(force, expected_force) and np.allclose(scattering, expected_scattering)
+
+    def test_detuning_window(self):
+        line = "87Rb D2"
+        trans = build_profile(line, [2, 1], [3, 0])
+        fields = self._create_fields(trans)
+        detunings = self._create_detunings(line)
+
+        composite = CompositeRateEquation([(trans, detunings)], fields, detuning_window=1e9)
+        assert composite.block_fields(0) == (0, 1)
+        assert composite.block_fields(1) == (2, 3)
+
+        # without the window, the pumping light also drives the cooling block
+        unfiltered = CompositeRateEquation([(trans, detunings)], fields)
+        assert unfiltered.block_fields(0) == (0, 1, 2, 3)
+
+        popu = composite.calculate_static_state_population()
+        assert np.allclose(popu, unfiltered.calculate_static_state_population(), atol=1e-6)
+
+        # a sweep that tunes a field into the window includes it
+        freqs = np.array([[f.frequency for f in fields.fields]] * 2)
+        freqs[1, 3] = fields.fields[0].frequency
+        assert composite.block_fields(0, freqs) == (0, 1, 3)
+        # (leaving the pumping block with pi light only, which has two dark states)
+        popu = composite.sweep_steady_state(field_frequency=freqs, on_degenerate="nan")
+        assert np.all(np.isnan(popu[1, 5:]))
+        assert np.allclose(popu[:, :5], unfiltered.sweep_steady_state(field_frequency=freqs)[:, :5], atol=1e-6)
+
+    def test_group_mask(self):
+        line = "87Rb D2"
+        trans = build_profile(line, [2, 1], [2])
+        freqs = trans.frequencies
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freqs[group("G2->E2")], delta_m=+1, normalized_intensity=0.5),
+            RadiationField(frequency=freqs[group("G1->E2")], delta_m=+1, normalized_intensity=0.1),
+            ])
+        detunings = self._create_detunings(line)
+
+        # a single block, in which each field only drives its own group
+        composite = CompositeRateEquation([(trans, detunings)], fields, detuning_window=1e9)
+        assert len(composite.blocks) == 1 and composite.block_fields(0) == (0, 1)
+
+        rate_eqn = RateEquation(trans, fields, detunings)
+        in_group = np.array([[t.group == group(label) for t in trans.transitions]
+                             for label in ["G2->E2", "G1->E2"]])
+        expected = np.where(in_group, rate_eqn.field_scattering_rates, 0)
+        assert np.allclose(composite.field_scattering_rates, expected)
+
+        popu = composite.calculate_static_state_population()
+        assert np.isclose(popu.sum(), 1)
+        assert np.allclose(rate_eqn.assemble_matrix(expected.sum(axis=0)) @ popu, 0, atol=1e-6)
+        assert np.isclose(composite.calculate_force(popu), rate_eqn.force_from_rates(expected, popu)[0])
+
+    def test_shifted_window(self):
+        line = "87Rb D2"
+        trans = build_profile(line, [2], [3])
+        # 30 MHz blue of the bare resonance: out of a 10 MHz window, but
+        # within it of the stretched transition at 2 mT (+28 MHz) or for
+        # atoms moving at 23 m/s along the field (+30 MHz)
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=trans.group_frequencies[0] + 30e6, delta_m=+1, normalized_intensity=0.5),
+            ])
+        detunings = [ZeemanDetuning(g_factors(line, [2], [3]), 0)]
+
+        composite = CompositeRateEquation([(trans, detunings)], fields, detuning_window=1e7)
+        assert composite.block_fields(0) == ()
+        assert composite.block_fields(0, b_field=np.array([0, 2e-3])) == (0,)
+        assert composite.block_fields(0, velocity=np.array([0, 23.0])) == (0,)
+
+        rate_eqn = RateEquation(trans, fields, detunings)
+        for params in [dict(b_field=np.array([0, 2e-3])), dict(velocity=np.array([0, 23.0]))]:
+            force, scattering = composite.calculate_force_array(**params)
+            expected_force, expected_scattering = rate_eqn.calculate_force_array(**params)
+
+            assert force[0] == 0 and scattering[0] == 0
+            assert np.isclose(force[1], expected_force[1]) and np.isclose(scattering[1], expected_scattering[1])
+
+    def test_undriven_block(self):
+        trans = build_profile("87Rb D2", [2, 1], [3, 0])
+        freq = trans.frequencies[trans.groups[0]]
+        fields = RadiationFieldProfile([RadiationField(frequency=freq, delta_m=+1, normalized_intensity=0.3)])
+
+        # the window leaves the F = 1 -> F' = 0 block without any field
+        composite = CompositeRateEquation([(trans, [])], fields, detuning_window=1e8)
+        assert composite.block_fields(1) == ()
+
+        cooling = RateEquation(composite.blocks[0].trans_profile, fields, [])
+        cooling_popu = cooling.calculate_static_state_population()
+
+        popu = composite.calculate_static_state_population()
+        assert np.allclose(popu[:5], 5/8 * cooling_popu)
+        assert np.allclose(popu[5:], 1/8)
+        assert np.isclose(composite.calculate_force(popu), 5/8 * cooling.calculate_force(cooling_popu))
+        assert np.all(composite.field_scattering_rates[:, composite.blocks[1].trans_index] == 0)
+
+        freqs = freq + np.linspace(-1, 1, 3) * 6e6
+        popu = composite.sweep_steady_state(field_frequency=freqs)
+        assert popu.shape == (3, 8)
+        assert np.allclose(popu[:, 5:], 1/8)
+
+        force, scattering = composite.calculate_force_array(field_frequency=freqs)
+        expected_force, expected_scattering = cooling.calculate_force_array(popu[:, :5], field_frequency=freqs)
+        assert np.allclose(force, expected_force) and np.allclose(scattering, expected_scattering)
+
+    def test_species(self):
+        profiles = {line: build_profile(line, [2 if line.startswith("87") else 3], [3 if line.startswith("87") else 4])
+                    for line in ["87Rb D2", "85Rb D2"]}
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=profiles["87Rb D2"].group_frequencies[0] - 3e6, delta_m=+1,
+                           normalized_intensity=0.3),
+            RadiationField(frequency=profiles["85Rb D2"].group_frequencies[0] - 3e6, delta_m=+1,
+                           normalized_intensity=0.3),
+            ])
+        species = [(tp, self._create_detunings(line)) for line, tp in profiles.items()]
+        abundances = [0.28, 0.72]
+
+        composite = CompositeRateEquation(species, fields, abundances=abundances)
+        assert len(composite.ground_states) == 5 + 7
+        popu = composite.calculate_static_state_population()
+        assert np.isclose(popu.sum(), 1)
+
+        force = 0
+        for (tp, detunings), abundance, popu_slice in zip(species, abundances, [popu[:5], popu[5:]]):
+            rate_eqn = RateEquation(tp, fields, detunings)
+            species_popu = rate_eqn.calculate_static_state_population()
+            assert np.allclose(popu_slice, abundance * species_popu)
+            force += abundance * rate_eqn.calculate_force(species_popu)
+
+        assert np.isclose(composite.calculate_force(popu), force)
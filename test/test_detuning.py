@@ -24,3 +24,72 @@ class TestDetuning:
         assert round(det.get_detuning(508.3331958e12, state("G2"), state("E3")) / 1e6) == -1696
 
 
+    def test_detuning_array(self):
+        from rate_equation.transition_profile import TransitionProfile, transition, group
+
+        trans = TransitionProfile(
+                ground_states=[state(s) for s in ["G1", "G0", "G-1"]],
+                excited_states=[state(s) for s in ["E2", "E1", "E0", "E-1", "E-2"]],
+                transitions=[
+                    transition("G-1", "E-2", 6),
+                    transition("G-1", "E-1", 3),
+                    transition("G-1", "E0",  1),
+                    transition("G0", "E-1",  3),
+                    transition("G0", "E0",   4),
+                    transition("G0", "E1",   3),
+                    transition("G1", "E0",   1),
+                    transition("G1", "E1",   3),
+                    transition("G1", "E2",   6),
+                    ],
+                frequencies={group("G->E"): 508.3331958e12},
+                gamma=9.795e6
+                )
+        field_freqs = np.array([[508.3331958e12], [508.3331958e12 + 1e9]])
+
+        for det in [ZeemanDetuning(g_factors={"G": -1/2, "E": 2/3}, b_field=0.06),
+                    DopplerDetuning(velocity=-1000)]:
+            dets = np.broadcast_to(det.get_detuning_array(field_freqs, trans), (2, len(trans.transitions)))
+
+            for f in range(2):
+                for t, d in zip(trans.transitions, dets[f]):
+                    assert np.isclose(d, det.get_detuning(field_freqs[f, 0], t.ground_state, t.excited_state))
+
+    def test_zeeman_cache(self):
+        import pickle
+        from rate_equation.transition_profile import TransitionProfile, transition, group
+
+        trans = TransitionProfile(
+                ground_states=[state(s) for s in ["G1", "G0", "G-1"]],
+                excited_states=[state(s) for s in ["E1", "E0", "E-1"]],
+                transitions=[
+                    transition("G-1", "E-1", 1),
+                    transition("G-1", "E0",  1),
+                    transition("G0", "E-1",  1),
+                    transition("G0", "E1",   1),
+                    transition("G1", "E0",   1),
+                    transition("G1", "E1",   1),
+                    ],
+                frequencies={group("G->E"): 508.3331958e12},
+                gamma=9.795e6
+                )
+        det = ZeemanDetuning(g_factors={"G": -1/2, "E": 2/3}, b_field=1e-3)
+
+        def expected(det):
+            return np.array([det.get_detuning(None, t.ground_state, t.excited_state) for t in trans.transitions])
+
+        shifts = det.get_detuning_array(None, trans)
+        assert det.get_detuning_array(None, trans) is shifts
+        assert np.allclose(shifts, expected(det))
+
+        det.b_field = 2e-3
+        assert np.allclose(det.get_detuning_array(None, trans), 2 * shifts)
+
+        det.g_factors = {"G": 1/2, "E": 2/3}
+        assert np.allclose(det.get_detuning_array(None, trans), expected(det))
+        assert not np.allclose(det.get_detuning_array(None, trans), 2 * shifts)
+
+        swept = det.with_b_field(np.array([0, 1e-3, 2e-3])[:, np.newaxis])
+        assert np.allclose(swept.get_detuning_array(None, trans)[2], det.get_detuning_array(None, trans))
+
+        copied = pickle.loads(pickle.dumps(det))
+        assert np.allclose(copied.get_detuning_array(None, trans), det.get_detuning_array(None, trans))
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from rate_equation.rate_equation import RateEquation
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.solver import steady_state
+from rate_equation import executor as executor_module
+from rate_equation.executor import SweepExecutor
+
+from test.profiles import create_87Rb_trans
+
+
+class TestExecutor:
+    def _create_executor(self, output_dir):
+        trans = create_87Rb_trans()
+        freq = 384.2304844685e12
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq, delta_m=+1, normalized_intensity=0.2 * 0.95),
+            RadiationField(frequency=freq, delta_m=-1, normalized_intensity=0.2 * 0.05, direction=-1),
+            ])
+        rate_eqn = RateEquation(trans, fields, [ZeemanDetuning(g_factors={"G": 1/2, "E": 2/3}, b_field=0)])
+
+        axes = {
+            "field_frequency": freq + np.linspace(-10, 5, 6) * trans.gamma,
+            "b_field": np.linspace(-2e-3, 2e-3, 5),
+            "velocity": [-1., 0., 1.],
+            }
+
+        return SweepExecutor(rate_eqn, axes, str(output_dir), chunk_size=7)
+
+    def _expected(self, executor):
+        grid = np.meshgrid(*executor.axes.values(), indexing="ij")
+        params = {name: g.ravel() for name, g in zip(executor.axes, grid)}
+
+        force, scattering = executor.rate_eqn.calculate_force_array(**params)
+        popu = steady_state(executor.rate_eqn.sweep(**params))
+
+        return popu.reshape(executor.shape + (5,)), force.reshape(executor.shape), \
+                scattering.reshape(executor.shape)
+
+    def test_parallel(self, tmp_path):
+        executor = self._create_executor(tmp_path / "sweep")
+        calls = []
+
+        result = executor.run(n_workers=2, progress=lambda done, total: calls.append((done, total)))
+        popu, force, scattering = self._expected(executor)
+
+        assert executor.num_of_chunks == 13
+        assert calls[-1] == (13, 13)
+        assert result.populations.shape == (6, 5, 3, 5)
+        assert np.allclose(result.populations, popu)
+        assert np.allclose(result.force, force, atol=1e-30)
+        assert np.allclose(result.scattering, scattering)
+
+    def test_resume(self, tmp_path):
+        executor = self._create_executor(tmp_path / "sweep")
+        executor.run(n_workers=1)
+
+        # forget two chunks, as if the sweep had been interrupted
+        done = np.lib.format.open_memmap(str(tmp_path / "sweep" / "done.npy"), mode="r+")
+        done[[3, 12]] = False
+        done.flush()
+        del done
+
+        popu = np.lib.format.open_memmap(str(tmp_path / "sweep" / "populations.npy"), mode="r+")
+        popu.reshape((-1, 5))[21:28] = np.nan
+        popu.reshape((-1, 5))[84:] = np.nan
+        popu.flush()
+        del popu
+
+        # the serial run does not keep the output files open
+        assert executor_module._worker is None
+
+        resumed = self._create_executor(tmp_path / "sweep")
+        assert resumed.pending_chunks() == [3, 12]
+
+        calls = []
+        result = resumed.run(n_workers=1, progress=lambda done, total: calls.append(done))
+
+        assert calls == [12, 13]
+        assert np.allclose(result.populations, self._expected(resumed)[0])
+
+    def test_mismatched_directory(self, tmp_path):
+        self._create_executor(tmp_path / "sweep").run(n_workers=1)
+
+        other = self._create_executor(tmp_path / "sweep")
+        other.axes["velocity"] = other.axes["velocity"] * 2
+
+        with pytest.raises(AssertionError):
+            other.run(n_workers=1)
@@ -0,0 +1,82 @@
+import json
+import logging
+
+import numpy as np
+
+from rate_equation import instrumentation
+from rate_equation.atomic_data import build_profile
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.executor import SweepExecutor
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.rate_equation import RateEquation
+
+
+class TestInstrumentation:
+    def _create_rate_eqn(self):
+        trans = build_profile("87Rb D2", [2], [3])
+        freq = trans.group_frequencies[0]
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq, delta_m=+1, normalized_intensity=0.2),
+            RadiationField(frequency=freq, delta_m=-1, normalized_intensity=0.1, direction=-1),
+            ])
+
+        return RateEquation(trans, fields, [ZeemanDetuning({"G2": 1/2, "E3": 2/3}, 1e-4)])
+
+    def test_disabled(self):
+        assert instrumentation.recorder is None
+        self._create_rate_eqn().calculate_static_state_population()
+        assert instrumentation.recorder is None
+
+    def test_record(self):
+        summaries = []
+
+        with instrumentation.record(summaries.append) as outer:
+            rate_eqn = self._create_rate_eqn()
+
+            with instrumentation.record(summaries.append) as inner:
+                popu = rate_eqn.calculate_static_state_population()
+                rate_eqn.calculate_force(popu)
+
+            rate_eqn.sweep(b_field=np.linspace(0, 1e-3, 4))
+
+            tp, radiation = rate_eqn.trans_profile, rate_eqn.radiation
+            radiation.get_effective_scattering_rate(tp.transitions[0], tp.trans_frequency[0], rate_eqn.detunings,
+                                                    tp.gamma)
+
+        assert instrumentation.recorder is None
+        assert summaries == [inner.summary(), outer.summary()]
+        json.dumps(outer.summary())
+
+        stages = inner.summary()["stages"]
+        assert {"matrix_assembly", "steady_state", "closed_classes", "force"} <= set(stages)
+        assert stages["steady_state"]["calls"] == 1
+        assert inner.summary()["values"]["condition_number"]["count"] == 1
+
+        summary = outer.summary()
+        assert summary["stages"]["scattering_rates"]["calls"] == 2  # __init__ and sweep
+        assert summary["stages"]["matrix_assembly"]["calls"] == 2
+        assert summary["counters"]["matrices"] == 5
+        assert summary["values"]["matrix_size"] == {"count": 2, "mean": 5., "min": 5., "max": 5.}
+        assert summary["counters"]["get_detuning"] == 1
+
+    def test_log_summary(self, caplog):
+        logger = logging.getLogger("rate_equation.test")
+
+        with caplog.at_level(logging.INFO, logger="rate_equation.test"):
+            with instrumentation.record(instrumentation.log_summary(logger)):
+                self._create_rate_eqn().calculate_static_state_population()
+
+        assert any("stage steady_state: 1 calls" in message for message in caplog.messages)
+
+    def test_pool_workers(self, tmp_path):
+        rate_eqn = self._create_rate_eqn()
+        freq = rate_eqn.radiation.fields[0].frequency
+        executor = SweepExecutor(rate_eqn, {"field_frequency": freq + np.linspace(-5, 5, 10) * 6e6},
+                                 str(tmp_path / "sweep"), chunk_size=3)
+
+        with instrumentation.record() as rec:
+            executor.run(n_workers=2)
+
+        summary = rec.summary()
+        assert summary["stages"]["steady_state"]["calls"] == executor.num_of_chunks
+        assert summary["counters"]["matrices"] == 10
@@ -0,0 +1,96 @@
+import numpy as np
+
+from rate_equation import atomic_data
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.intermediate_field import IntermediateField, IntermediateFieldDetuning
+from rate_equation.radiation_field import RadiationField, RadiationFieldProfile
+from rate_equation.rate_equation import RateEquation
+from rate_equation.transition_profile import state
+
+
+class TestIntermediateField:
+    def test_breit_rabi(self):
+        from scipy.constants import physical_constants, h
+
+        model = IntermediateField("87Rb D2")
+        b_fields = np.array([0, 0.01, 0.1, 1.0])
+        eig = model.eigensystem(b_fields)
+
+        # Breit-Rabi formula of the J = 1/2 ground level (g_I neglected)
+        line = model.line
+        hfs = line.a_ground * (line.nuclear_spin + 1/2)
+        x = line.g_j_ground * physical_constants['Bohr magneton'][0] / h * b_fields / hfs
+
+        for (f, m), n in model.ground.index.items():
+            if abs(m) == 2:
+                expected = 3/8 * hfs + m / 4 * hfs * x  # stretched states are linear in B
+            else:
+                expected = -hfs / 8 + (1 if f == 2 else -1) * hfs / 2 * np.sqrt(1 + m * x + x**2)
+
+            assert np.allclose(eig.ground_energies[:, n], expected, rtol=0, atol=1)
+
+    def test_strengths(self):
+        model = IntermediateField("87Rb D2")
+        tp = model.profile
+        shifts, strengths = model.transition_data(np.array([0, 1e-6, 0.05, 1.0]))
+
+        assert shifts.shape == strengths.shape == (4, len(tp.transitions))
+        assert np.allclose(strengths[0], tp.trans_strength)
+        assert np.allclose(shifts[0], 0)
+
+        # every excited eigenstate still decays with total strength 1
+        for s in strengths:
+            branching = np.zeros(tp.branching_ratio.shape)
+            branching[tp.trans_ground, tp.trans_excited] = s
+            assert np.allclose(branching.sum(axis=0), 1)
+
+        # the stretched cycling transition is not mixed
+        cycling = model.transition_index[(state("G2,2"), state("E3,3"))]
+        assert np.allclose(strengths[:, cycling], 1)
+
+        # forbidden at zero field, e.g. F=1 -> F'=3, but allowed at strong field
+        forbidden = model.transition_index[(state("G1,1"), state("E3,2"))]
+        assert strengths[0, forbidden] < 1e-12 < strengths[-1, forbidden]
+
+        # weak field limit: linear Zeeman shifts with g_F (up to second order shifts)
+        zeeman = ZeemanDetuning(atomic_data.g_factors("87Rb D2", [2, 1], [3, 2, 1, 0]), 1e-6)
+        linear = zeeman.get_detuning_array(None, tp)
+        assert np.allclose(shifts[1], linear, rtol=0, atol=1e-3 * np.abs(linear).max())
+
+    def test_cache(self):
+        model = IntermediateField("87Rb D2", [2], [3], b_resolution=1e-6)
+
+        model.eigensystem([0.1, 0.1 + 1e-9, 0.2])
+        assert len(model._cache) == 2
+
+        shifts = model.transition_shifts(np.array([[0.1], [0.2]]))
+        assert shifts.shape == (2, 1, len(model.profile.transitions))
+        assert len(model._cache) == 2
+
+    def test_rate_equation(self):
+        model = IntermediateField("87Rb D2", [2, 1], [2])
+        tp = model.profile
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=tp.frequencies[tp.groups[0]], delta_m=1, normalized_intensity=0.1),
+            RadiationField(frequency=tp.frequencies[tp.groups[1]], delta_m=0, normalized_intensity=0.1),
+            ])
+
+        # zero field: identical to the linear Zeeman model
+        rate_eqn = RateEquation(tp, fields, [IntermediateFieldDetuning(model, 0)])
+        zeeman_eqn = RateEquation(tp, fields, [ZeemanDetuning(atomic_data.g_factors("87Rb D2", [2, 1], [2]), 0)])
+        assert np.allclose(rate_eqn.build_matrix(), zeeman_eqn.build_matrix())
+
+        b_fields = np.array([1e-4, 0.01, 0.1])
+        mats = rate_eqn.sweep(b_field=b_fields)
+        assert mats.shape == (3, 8, 8)
+
+        for i, b in enumerate(b_fields):
+            rate_eqn.set_detuning(0, b_field=b)
+            mat = rate_eqn.build_matrix()
+
+            assert np.allclose(mats[i], mat)
+            assert np.allclose(mat.sum(axis=0), 0, atol=1e-9 * np.abs(mat).max())
+
+            elements = np.array([[rate_eqn.calculate_matrix_element(gs1, gs2) for gs2 in tp.ground_states]
+                                 for gs1 in tp.ground_states])
+            assert np.allclose(mat, elements)
@@ -1,48 +1,19 @@
 import numpy as np
+import pytest
 
 from rate_equation.transition_profile import (Transition, TransitionProfile, State,
                                               state, transition, group)
 from rate_equation.rate_equation import RateEquation
 from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
 
-class TestTransitions:
-    def _create_87Rb_trans(self):
-        # 87Rb D2-line, Fg=2 -> Fe=3
-        trans = TransitionProfile(
-                ground_states=[state(s) for s in ["G2", "G1", "G0", "G-1", "G-2"]],
-                excited_states=[state(s) for s in ["E3", "E2", "E1", "E0", "E-1", "E-2", "E-3"]],
-                transitions=[
-                    # Metcalf, Appendix D
-                    transition("G-2", "E-3", 60),
-                    transition("G-2", "E-2", 20),
-                    transition("G-2", "E-1", 4),
-                    transition("G-1", "E-2", 40),
-                    transition("G-1", "E-1", 32),
-                    transition("G-1", "E0",  12),
-                    transition("G0", "E-1",  24),
-                    transition("G0", "E0",   36),
-                    transition("G0", "E1",   24),
-                    transition("G1", "E0",   12),
-                    transition("G1", "E1",   32),
-                    transition("G1", "E2",   40),
-                    transition("G2", "E1",   4),
-                    transition("G2", "E2",   20),
-                    transition("G2", "E3",   60),
-                    ],
-                frequencies={
-                    group("G->E"): 384.2304844685e12
-
-                    },
-                gamma=6.0666e6
-                )
-
-        return trans
+from test.profiles import create_87Rb_trans
 
+class TestTransitions:
     def _create_rate_eqn(self):
         # pumping Fg=2 with sigma-plus light to Fe=3
         # Atonche 2017, example 1
 
-        trans = self._create_87Rb_trans()
+        trans = create_87Rb_trans()
         fields = RadiationFieldProfile([ RadiationField(
             frequency=384.2304844685e12,
             delta_m=+1,
@@ -106,3 +77,304 @@ class TestTransitions:
 
 
 
+    def _create_87Rb_f2_f1_to_e2(self):
+        # 87Rb D2-line, Fg=2 -> Fe=2 and Fg=1 -> Fe=2 (Metcalf, Appendix D)
+        trans = TransitionProfile(
+                ground_states=[state(s) for s in ["G2", "G1", "G0", "G-1", "G-2", "H1", "H0", "H-1"]],
+                excited_states=[state(s) for s in ["E2", "E1", "E0", "E-1", "E-2"]],
+                transitions=[
+                    transition("G-2", "E-2", 20),
+                    transition("G-2", "E-1", 10),
+                    transition("G-1", "E-2", 10),
+                    transition("G-1", "E-1", 5),
+                    transition("G-1", "E0",  15),
+                    transition("G0", "E-1",  15),
+                    transition("G0", "E0",   0),
+                    transition("G0", "E1",   15),
+                    transition("G1", "E0",   15),
+                    transition("G1", "E1",   5),
+                    transition("G1", "E2",   10),
+                    transition("G2", "E1",   10),
+                    transition("G2", "E2",   20),
+                    transition("H-1", "E-2", 30),
+                    transition("H-1", "E-1", 15),
+                    transition("H-1", "E0",  5),
+                    transition("H0", "E-1",  15),
+                    transition("H0", "E0",   20),
+                    transition("H0", "E1",   15),
+                    transition("H1", "E0",    5),
+                    transition("H1", "E1",   15),
+                    transition("H1", "E2",   30),
+                    ],
+                frequencies={
+                    group("H->E"): 384.2304844685e12 - 72.9113e6 + 4.27167663181519e9,
+                    group("G->E"): 384.2304844685e12 - 72.9113e6 - 2.56300597908911e9,
+                    },
+                gamma=6.0666e6
+                )
+
+        return trans
+
+    def test_matrix_matches_elements(self):
+        from rate_equation.detuning import ZeemanDetuning
+
+        trans = self._create_87Rb_f2_f1_to_e2()
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=trans.frequencies[group("G->E")] + 3e6, delta_m=0, normalized_intensity=0.2),
+            RadiationField(frequency=trans.frequencies[group("G->E")] - 2e6, delta_m=+1, normalized_intensity=0.3),
+            RadiationField(frequency=trans.frequencies[group("H->E")], delta_m=-1, normalized_intensity=0.1),
+            ])
+        detunings = [ZeemanDetuning(g_factors={"G": 1/2, "H": -1/2, "E": 2/3}, b_field=1e-4)]
+
+        rate_eqn = RateEquation(trans, fields, detunings)
+        mat = rate_eqn.build_matrix()
+
+        gs = trans.ground_states
+        elements = np.array([[rate_eqn.calculate_matrix_element(g1, g2) for g2 in gs] for g1 in gs])
+
+        assert np.allclose(mat, elements, rtol=1e-12, atol=0)
+        assert np.allclose(mat.sum(axis=0), 0, atol=1e-6)
+
+    def test_scattering_rates_match_scalar(self):
+        from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+
+        trans = self._create_87Rb_f2_f1_to_e2()
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=trans.frequencies[group("G->E")] + 3e6, delta_m=0, normalized_intensity=0.2),
+            RadiationField(frequency=trans.frequencies[group("H->E")], delta_m=-1, normalized_intensity=0.1),
+            ])
+        detunings = [ZeemanDetuning(g_factors={"G": 1/2, "H": -1/2, "E": 2/3}, b_field=1e-4),
+                     DopplerDetuning(velocity=2.)]
+
+        rates = fields.get_effective_scattering_rate_array(trans, detunings)
+
+        for t, rate in zip(trans.transitions, rates):
+            assert np.isclose(rate, fields.get_effective_scattering_rate(
+                t, trans.frequencies[t.group], detunings, trans.gamma), rtol=1e-12, atol=0)
+
+        # per-transition (Zeeman) and common (Doppler) shifts on a subset of transitions
+        subset = np.array([1, 4, 15])
+        assert np.allclose(fields.get_effective_scattering_rate_array(trans, detunings, transitions=subset),
+                           rates[subset], rtol=1e-12, atol=0)
+
+    def test_scattering_rates_match_scalar_counter_propagating(self):
+        from rate_equation.detuning import DopplerDetuning
+
+        trans = create_87Rb_trans()
+        freq = trans.frequencies[group("G->E")]
+        detunings = [DopplerDetuning(velocity=3.)]
+
+        for direction in [+1, -1]:
+            fields = RadiationFieldProfile([
+                RadiationField(frequency=freq - 4e6, delta_m=+1, normalized_intensity=0.2, direction=direction),
+                ])
+            rates = fields.get_effective_scattering_rate_array(trans, detunings)
+
+            for t, rate in zip(trans.transitions, rates):
+                assert np.isclose(rate, fields.get_effective_scattering_rate(t, freq, detunings, trans.gamma),
+                                  rtol=1e-12, atol=0)
+
+        # the Doppler shift of 3 m/s (~4 MHz) tunes the red-detuned field into
+        # resonance if it is counter-propagating, and away from it otherwise
+        co, counter = (RadiationFieldProfile([RadiationField(freq - 4e6, +1, 0.2, direction)])
+                       .get_effective_scattering_rate(trans.transitions[-1], freq, detunings, trans.gamma)
+                       for direction in [+1, -1])
+        assert counter > 2 * co
+
+    def test_sweep(self):
+        from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+
+        trans = self._create_87Rb_f2_f1_to_e2()
+        freq = trans.frequencies[group("G->E")]
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq, delta_m=+1, normalized_intensity=0.2),
+            RadiationField(frequency=trans.frequencies[group("H->E")], delta_m=0, normalized_intensity=0.1),
+            ])
+        g_factors = {"G": 1/2, "H": -1/2, "E": 2/3}
+        rate_eqn = RateEquation(trans, fields, [ZeemanDetuning(g_factors, 0)])
+
+        dets = np.linspace(-5, 5, 7) * trans.gamma
+        b_fields = np.linspace(-1e-3, 1e-3, 7)
+        velocities = np.linspace(-3, 3, 7)
+        intensities = np.linspace(0.1, 1, 7)
+
+        mats = rate_eqn.sweep(field_frequency=np.stack([freq + dets, np.full(7, fields.fields[1].frequency)], axis=-1),
+                              normalized_intensity=intensities,
+                              b_field=b_fields,
+                              velocity=velocities)
+
+        assert mats.shape == (7, 8, 8)
+
+        for i in range(7):
+            point_fields = RadiationFieldProfile([
+                fields.fields[0]._replace(frequency=freq + dets[i], normalized_intensity=intensities[i]),
+                fields.fields[1]._replace(normalized_intensity=intensities[i]),
+                ])
+            point_eqn = RateEquation(trans, point_fields,
+                                     [ZeemanDetuning(g_factors, b_fields[i]), DopplerDetuning(velocities[i])])
+
+            assert np.allclose(mats[i], point_eqn.build_matrix(), rtol=1e-12, atol=1e-9)
+
+        assert np.allclose(rate_eqn.sweep(b_field=[0.])[0], rate_eqn.build_matrix())
+
+    def test_force(self):
+        from scipy.constants import h, c
+        from rate_equation.detuning import DopplerDetuning
+
+        trans = create_87Rb_trans()
+        freq = trans.frequencies[group("G->E")]
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq - 6e6, delta_m=+1, normalized_intensity=0.2),
+            RadiationField(frequency=freq - 3e6, delta_m=0, normalized_intensity=0.1),
+            ])
+        rate_eqn = RateEquation(trans, fields, [DopplerDetuning(velocity=2.)])
+        popu = rate_eqn.calculate_static_state_population()
+
+        force = 0
+        for t in trans.transitions:
+            rate = fields.get_effective_scattering_rate(t, freq, rate_eqn.detunings, trans.gamma)
+            force += popu[trans.ground_index[t.ground_state]] * h * freq / c * rate
+
+        assert np.isclose(rate_eqn.calculate_force(popu), force)
+
+        forces, scattering = rate_eqn.calculate_force_array(velocity=[2.])
+
+        assert np.isclose(forces[0], force)
+        assert np.isclose(scattering[0], force / (h * freq / c))
+
+    def test_force_counter_propagating(self):
+        from rate_equation.detuning import DopplerDetuning
+
+        trans = create_87Rb_trans()
+        freq = trans.frequencies[group("G->E")]
+
+        # 1D sigma+ / sigma- molasses, red detuned
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq - 6e6, delta_m=+1, normalized_intensity=0.2, direction=+1),
+            RadiationField(frequency=freq - 6e6, delta_m=-1, normalized_intensity=0.2, direction=-1),
+            ])
+        rate_eqn = RateEquation(trans, fields, [])
+
+        velocities = np.linspace(-5, 5, 11)
+        forces, scattering = rate_eqn.calculate_force_array(velocity=velocities)
+
+        assert forces.shape == scattering.shape == (11,)
+        assert np.allclose(forces, -forces[::-1], atol=1e-30)
+        assert np.allclose(scattering, scattering[::-1])
+        assert np.isclose(forces[5], 0, atol=1e-30)
+        # friction: force opposes the motion
+        assert np.all(forces[:5] > 0) and np.all(forces[6:] < 0)
+
+        for v, f in zip(velocities, forces):
+            point_eqn = RateEquation(trans, fields, [DopplerDetuning(v)])
+            popu = point_eqn.calculate_static_state_population()
+
+            assert np.isclose(point_eqn.calculate_force(popu), f, rtol=1e-9, atol=1e-30)
+
+    def test_incremental_update(self):
+        from rate_equation.detuning import ZeemanDetuning
+
+        trans = self._create_87Rb_f2_f1_to_e2()
+        freq_g = trans.frequencies[group("G->E")]
+        freq_h = trans.frequencies[group("H->E")]
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq_g + 3e6, delta_m=0, normalized_intensity=0.2),
+            RadiationField(frequency=freq_g - 2e6, delta_m=+1, normalized_intensity=0.3),
+            RadiationField(frequency=freq_h, delta_m=-1, normalized_intensity=0.1),
+            ])
+        g_factors = {"G": 1/2, "H": -1/2, "E": 2/3}
+
+        for sparse in [False, True]:
+            rate_eqn = RateEquation(trans, fields, [ZeemanDetuning(g_factors, 1e-4)], sparse=sparse)
+
+            def check(field_list, b_field):
+                fresh = RateEquation(trans, RadiationFieldProfile(field_list), [ZeemanDetuning(g_factors, b_field)])
+                mat = rate_eqn.build_matrix()
+                mat = mat.toarray() if sparse else mat
+
+                assert np.allclose(mat, fresh.build_matrix(), rtol=1e-12, atol=1e-9)
+                assert np.allclose(rate_eqn.scattering_rates, fresh.scattering_rates)
+                assert rate_eqn.pump_terms == fresh.pump_terms
+
+            check(fields.fields, 1e-4)
+
+            rate_eqn.set_field(1, frequency=freq_g + 1e6)
+            expected = [fields.fields[0], fields.fields[1]._replace(frequency=freq_g + 1e6), fields.fields[2]]
+            check(expected, 1e-4)
+
+            # several changes before the next build, including a polarization change
+            rate_eqn.set_field(0, normalized_intensity=0.5)
+            rate_eqn.set_field(2, delta_m=0)
+            expected[0] = expected[0]._replace(normalized_intensity=0.5)
+            expected[2] = expected[2]._replace(delta_m=0)
+            check(expected, 1e-4)
+
+            rate_eqn.set_detuning(0, b_field=-3e-4)
+            check(expected, -3e-4)
+
+            with pytest.raises(ValueError):
+                rate_eqn.set_detuning(0, ZeemanDetuning(g_factors, 2e-4), b_field=-3e-4)
+            check(expected, -3e-4)
+
+        # the original radiation field profile is left untouched
+        assert fields.fields[1].frequency == freq_g - 2e6
+
+    def test_gradient(self):
+        from rate_equation.detuning import ZeemanDetuning, DopplerDetuning
+        from rate_equation.solver import steady_state
+
+        trans = self._create_87Rb_f2_f1_to_e2()
+        freq_g = trans.frequencies[group("G->E")]
+        freq_h = trans.frequencies[group("H->E")]
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq_g + 3e6, delta_m=0, normalized_intensity=0.2),
+            RadiationField(frequency=freq_g - 2e6, delta_m=+1, normalized_intensity=0.3, direction=-1),
+            RadiationField(frequency=freq_h, delta_m=-1, normalized_intensity=0.1),
+            ])
+        detunings = [ZeemanDetuning({"G": 1/2, "H": -1/2, "E": 2/3}, 1e-4), DopplerDetuning(0.5)]
+
+        # two parameter points
+        params = {
+            "field_frequency": np.array([[f.frequency for f in fields.fields]] * 2) + [[0, 1e6, 0], [2e6, 0, -1e6]],
+            "normalized_intensity": np.array([[0.2, 0.3, 0.1], [0.4, 0.1, 0.2]]),
+            "b_field": np.array([1e-4, -2e-4]),
+            "velocity": np.array([0.5, -1.]),
+            }
+        steps = {"field_frequency": 1e3, "normalized_intensity": 1e-5, "b_field": 1e-8, "velocity": 1e-4}
+
+        for sparse in [False, True]:
+            rate_eqn = RateEquation(trans, fields, detunings, sparse=sparse)
+            grad = rate_eqn.gradient(wrt=("frequency", "normalized_intensity", "b_field", "velocity"), **params)
+
+            assert len(grad.parameters) == 8
+            assert grad.d_populations.shape == (2, 8, 8)
+            assert grad.d_force.shape == grad.d_scattering.shape == (2, 8)
+            assert np.all(np.abs(grad.d_populations.sum(axis=-1)) <= 1e-9 * np.abs(grad.d_populations).max(axis=-1))
+
+            force, scattering = rate_eqn.calculate_force_array(**params)
+            assert np.allclose(grad.force, force) and np.allclose(grad.scattering, scattering)
+
+            for i, (name, field) in enumerate(grad.parameters):
+                key = "field_frequency" if name == "frequency" else name
+                results = []
+                for sign in [+1, -1]:
+                    shifted = dict(params)
+                    shifted[key] = params[key].copy()
+                    if field is None:
+                        shifted[key] += sign * steps[key]
+                    else:
+                        shifted[key][:, field] += sign * steps[key]
+
+                    mats = rate_eqn.sweep(**shifted)
+                    results.append((steady_state(mats),) + rate_eqn.calculate_force_array(**shifted))
+
+                diff = [(plus - minus) / (2 * steps[key]) for plus, minus in zip(*results)]
+
+                assert np.allclose(grad.d_populations[:, i], diff[0], rtol=1e-4, atol=1e-6 * np.abs(diff[0]).max())
+                assert np.allclose(grad.d_force[:, i], diff[1], rtol=1e-4, atol=1e-6 * np.abs(diff[1]).max())
+                assert np.allclose(grad.d_scattering[:, i], diff[2], rtol=1e-4, atol=1e-6 * np.abs(diff[2]).max())
+
+        # without sweep parameters: the point of the rate equation itself
+        grad = RateEquation(trans, fields, detunings).gradient()
+        assert grad.d_force.shape == (1, 6)
+        assert np.allclose(grad.populations[0], RateEquation(trans, fields, detunings).calculate_static_state_population())
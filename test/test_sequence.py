@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.linalg import expm
+
+from rate_equation.rate_equation import RateEquation
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.sequence import PulseSequence, Segment
+
+from test.profiles import create_87Rb_trans
+
+
+class TestSequence:
+    def _create_sequence(self, cache=None):
+        trans = create_87Rb_trans()
+        freq = 384.2304844685e12
+        det = [ZeemanDetuning(g_factors={"G": 1/2, "E": 2/3}, b_field=1e-4)]
+
+        pump = RadiationFieldProfile([RadiationField(frequency=freq, delta_m=+1, normalized_intensity=0.05)])
+        probe = RadiationFieldProfile([RadiationField(frequency=freq + 2e6, delta_m=-1, normalized_intensity=0.01)])
+
+        return PulseSequence(trans, [
+            (2e-6, pump, det),
+            Segment(5e-6, None, det),
+            (1e-6, probe, det),
+            (5e-6, None, det),
+            ], cache=cache)
+
+    def test_propagator(self):
+        seq = self._create_sequence()
+        trans = seq.trans_profile
+
+        expected = np.eye(5)
+        for seg in seq.segments:
+            mat = np.zeros((5, 5)) if seg.radiation is None else \
+                    RateEquation(trans, seg.radiation, seg.detunings).build_matrix()
+            expected = expm(mat * seg.duration) @ expected
+
+        assert np.allclose(seq.propagator(), expected)
+        assert np.isclose(seq.duration, 13e-6)
+
+        p0 = np.ones(5) / 5
+        p = p0
+        for _ in range(7):
+            p = expected @ p
+
+        assert np.allclose(seq.run(p0, repetitions=7), p)
+
+    def test_cache(self):
+        cache = {}
+        seq = self._create_sequence(cache)
+        seq.propagator()
+
+        # the two identical dark segments share their propagator
+        assert len([k for k in cache if k[0] == "propagator"]) == 3
+
+        # sequences of the same profile sharing the cache reuse propagators
+        again = PulseSequence(seq.trans_profile,
+                              [seq.segments[1]._replace(radiation=RadiationFieldProfile([]))] + seq.segments,
+                              cache=cache)
+        again.propagator()
+
+        assert len([k for k in cache if k[0] == "propagator"]) == 3
+
+    def test_evolve_and_stroboscopic_state(self):
+        seq = self._create_sequence()
+        p0 = np.ones(5) / 5
+
+        times, popu = seq.evolve(p0, samples_per_segment=10)
+
+        assert times.shape == (40,)
+        assert popu.shape == (40, 5)
+        assert np.allclose(popu[-1], seq.run(p0))
+        assert np.allclose(popu.sum(axis=-1), 1)
+
+        p_inf = seq.stroboscopic_steady_state()
+
+        assert np.allclose(seq.run(p_inf), p_inf)
+        assert np.allclose(seq.run(p0, repetitions=10000), p_inf, atol=1e-6)
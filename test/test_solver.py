@@ -0,0 +1,199 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.linalg import null_space
+
+from rate_equation.transition_profile import TransitionProfile, state, transition, group
+from rate_equation.rate_equation import RateEquation
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.solver import steady_state, evolve, count_closed_classes, DegenerateSteadyStateError
+
+from test.profiles import create_87Rb_trans
+
+
+class TestSolver:
+    def _create_87Rb_f1_to_e0(self):
+        # 87Rb D2-line, Fg=1 -> Fe=0
+        return TransitionProfile(
+                ground_states=[state(s) for s in ["G1", "G0", "G-1"]],
+                excited_states=[state("E0")],
+                transitions=[
+                    transition("G1", "E0", 20),
+                    transition("G0", "E0", 20),
+                    transition("G-1", "E0", 20),
+                    ],
+                frequencies={
+                    group("G->E"): 384.2304844685e12
+                    },
+                gamma=6.0666e6
+                )
+
+    def _create_rate_eqn(self):
+        trans = create_87Rb_trans()
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=384.2304844685e12, delta_m=+1, normalized_intensity=0.2 * 0.95),
+            RadiationField(frequency=384.2304844685e12, delta_m=0, normalized_intensity=0.2 * 0.025),
+            RadiationField(frequency=384.2304844685e12, delta_m=-1, normalized_intensity=0.2 * 0.025),
+            ])
+
+        return RateEquation(trans, fields, [ZeemanDetuning(g_factors={"G": 1/2, "E": 2/3}, b_field=-0.002)])
+
+    def test_matches_null_space(self):
+        rate_eqn = self._create_rate_eqn()
+        mat = rate_eqn.build_matrix()
+
+        equlb = null_space(mat).flatten()
+        equlb = equlb / np.sum(equlb)
+
+        assert np.allclose(rate_eqn.calculate_static_state_population(), equlb)
+
+    def test_batched(self):
+        rate_eqn = self._create_rate_eqn()
+        mats = rate_eqn.sweep(b_field=np.linspace(-0.002, 0.002, 9))
+
+        popu = steady_state(mats)
+
+        assert popu.shape == (9, 5)
+        assert np.allclose(popu.sum(axis=-1), 1)
+        assert np.allclose(np.einsum("pij,pj->pi", mats, popu), 0, atol=1e-6)
+
+        for mat, p in zip(mats, popu):
+            assert np.allclose(p, steady_state(mat))
+
+    def test_degenerate(self):
+        # pi light only: G1 and G-1 are both dark
+        trans = self._create_87Rb_f1_to_e0()
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=384.2304844685e12, delta_m=0, normalized_intensity=0.1)
+            ])
+        mat = RateEquation(trans, fields, []).build_matrix()
+
+        assert count_closed_classes(mat) == 2
+
+        with pytest.raises(DegenerateSteadyStateError):
+            steady_state(mat)
+
+        # sigma+ and sigma- light: G0 is the only dark state
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=384.2304844685e12, delta_m=+1, normalized_intensity=0.1),
+            RadiationField(frequency=384.2304844685e12, delta_m=-1, normalized_intensity=0.1),
+            ])
+        mat_unique = RateEquation(trans, fields, []).build_matrix()
+
+        popu = steady_state(np.stack([mat, mat_unique]), on_degenerate="nan")
+
+        assert np.all(np.isnan(popu[0]))
+        assert np.allclose(popu[1], [0, 1, 0])
+
+    def test_closed_classes(self):
+        # random transfer graphs with transient states: the number of closed
+        # classes equals the dimension of the null space
+        rng = np.random.default_rng(0)
+        mats = []
+        for _ in range(20):
+            transfer = rng.random((8, 8)) * (rng.random((8, 8)) < 0.15)
+            np.fill_diagonal(transfer, 0)
+            mats.append(transfer - np.diag(transfer.sum(axis=0)))
+
+        counts = count_closed_classes(np.stack(mats))
+
+        assert counts.shape == (20,)
+        assert np.array_equal(counts, [null_space(mat).shape[1] for mat in mats])
+        assert np.array_equal(count_closed_classes([sparse.csr_matrix(mat) for mat in mats]), counts)
+        assert count_closed_classes(np.stack(mats).reshape((4, 5, 8, 8))).shape == (4, 5)
+
+    def test_evolve(self):
+        from scipy.integrate import solve_ivp
+
+        rate_eqn = self._create_rate_eqn()
+        mat = rate_eqn.build_matrix()
+        t_eval = np.linspace(0, 100e-6, 50)
+        p0 = np.ones(5) / 5
+
+        sol = solve_ivp(lambda t, y: mat @ y, [0, 100e-6], p0, t_eval=t_eval,
+                        method="LSODA", rtol=1e-10, atol=1e-12)
+        popu = rate_eqn.evolve(p0, t_eval)
+
+        assert popu.shape == (50, 5)
+        assert np.allclose(popu, sol.y.T, atol=1e-7)
+        assert np.allclose(rate_eqn.evolve(p0, [10e-3])[-1], rate_eqn.calculate_static_state_population())
+
+    def test_evolve_batched(self):
+        from scipy.linalg import expm
+
+        rate_eqn = self._create_rate_eqn()
+        mats = rate_eqn.sweep(b_field=np.linspace(-0.002, 0.002, 4))
+        t_eval = [0, 1e-6, 5e-6, 30e-6]
+        p0 = np.ones(5) / 5
+
+        popu = rate_eqn.evolve(p0, t_eval, mats=mats)
+
+        assert popu.shape == (4, 4, 5)
+
+        for mat, p in zip(mats, popu):
+            for t, p_t in zip(t_eval, p):
+                assert np.allclose(p_t, expm(mat * t) @ p0)
+
+    def test_evolve_defective(self):
+        from scipy.linalg import expm
+
+        # chain 0 -> 1 -> 2 with equal rates is not diagonalizable
+        mat = np.array([[-1,  0, 0],
+                        [ 1, -1, 0],
+                        [ 0,  1, 0]]) * 1e6
+        p0 = np.array([1, 0, 0])
+
+        for t_eval in [np.linspace(0, 5e-6, 6), np.array([0, 1e-7, 3e-6])]:
+            popu = evolve(np.stack([mat, mat]), p0, t_eval)
+
+            for p in popu:
+                for t, p_t in zip(t_eval, p):
+                    assert np.allclose(p_t, expm(mat * t) @ p0)
+
+    def test_sparse_backend(self):
+        dense = self._create_rate_eqn()
+        rate_eqn = RateEquation(dense.trans_profile, dense.radiation, dense.detunings, sparse=True)
+
+        mat = rate_eqn.build_matrix()
+
+        assert sparse.issparse(mat)
+        assert np.allclose(mat.toarray(), dense.build_matrix())
+        assert np.allclose(rate_eqn.calculate_static_state_population(),
+                           dense.calculate_static_state_population())
+
+        p0 = np.ones(5) / 5
+        for t_eval in [np.linspace(0, 30e-6, 7), [0, 1e-6, 10e-6]]:
+            assert np.allclose(rate_eqn.evolve(p0, t_eval), dense.evolve(p0, t_eval))
+
+        b_fields = np.linspace(-0.002, 0.002, 3)
+        mats = rate_eqn.sweep(b_field=b_fields)
+
+        assert len(mats) == 3
+        assert np.allclose(steady_state(mats), steady_state(dense.sweep(b_field=b_fields)))
+        assert np.allclose(rate_eqn.evolve(p0, [1e-6], mats=mats), dense.evolve(p0, [1e-6], mats=dense.sweep(b_field=b_fields)))
+
+    def test_sparse_degenerate(self):
+        trans = self._create_87Rb_f1_to_e0()
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=384.2304844685e12, delta_m=0, normalized_intensity=0.1)
+            ])
+        mat = RateEquation(trans, fields, [], sparse=True).build_matrix()
+
+        assert count_closed_classes(mat) == 2
+
+        with pytest.raises(DegenerateSteadyStateError):
+            steady_state(mat)
+
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=384.2304844685e12, delta_m=+1, normalized_intensity=0.1),
+            RadiationField(frequency=384.2304844685e12, delta_m=-1, normalized_intensity=0.1),
+            ])
+        mat_unique = RateEquation(trans, fields, [], sparse=True).build_matrix()
+
+        assert np.array_equal(count_closed_classes([mat, mat_unique]), [2, 1])
+
+        popu = steady_state([mat, mat_unique], on_degenerate="nan")
+
+        assert np.all(np.isnan(popu[0]))
+        assert np.allclose(popu[1], [0, 1, 0])
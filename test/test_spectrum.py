@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from rate_equation.atomic_data import build_profile, g_factors
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.rate_equation import RateEquation
+from rate_equation.spectrum import spectrum, line_centers
+
+
+class TestSpectrum:
+    def _group_frequency(self, trans, ground, excited):
+        return [f for grp, f in trans.frequencies.items() if grp == (ground, excited)][0]
+
+    def _create_rate_eqn(self, b_field=2e-4):
+        # repump on G1 -> E2, sigma+ probe around G2 -> E3
+        line = "87Rb D2"
+        trans = build_profile(line)
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=self._group_frequency(trans, "G1", "E2"), delta_m=0, normalized_intensity=1),
+            RadiationField(frequency=self._group_frequency(trans, "G2", "E3"), delta_m=+1, normalized_intensity=0.05),
+            ])
+
+        return RateEquation(trans, fields, [ZeemanDetuning(g_factors(line, [2, 1], [3, 2, 1, 0]), b_field)])
+
+    def test_line_centers(self):
+        rate_eqn = self._create_rate_eqn()
+        tp = rate_eqn.trans_profile
+        coefficients = rate_eqn.detunings[0].get_transition_coefficients(tp)
+
+        expected = {freq + coeff * 2e-4
+                    for t, freq, coeff in zip(tp.transitions, tp.trans_frequency, coefficients) if t.delta_m == +1}
+        assert np.allclose(line_centers(rate_eqn, 1), sorted(expected))
+
+        # without field, the lines of each group coincide
+        assert len(line_centers(self._create_rate_eqn(0), 1)) == len(tp.groups)
+
+    def test_adaptive(self):
+        rate_eqn = self._create_rate_eqn()
+        tp = rate_eqn.trans_profile
+        center = self._group_frequency(tp, "G2", "E3")
+        frequency_range = (center - 500e6, center + 100e6)
+
+        spec = spectrum(rate_eqn, 1, frequency_range, tol=1e-3)
+        assert np.all(np.diff(spec.frequencies) > 0)
+        assert spec.frequencies[0] == frequency_range[0] and spec.frequencies[-1] == frequency_range[1]
+        assert np.allclose(spec.populations.sum(axis=-1), 1)
+        assert np.all(spec.absorption <= spec.scattering)
+
+        # reference: steady states on a fine uniform grid
+        dense = np.linspace(*frequency_range, 6001)
+        field_freqs = np.array([[f.frequency for f in rate_eqn.radiation.fields]] * len(dense))
+        field_freqs[:, 1] = dense
+        _, scattering = rate_eqn.calculate_force_array(field_frequency=field_freqs)
+
+        assert len(spec.frequencies) < len(dense) / 10
+        assert np.allclose(np.interp(dense, spec.frequencies, spec.scattering), scattering,
+                           atol=2e-3 * scattering.max(), rtol=0)
+
+        # the probe absorption peaks at a (Zeeman-shifted) line center
+        peak = spec.frequencies[np.argmax(spec.absorption)]
+        assert np.min(np.abs(line_centers(rate_eqn, 1) - peak)) < tp.gamma / 10
+
+        # points are concentrated around the resonances
+        near = np.min(np.abs(spec.frequencies[:, np.newaxis] - line_centers(rate_eqn, 1)), axis=-1) < 3 * tp.gamma
+        assert np.mean(near) > 0.5
+
+    def test_max_points(self):
+        rate_eqn = self._create_rate_eqn()
+        spec = spectrum(rate_eqn, 1, tol=1e-6, max_points=200)
+
+        assert len(spec.frequencies) == 200
+        assert np.all(np.diff(spec.frequencies) > 0)
+
+        # the budget cannot hold the initial grid and its line center seeds
+        with pytest.raises(AssertionError, match="max_points"):
+            spectrum(rate_eqn, 1, max_points=20)
+
+    def test_undriven_probe(self):
+        rate_eqn = self._create_rate_eqn()
+        probe = rate_eqn.radiation.fields[1]._replace(delta_m=+2)
+        rate_eqn = RateEquation(rate_eqn.trans_profile, RadiationFieldProfile([rate_eqn.radiation.fields[0], probe]),
+                                rate_eqn.detunings)
+
+        assert len(line_centers(rate_eqn, 1)) == 0
+        with pytest.raises(AssertionError, match="frequency_range"):
+            spectrum(rate_eqn, 1)
+
+        center = probe.frequency
+        spec = spectrum(rate_eqn, 1, (center - 50e6, center + 50e6), num_of_points=9)
+        assert np.allclose(spec.absorption, 0)
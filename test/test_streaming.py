@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from rate_equation.atomic_data import build_profile
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.rate_equation import RateEquation
+from rate_equation.solver import steady_state
+from rate_equation.streaming import ChunkedArrayWriter, ChunkedArray, write_sweep
+
+
+class TestStreaming:
+    def _create_rate_eqn(self):
+        trans = build_profile("87Rb D2", [2, 1], [2])
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=trans.frequencies[trans.groups[0]], delta_m=+1, normalized_intensity=0.2),
+            RadiationField(frequency=trans.frequencies[trans.groups[1]], delta_m=0, normalized_intensity=0.2),
+            ])
+
+        return RateEquation(trans, fields, [ZeemanDetuning({"G2": 1/2, "G1": -1/2, "E2": 2/3}, 1e-4)])
+
+    def test_chunked_array(self, tmp_path):
+        data = np.arange(23 * 3 * 2, dtype=float).reshape((23, 3, 2))
+
+        with ChunkedArrayWriter(str(tmp_path / "arr"), (3, 2), chunk_len=5, attrs={"unit": "s"},
+                                arrays={"x": np.arange(3)}) as writer:
+            for block in np.split(data, [4, 11, 12, 20]):
+                writer.append(block)
+
+        arr = ChunkedArray(str(tmp_path / "arr"))
+        assert arr.shape == data.shape and len(arr) == 23
+        assert arr.attrs == {"unit": "s"}
+        assert np.array_equal(arr.arrays["x"], np.arange(3))
+        assert len(list((tmp_path / "arr").glob("[0-9]*.npz"))) == 5
+
+        assert np.array_equal(arr[:], data)
+        assert np.array_equal(arr[7], data[7])
+        assert np.array_equal(arr[3:18:4, 1], data[3:18:4, 1])
+        assert np.array_equal(arr[[22, 0, 9], ..., 1], data[[22, 0, 9], ..., 1])
+        assert np.array_equal(np.asarray(arr), data)
+        assert np.array_equal(np.concatenate([rows for _, rows in arr.iter_chunks()]), data)
+
+        with pytest.raises(AssertionError):
+            ChunkedArrayWriter(str(tmp_path / "arr"), (3, 2))
+
+    def test_iter_sweep(self):
+        rate_eqn = self._create_rate_eqn()
+        freq = rate_eqn.radiation.fields[0].frequency
+        axes = {"field_frequency": freq + np.linspace(-5, 5, 7) * 6e6, "b_field": [0., 1e-4, 2e-4]}
+
+        chunks = list(rate_eqn.iter_sweep(axes, chunk_size=4))
+        assert [start for start, _ in chunks] == [0, 4, 8, 12, 16, 20]
+
+        grid = np.meshgrid(*axes.values(), indexing="ij")
+        expected = steady_state(rate_eqn.sweep(field_frequency=grid[0].ravel(), b_field=grid[1].ravel()))
+        assert np.allclose(np.concatenate([popu for _, popu in chunks]), expected)
+
+        # rejected when called, before any chunk is computed
+        with pytest.raises(AssertionError, match="Unknown sweep axis frequency"):
+            rate_eqn.iter_sweep({"frequency": axes["field_frequency"]})
+
+    def test_write_sweep(self, tmp_path):
+        rate_eqn = self._create_rate_eqn()
+        freq = rate_eqn.radiation.fields[0].frequency
+        axes = {"field_frequency": freq + np.linspace(-5, 5, 5) * 6e6, "velocity": [-1., 1.]}
+        t_eval = np.linspace(0, 20e-6, 6)
+
+        arr = write_sweep(rate_eqn, axes, str(tmp_path / "sweep"), chunk_size=3, t_eval=t_eval, chunk_len=4)
+        assert arr.shape == (10, 6, 8)
+        assert arr.attrs["grid_shape"] == [5, 2]
+        assert arr.attrs["ground_states"][0] == ["G2", 2]
+        assert np.array_equal(arr.arrays["axis_velocity"], [-1., 1.])
+        assert np.array_equal(arr.arrays["t_eval"], t_eval)
+
+        row = np.ravel_multi_index((3, 1), arr.attrs["grid_shape"])
+        mat = rate_eqn.sweep(field_frequency=axes["field_frequency"][[3]], velocity=[1.])
+        expected = rate_eqn.evolve(np.full(8, 1 / 8), t_eval, mats=mat)[0]
+        assert np.allclose(arr[row], expected)
@@ -0,0 +1,64 @@
+import functools
+import numpy as np
+
+from rate_equation.transition_profile import group
+from rate_equation.rate_equation import RateEquation
+from rate_equation.radiation_field import RadiationFieldProfile, RadiationField
+from rate_equation.detuning import ZeemanDetuning
+from rate_equation.trajectory import TrajectorySimulator
+
+from test.profiles import create_87Rb_trans
+
+
+class TestTrajectory:
+    mass = 1.443e-25  # 87Rb, kg
+
+    def _create_simulator(self):
+        trans = create_87Rb_trans()
+        freq = trans.frequencies[group("G->E")]
+
+        # slowing beam against the atomic motion, with a field gradient
+        fields = RadiationFieldProfile([
+            RadiationField(frequency=freq - 20e6, delta_m=-1, normalized_intensity=1, direction=-1),
+            ])
+        rate_eqn = RateEquation(trans, fields, [ZeemanDetuning(g_factors={"G": 1/2, "E": 2/3}, b_field=0)])
+        b_field_profile = functools.partial(np.interp, xp=[0, 0.1], fp=[1e-3, 0])
+
+        return TrajectorySimulator(rate_eqn, self.mass, b_field_profile)
+
+    def test_mean_force_step(self):
+        sim = self._create_simulator()
+        positions = np.array([[0.], [0.02], [0.05]])
+        velocities = np.array([[5.], [10.], [15.]])
+        dt = 1e-7
+
+        result = sim.run(positions, velocities, dt, n_steps=1)
+
+        p0 = np.full(5, 1 / 5)
+        force, _ = sim.rate_eqn.calculate_force_array(p0, b_field=sim.b_field_profile(positions[:, 0]),
+                                                      velocity=velocities[:, 0])
+
+        assert result.positions.shape == (2, 3, 1)
+        assert result.populations.shape == (2, 3, 5)
+        assert np.allclose(result.velocities[-1, :, 0], velocities[:, 0] + force / self.mass * dt)
+        assert np.all(result.velocities[-1] < velocities)
+        assert np.allclose(result.populations[-1].sum(axis=-1), 1)
+
+    def test_deterministic_heating(self):
+        sim = self._create_simulator()
+        rng = np.random.default_rng(0)
+        positions = np.zeros((2500, 3))
+        velocities = rng.normal(size=(2500, 3)) + [0, 0, 10]
+
+        kwargs = dict(dt=1e-7, n_steps=20, save_every=10, heating=True, seed=1234)
+
+        serial = sim.run(positions, velocities, n_workers=1, **kwargs)
+        parallel = sim.run(positions, velocities, n_workers=2, **kwargs)
+
+        assert np.allclose(serial.times, [0, 1e-6, 2e-6])
+        assert serial.velocities.shape == (3, 2500, 3)
+        assert np.array_equal(serial.velocities, parallel.velocities)
+        assert np.array_equal(serial.populations, parallel.populations)
+
+        # recoil kicks spread the transverse velocities
+        assert not np.allclose(serial.velocities[-1, :, 0], velocities[:, 0])
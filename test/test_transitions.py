@@ -1,38 +1,12 @@
+import numpy as np
+import pytest
+
 from rate_equation.transition_profile import (Transition, TransitionProfile, State,
                                               state, transition, group)
 
-class TestTransitions:
-    def _create_87Rb_trans(self):
-        # 87Rb D2-line, Fg=2 -> Fe=3
-        trans = TransitionProfile(
-                ground_states=[state(s) for s in ["G2", "G1", "G0", "G-1", "G-2"]],
-                excited_states=[state(s) for s in ["E3", "E2", "E1", "E0", "E-1", "E-2", "E-3"]],
-                transitions=[
-                    # Metcalf, Appendix D
-                    transition("G-2", "E-3", 60),
-                    transition("G-2", "E-2", 20),
-                    transition("G-2", "E-1", 4),
-                    transition("G-1", "E-2", 40),
-                    transition("G-1", "E-1", 32),
-                    transition("G-1", "E0",  12),
-                    transition("G0", "E-1",  24),
-                    transition("G0", "E0",   36),
-                    transition("G0", "E1",   24),
-                    transition("G1", "E0",   12),
-                    transition("G1", "E1",   32),
-                    transition("G1", "E2",   40),
-                    transition("G2", "E1",   4),
-                    transition("G2", "E2",   20),
-                    transition("G2", "E3",   60),
-                    ],
-                frequencies={
-                    group("G->E"): 384.2304844685e12
-                    },
-                gamma=6.0666e6
-                )
-
-        return trans
+from test.profiles import create_87Rb_trans
 
+class TestTransitions:
     def _has_transition(self, trans_list, gs, es):
         return any(filter(lambda t: t.ground_state == gs and t.excited_state == es, trans_list))
 
@@ -53,9 +27,9 @@ class TestTransitions:
 
 
     def test_exc_to_gnd_trans_map(self):
-        trans_map = self._create_87Rb_trans()
+        trans_map = create_87Rb_trans()
 
-        e_to_g = trans_map._exc_to_gnd_trans
+        e_to_g = {es: trans_map.get_exc_to_gnd(es) for es in trans_map.excited_states}
 
         assert len(e_to_g[state("E2")]) == 2
         assert len(e_to_g[state("E-2")]) == 2
@@ -68,9 +42,9 @@ class TestTransitions:
         assert self._has_transition(e_to_g[state("E0")], state("G1"), state("E0"))
 
     def test_gnd_to_trans_map(self):
-        trans_map = self._create_87Rb_trans()
+        trans_map = create_87Rb_trans()
 
-        g_to_e = trans_map._gnd_to_exc_trans
+        g_to_e = {gs: trans_map.get_gnd_to_exc(gs) for gs in trans_map.ground_states}
 
         assert len(g_to_e[state("G0")]) == 3
         assert self._has_transition(g_to_e[state("G0")], state("G0"), state("E-1"))
@@ -84,17 +58,17 @@ class TestTransitions:
         assert self._has_transition(g_to_e[state("G-2")], state("G-2"), state("E-1"))
 
     def test_normalization_to_1(self):
-        trans_map = self._create_87Rb_trans()
+        trans_map = create_87Rb_trans()
 
-        e_to_g = trans_map._exc_to_gnd_trans
+        e_to_g = {es: trans_map.get_exc_to_gnd(es) for es in trans_map.excited_states}
 
         for trans in e_to_g.values():
             assert sum([t.strength for t in trans]) == 1
 
     def test_normalization_numbers(self):
-        trans_map = self._create_87Rb_trans()
+        trans_map = create_87Rb_trans()
 
-        g_to_e = trans_map._gnd_to_exc_trans
+        g_to_e = {gs: trans_map.get_gnd_to_exc(gs) for gs in trans_map.ground_states}
 
         # Transition(state("G-2"), state("E-3"), -1, 1),
         # Transition(state("G-2"), state("E-2"), 0, 1/3),
@@ -130,3 +104,115 @@ class TestTransitions:
         assert self._get_transition(g_to_e, state("G2"), state("E1")).strength == 1/15
         assert self._get_transition(g_to_e, state("G2"), state("E2")).strength == 1/3
         assert self._get_transition(g_to_e, state("G2"), state("E3")).strength == 1
+
+    def test_save_load(self, tmp_path):
+        import numpy as np
+
+        trans_map = create_87Rb_trans()
+        trans_map.save(str(tmp_path / "profile.npz"))
+        loaded = TransitionProfile.load(str(tmp_path / "profile.npz"))
+
+        assert loaded.ground_states == trans_map.ground_states
+        assert loaded.excited_states == trans_map.excited_states
+        assert loaded.frequencies == trans_map.frequencies
+        assert loaded.gamma == trans_map.gamma
+        assert np.array_equal(loaded.branching_ratio, trans_map.branching_ratio)
+
+        for gs in trans_map.ground_states:
+            assert sorted(loaded.get_gnd_to_exc(gs)) == sorted(trans_map.get_gnd_to_exc(gs))
+
+    def test_save_load_half_integer_m(self, tmp_path):
+        import numpy as np
+
+        # J = 1/2 -> J' = 1/2 without hyperfine structure (e.g. a D1 line, I = 0)
+        gs = [State("G", 1/2), State("G", -1/2)]
+        es = [State("E", 1/2), State("E", -1/2)]
+        trans_map = TransitionProfile(
+                ground_states=gs,
+                excited_states=es,
+                transitions=[Transition(g, e, group("G->E"), e.m - g.m, abs(e.m + g.m) + 1)
+                             for g in gs for e in es],
+                frequencies={
+                    group("G->E"): 377.107463380e12
+                    },
+                gamma=5.7500e6
+                )
+
+        trans_map.save(str(tmp_path / "profile.npz"))
+        loaded = TransitionProfile.load(str(tmp_path / "profile.npz"))
+
+        assert loaded.ground_states == gs
+        assert loaded.excited_states == es
+        assert np.array_equal(loaded.trans_delta_m, trans_map.trans_delta_m)
+        assert np.array_equal(loaded.branching_ratio, trans_map.branching_ratio)
+
+    def test_atomic_data(self, tmp_path):
+        import numpy as np
+        from rate_equation import atomic_data
+
+        profile = atomic_data.build_profile("87Rb D2", [2], [3])
+        reference = create_87Rb_trans()
+
+        assert np.allclose(profile.branching_ratio, reference.branching_ratio)
+        # 384.2304844685e12 + 193.7408e6 - 2.56300597908911e9 (Steck)
+        assert np.isclose(list(profile.frequencies.values())[0], 384.2304844685e12 + 193.7408e6 - 2.56300597908911e9,
+                          rtol=0, atol=1e3)
+
+        g_factors = atomic_data.g_factors("87Rb D2", [2], [3])
+        assert np.isclose(g_factors["G2"], 1/2, atol=1e-3)
+        assert np.isclose(g_factors["E3"], 2/3, atol=2e-3)
+
+        # every hyperfine group of the tabulated lines
+        for line in ["87Rb D2", "23Na D2"]:
+            profile = atomic_data.build_profile(line, [2, 1], [3, 2, 1, 0])
+            assert len(profile.groups) == 6
+            assert np.allclose(profile.branching_ratio.sum(axis=0), 1)
+
+        # Fg=2,1 -> Fe=2, as in the Atoneche example
+        profile = atomic_data.get_profile("87Rb D2", [2, 1], [2], cache_dir=str(tmp_path))
+        cached = atomic_data.get_profile("87Rb D2", (2, 1), (2,), cache_dir=str(tmp_path))
+        loaded = TransitionProfile.load(str(tmp_path / "87Rb_D2_F2-1_F2.npz"))
+
+        assert cached is profile
+        assert np.array_equal(loaded.branching_ratio, profile.branching_ratio)
+        assert np.allclose(profile.branching_ratio.sum(axis=0), 1)
+        assert np.isclose(profile.frequencies[group("G1->E2")] - profile.frequencies[group("G2->E2")],
+                          6.834682610904e9, rtol=0, atol=1e3)
+
+        # all hyperfine levels of a line with half-integer I = 7/2
+        profile = atomic_data.get_profile("133Cs D2")
+        assert [g.ground_state_hyperfine + "->" + g.excited_state_hyperfine for g in profile.groups] == \
+                ["G4->E5", "G4->E4", "G4->E3", "G3->E4", "G3->E3", "G3->E2"]
+        assert len(profile.ground_states) == 16 and len(profile.excited_states) == 32
+        assert np.allclose(profile.branching_ratio.sum(axis=0), 1)
+
+    def test_adjacency(self):
+        from rate_equation.atomic_data import build_profile
+
+        trans_map = build_profile("87Rb D2")
+
+        for n, gs in enumerate(trans_map.ground_states):
+            trans = trans_map.ground_transitions(n)
+            assert np.all(trans_map.trans_ground[trans] == n)
+            assert [trans_map.transitions[t] for t in trans] == trans_map.get_gnd_to_exc(gs)
+        assert sum(len(trans_map.ground_transitions(n)) for n in range(len(trans_map.ground_states))) == \
+            len(trans_map.transitions)
+
+        for k, es in enumerate(trans_map.excited_states):
+            trans = trans_map.excited_transitions(k)
+            assert np.all(trans_map.trans_excited[trans] == k)
+            assert np.isclose(trans_map.trans_strength[trans].sum(), 1)
+            assert all(t.excited_state == es for t in trans_map.get_exc_to_gnd(es))
+
+        with pytest.raises(AssertionError):
+            trans_map.get_gnd_to_exc(state("G7,0"))
+
+    def test_inconsistent_strength(self):
+        with pytest.raises(AssertionError, match="m=0"):
+            TransitionProfile(
+                    ground_states=[state(s) for s in ["G1", "G0", "G-1"]],
+                    excited_states=[state(s) for s in ["E1", "E0"]],
+                    transitions=[transition("G1", "E1", 1), transition("G0", "E1", 1),
+                                 transition("G0", "E0", 1), transition("G-1", "E0", 2)],
+                    frequencies={group("G->E"): 384e12},
+                    gamma=6e6)
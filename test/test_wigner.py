@@ -0,0 +1,63 @@
+import numpy as np
+
+from rate_equation.wigner import wigner_3j, wigner_6j, hyperfine_strengths
+
+# Metcalf, Appendix D: I = 3/2, J = 1/2 -> J' = 3/2 (87Rb D2), (F, F') -> {(m_g, m_e): strength},
+# strengths of one excited state to all ground levels sum up to 60
+METCALF_87RB_D2 = {
+    (2, 3): {(-2, -3): 60, (-2, -2): 20, (-2, -1): 4,
+             (-1, -2): 40, (-1, -1): 32, (-1, 0): 12,
+             (0, -1): 24, (0, 0): 36, (0, 1): 24,
+             (1, 0): 12, (1, 1): 32, (1, 2): 40,
+             (2, 1): 4, (2, 2): 20, (2, 3): 60},
+    (2, 2): {(-2, -2): 20, (-2, -1): 10,
+             (-1, -2): 10, (-1, -1): 5, (-1, 0): 15,
+             (0, -1): 15, (0, 1): 15,
+             (1, 0): 15, (1, 1): 5, (1, 2): 10,
+             (2, 1): 10, (2, 2): 20},
+    (2, 1): {(-2, -1): 6, (-1, -1): 3, (-1, 0): 3,
+             (0, -1): 1, (0, 0): 4, (0, 1): 1,
+             (1, 0): 3, (1, 1): 3, (2, 1): 6},
+    (1, 2): {(-1, -2): 30, (-1, -1): 15, (-1, 0): 5,
+             (0, -1): 15, (0, 0): 20, (0, 1): 15,
+             (1, 0): 5, (1, 1): 15, (1, 2): 30},
+    (1, 1): {(-1, -1): 25, (-1, 0): 25,
+             (0, -1): 25, (0, 1): 25,
+             (1, 0): 25, (1, 1): 25},
+    (1, 0): {(1, 0): 20, (0, 0): 20, (-1, 0): 20},
+}
+
+
+class TestWigner:
+    def test_3j(self):
+        assert np.isclose(wigner_3j(1, 1, 1, 1, -1, 0), 1 / np.sqrt(6))
+        assert np.isclose(wigner_3j(1/2, 1/2, 0, 1/2, -1/2, 0), 1 / np.sqrt(2))
+        assert np.isclose(wigner_3j(1/2, 1/2, 1, 1/2, 1/2, -1), -1 / np.sqrt(3))
+
+        # vectorized over m, forbidden combinations are zero
+        values = wigner_3j(2, 1, 3, [-2, 0, 1, 2], [-1, 0, 0, 1], [3, 0, -1, 0])
+        assert values.shape == (4,)
+        assert np.allclose(values, [1 / np.sqrt(7), -3 / np.sqrt(105), 2 * np.sqrt(2) / np.sqrt(105), 0])
+
+        # orthogonality: sum over m1, m2 of (j1 j2 j3; m1 m2 m3)^2 = 1 / (2 j3 + 1) at fixed m3
+        m1, m2 = np.meshgrid(np.arange(-2, 3), np.arange(-1, 2))
+        assert np.isclose(np.sum(wigner_3j(2, 1, 2, m1, m2, -1) ** 2), 1 / 5)
+
+    def test_6j(self):
+        assert np.isclose(wigner_6j(1, 1, 1, 1, 1, 1), 1 / 6)
+        assert np.isclose(wigner_6j(2, 2, 2, 2, 2, 2), -3 / 70)
+        assert np.isclose(wigner_6j(1/2, 1/2, 1, 1/2, 1/2, 0), 1 / 2)
+        assert wigner_6j(1, 1, 3, 1, 1, 1) == 0  # violates the triangle condition
+
+    def test_metcalf_tables(self):
+        for (f_g, f_e), table in METCALF_87RB_D2.items():
+            strengths = hyperfine_strengths(3/2, 1/2, 3/2, f_g, f_e)
+
+            assert set(strengths) == set(table)
+            for m, strength in table.items():
+                assert np.isclose(strengths[m] * 60, strength)
+
+        hyperfine_strengths.cache_clear()
+        hyperfine_strengths(3/2, 1/2, 3/2, 2, 3)
+        hyperfine_strengths(3/2, 1/2, 3/2, 2, 3)
+        assert hyperfine_strengths.cache_info().hits == 1